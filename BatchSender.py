@@ -0,0 +1,133 @@
+import socket # For sending packets straight from the socket
+import struct # For building the segment size control message
+
+# The socket option level and option for UDP segmentation offload (GSO). Not
+# every version of Python names them, but Linux has used these values since
+# UDP GSO was added in 4.18
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+
+# The most packets the kernel will split a single send into
+MAXSEGMENTS = 64
+
+# The largest amount of data a single UDP send can carry
+MAXPAYLOAD = 65507
+
+class BatchSender(object):
+    """
+    Sends bursts of packets to a Client with as few system calls as possible.
+    Where the kernel supports UDP segmentation offload (GSO), runs of packets
+    of the same size are handed to the kernel in one sendmsg() call, along
+    with the size of each packet, and the kernel splits them back up into
+    separate datagrams. Elsewhere, or if the kernel refuses a batch, packets
+    are sent one at a time through the transport, as before.
+    """
+
+    def __init__(self, transport, sock):
+        """
+        Initializes a BatchSender sending through the given transport.
+
+        :type transport: asyncio.DatagramTransport
+        :param transport: the transport of the Server socket
+
+        :type sock: UDP socket
+        :param sock: the non-blocking socket underneath the transport. The
+                     transport only hands out a restricted view of it, so it
+                     has to be given separately.
+        """
+
+        # Sends single packets, and anything that could not be batched
+        self.transport = transport
+
+        # The socket underneath the transport, used for batched sends
+        self.socket = sock
+
+        # Set to False the first time the kernel refuses a batch, so it is
+        # not asked again
+        self.gso = hasattr(sock, 'sendmsg')
+    # End of constructor()
+
+    def send(self, packets, address):
+        """
+        Sends every given packet to the given address, batching them where
+        possible.
+
+        :type packets: list of bytes-like objects
+        :param packets: the packets to be sent, in order
+
+        :type address: (string, int) tuple
+        :param address: the address to which the packets will be sent
+        """
+        position = 0
+        while position < len(packets):
+            batch = self._nextBatch(packets, position)
+            if len(batch) == 1 or not self._sendBatch(batch, address):
+                for packet in batch:
+                    self.transport.sendto(packet, address)
+            position += len(batch)
+    # End of send()
+
+    def _nextBatch(self, packets, position):
+        """
+        Returns the packets that can be sent in one batch, starting at the
+        given position: packets of the same size, possibly followed by one
+        shorter packet, up to MAXSEGMENTS packets and MAXPAYLOAD bytes.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type packets: list of bytes-like objects
+        :param packets: the packets to be sent
+
+        :type position: int
+        :param position: the position of the first packet of the batch
+        """
+        size = len(packets[position])
+        limit = min(MAXSEGMENTS, MAXPAYLOAD // max(size, 1))
+        end = position + 1
+        while end < len(packets) and end - position < limit:
+            length = len(packets[end])
+            if length > size:
+                break
+            end += 1
+            # Only the last packet of a batch may be shorter than the others
+            if length < size:
+                break
+        return packets[position:end]
+    # End of _nextBatch()
+
+    def _sendBatch(self, batch, address):
+        """
+        Sends a batch of packets in a single system call using UDP GSO.
+        Returns True if the batch was sent, False if it has to be sent one
+        packet at a time instead.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type batch: list of bytes-like objects
+        :param batch: the packets to be sent, all of the same size except
+                      possibly the last
+
+        :type address: (string, int) tuple
+        :param address: the address to which the packets will be sent
+        """
+        # Packets still queued in the transport have to go out first
+        if not self.gso or self.transport.get_write_buffer_size() > 0:
+            return False
+
+        segment = struct.pack('=H', len(batch[0]))
+        try:
+            self.socket.sendmsg(batch, [(SOL_UDP, UDP_SEGMENT, segment)], 0,
+                                address)
+        except BlockingIOError:
+            return False
+        except OSError as error:
+            print("UDP GSO not available, sending packets one at a time: %s"
+                  % error)
+            self.gso = False
+            return False
+        return True
+    # End of _sendBatch()
+
+# End of BatchSender class
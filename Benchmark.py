@@ -0,0 +1,665 @@
+#
+# Measures how fast files are transferred, and how fast the parts of the
+# transfer that run for every packet are, so the numbers can be compared
+# between commits.
+#
+# "run" transfers files of each given size with each given packet size and
+# window size from a Server to a Client, each in a process of its own on this
+# machine, and times the parts of SlidingWindow and the integrity checks that
+# run for every packet. The results are written as JSON. "compare" reads the
+# results of two runs and reports what got slower.
+#
+
+import argparse # For reading what to measure from the command line
+import asyncio # For running the Server in its process
+import contextlib # For hiding what is printed for every packet
+import filecmp # For checking every transfer saved the file it was sent
+import io # For writing the files transferred and the results
+import json # For writing and reading the results
+import multiprocessing # For running the Server and the Client apart
+import os # For the files transferred
+import platform # For recording what the results were measured on
+import resource # For the CPU time and peak memory of each process
+import statistics # For the median of repeated measurements
+import subprocess # For recording the commit the results were measured at
+import sys # For the exit status of "compare"
+import tempfile # For the files saved by the Client
+import time # For timing
+
+import SlidingWindow as window
+import Integrity
+import WireFormat
+
+# The number of bytes ru_maxrss is counted in, which is kilobytes everywhere
+# but macOS
+MAXRSSUNIT = 1 if sys.platform == 'darwin' else 1024
+
+# The address the Server listens on during transfers
+ADDRESS = "127.0.0.1"
+
+# The number of bytes written at a time to the files transferred
+CHUNKSIZE = 1024 * 1024
+
+# The name under files/ of the file of each size transferred, made before the
+# transfers and deleted after them
+FILENAME = "benchmark-%d.bin"
+
+# The Server and every Client are started as fresh interpreters rather than
+# forked, so their peak memory is their own
+PROCESSES = multiprocessing.get_context('spawn')
+
+# A transfer is given up on after this many seconds, plus one second for
+# every megabyte of the file
+TIMEOUT = 60
+
+# The number of packets each microbenchmark runs over
+MICROPACKETS = 20000
+
+# The defaults of "run"
+SIZES = "64K,1M,16M"
+PACKETSIZES = "1024,1472,8972"
+WINDOWSIZES = "64,256"
+REPEAT = 3
+
+# A result of "compare" that is this many percent worse is reported as a
+# regression
+THRESHOLD = 10.0
+
+# The metric compared for each benchmark, and whether larger is better
+KEYMETRICS = {
+    'transfer': ('goodputMBps', True),
+}
+MICROMETRIC = ('usPerCall', False)
+
+def parseSize(text):
+    """
+    Returns the number of bytes given by a size such as 512, 64K, 16M or 1G.
+
+    :type text: string
+    :param text: the size
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+# End of parseSize()
+
+def usage():
+    """
+    Returns the CPU time used by this process so far, in seconds, and the
+    most memory it has held at once, in bytes, as a tuple.
+    """
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    return (used.ru_utime + used.ru_stime, used.ru_maxrss * MAXRSSUNIT)
+# End of usage()
+
+def makeFile(path, size):
+    """
+    Writes a file of the given size full of random bytes, so compression
+    never changes what is measured.
+
+    :type path: string
+    :param path: the path to the file
+
+    :type size: int
+    :param size: the number of bytes in the file
+    """
+    with io.open(path, 'wb') as newFile:
+        while size > 0:
+            newFile.write(os.urandom(min(size, CHUNKSIZE)))
+            size -= CHUNKSIZE
+# End of makeFile()
+
+def _serve(windowSize, cacheBudget, connection):
+    """
+    Runs a Server with the given window size in this process, until told to
+    stop over the connection. Sends back the port number it listens on, then
+    answers every "usage" it is sent with its usage().
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    sys.stdout = open(os.devnull, 'w')
+    import Server
+    Server.WINDOWSIZE = windowSize
+
+    async def serveUntilStopped():
+        server = Server.Server(ADDRESS, 0, cacheBudget=cacheBudget)
+        await server.start()
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+
+        def answer():
+            if connection.recv() == "usage":
+                connection.send(usage())
+            elif not stopped.done():
+                stopped.set_result(None)
+
+        loop.add_reader(connection.fileno(), answer)
+        connection.send(server.transport.get_extra_info('sockname')[1])
+        try:
+            await stopped
+        finally:
+            loop.remove_reader(connection.fileno())
+            server.close()
+
+    asyncio.run(serveUntilStopped())
+# End of _serve()
+
+def _download(port, name, dest, packetSize, windowSize, connection):
+    """
+    Downloads a file in this process, with the given window size, and sends
+    back how long that took, its usage() before and after and the counters of
+    the download, or the error that stopped it.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    sys.stdout = open(os.devnull, 'w')
+    import Client
+    import Metrics
+    Client.WINDOWSIZE = windowSize
+    Client.BITMAPSIZE = (windowSize + 7) // 8
+    metrics = Metrics.Metrics()
+    before = usage()
+    start = time.perf_counter()
+    try:
+        Client.downloadSync(ADDRESS, port, name, dest, packetSize=packetSize,
+                            metrics=metrics)
+    except Exception as error:
+        connection.send(repr(error))
+        return
+    connection.send((time.perf_counter() - start, before, usage(),
+                     metrics.counters))
+# End of _download()
+
+def _ask(connection, message, timeout):
+    """
+    Sends a message to a process and returns its answer. Raises TimeoutError
+    if it does not answer in time.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    if not message == None:
+        connection.send(message)
+    if not connection.poll(timeout):
+        raise TimeoutError("No answer after %d seconds" % timeout)
+    return connection.recv()
+# End of _ask()
+
+def transfer(port, serverConnection, name, size, packetSize, windowSize):
+    """
+    Transfers a file once from the Server to a new Client process, checks it
+    was saved as it was sent, and returns how long it took, along with the
+    CPU time and peak memory of each side, as a dict. The peak memory of the
+    Server is the most it has held since it was started.
+
+    :type port: int
+    :param port: the port number of the Server
+
+    :type serverConnection: multiprocessing.connection.Connection
+    :param serverConnection: the connection to the Server process
+
+    :type name: string
+    :param name: the name of the file under files/
+
+    :type size: int
+    :param size: the size of the file
+
+    :type packetSize: int
+    :param packetSize: the size of file packets asked for
+
+    :type windowSize: int
+    :param windowSize: the number of packets in the Client's window
+    """
+    timeout = TIMEOUT + size / (1024 * 1024)
+    with tempfile.TemporaryDirectory() as directory:
+        dest = os.path.join(directory, name)
+        (resultConnection, clientConnection) = PROCESSES.Pipe()
+        serverBefore = _ask(serverConnection, "usage", timeout)
+        client = PROCESSES.Process(
+            target=_download,
+            args=(port, name, dest, packetSize, windowSize,
+                  clientConnection))
+        client.start()
+        try:
+            result = _ask(resultConnection, None, timeout)
+        finally:
+            client.join(1)
+            if client.is_alive():
+                client.terminate()
+        serverAfter = _ask(serverConnection, "usage", timeout)
+
+        if isinstance(result, str):
+            raise RuntimeError("Transfer of %s failed: %s" % (name, result))
+        if not filecmp.cmp(dest, os.path.join("files", name), shallow=False):
+            raise RuntimeError("Transfer of %s saved a different file" % name)
+
+    (seconds, clientBefore, clientAfter, counters) = result
+    return {
+        'seconds': seconds,
+        'packets': counters.get('filePackets', 0),
+        'duplicates': counters.get('duplicates', 0),
+        'clientCpu': clientAfter[0] - clientBefore[0],
+        'serverCpu': serverAfter[0] - serverBefore[0],
+        'clientPeak': clientAfter[1],
+        'serverPeak': serverAfter[1],
+    }
+# End of transfer()
+
+def benchmarkTransfers(sizes, packetSizes, windowSizes, repeat, cacheBudget,
+                       report):
+    """
+    Transfers a file of every given size, with every given packet size and
+    window size, repeat times each, and returns a result for each
+    combination. Each result holds the median over the repeats of the
+    goodput (file bytes saved per second), the file packets received per
+    second, the duplicates received and the CPU time per megabyte on each
+    side, and the peak memory of each side. Every Client runs in a process
+    of its own, and a new Server is started for each combination, so the
+    peak memory of the Server is the most it held during the transfers of
+    that combination alone.
+
+    :type sizes: list of int
+    :param sizes: the sizes of the files transferred
+
+    :type packetSizes: list of int
+    :param packetSizes: the sizes of file packets asked for
+
+    :type windowSizes: list of int
+    :param windowSizes: the numbers of packets in the windows of the Server
+                        and the Client
+
+    :type repeat: int
+    :param repeat: the number of times each transfer is repeated
+
+    :type cacheBudget: int
+    :param cacheBudget: the budget of the Server's packet cache, 0 for none
+
+    :type report: function
+    :param report: called with each result as it is measured
+    """
+    names = {}
+    for size in sizes:
+        names[size] = FILENAME % size
+        makeFile(os.path.join("files", names[size]), size)
+
+    results = []
+    try:
+        for windowSize in windowSizes:
+            for size in sizes:
+                for packetSize in packetSizes:
+                    runs = _transferRepeatedly(
+                        windowSize, cacheBudget, names[size], size,
+                        packetSize, repeat)
+                    result = _summarize(runs, size, packetSize, windowSize)
+                    report(result)
+                    results.append(result)
+    finally:
+        for name in names.values():
+            os.remove(os.path.join("files", name))
+    return results
+# End of benchmarkTransfers()
+
+def _transferRepeatedly(windowSize, cacheBudget, name, size, packetSize,
+                        repeat):
+    """
+    Starts a Server process, transfers a file from it repeat times, then
+    stops it, and returns the result of each transfer().
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    (serverConnection, connection) = PROCESSES.Pipe()
+    server = PROCESSES.Process(
+        target=_serve, args=(windowSize, cacheBudget, connection))
+    server.start()
+    try:
+        port = _ask(serverConnection, None, TIMEOUT)
+        return [transfer(port, serverConnection, name, size, packetSize,
+                         windowSize)
+                for i in range(repeat)]
+    finally:
+        serverConnection.send("stop")
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+# End of _transferRepeatedly()
+
+def _summarize(runs, size, packetSize, windowSize):
+    """
+    Returns the result of repeated transfers of one combination.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    megabytes = size / (1024 * 1024)
+    packets = statistics.median(run['packets'] for run in runs)
+    seconds = statistics.median(run['seconds'] for run in runs)
+    return {
+        'benchmark': 'transfer',
+        'params': {'size': size, 'packetSize': packetSize,
+                   'windowSize': windowSize},
+        'metrics': {
+            'seconds': seconds,
+            'minSeconds': min(run['seconds'] for run in runs),
+            'goodputMBps': megabytes / seconds,
+            'packetsPerSecond': packets / seconds,
+            'duplicates': statistics.median(
+                run['duplicates'] for run in runs),
+            'clientCpuPerMB': statistics.median(
+                run['clientCpu'] for run in runs) / megabytes,
+            'serverCpuPerMB': statistics.median(
+                run['serverCpu'] for run in runs) / megabytes,
+            'clientPeakMB': max(run['clientPeak'] for run in runs) / 2 ** 20,
+            'serverPeakMB': max(run['serverPeak'] for run in runs) / 2 ** 20,
+        },
+    }
+# End of _summarize()
+
+def _microResult(name, params, calls, seconds):
+    """
+    Returns the result of a microbenchmark that made the given number of
+    calls in the given number of seconds.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    return {
+        'benchmark': name,
+        'params': params,
+        'metrics': {'calls': calls, 'seconds': seconds,
+                    'usPerCall': seconds * 1e6 / calls},
+    }
+# End of _microResult()
+
+def benchmarkWindow(packetSize, windowSize, report):
+    """
+    Times the SlidingWindow methods run for every packet, over a file of
+    MICROPACKETS packets, and returns a result for each:
+    slideServer() after the first packet is acknowledged, getPackets() on a
+    full window, saveBytes() with packets arriving in order, which includes
+    sliding the window past each of them, and slideClient() on its own after
+    the first packet is marked as received.
+
+    :type packetSize: int
+    :param packetSize: the size of the packets
+
+    :type windowSize: int
+    :param windowSize: the number of packets in the windows
+
+    :type report: function
+    :param report: called with each result as it is measured
+    """
+    params = {'packetSize': packetSize, 'windowSize': windowSize}
+    tagSize = Integrity.CHECKSUMS[Integrity.PREFERENCE[0]].size
+    wireFormat = WireFormat.FORMATS[WireFormat.VERSION]
+    dataSize = packetSize - wireFormat.headerSize - tagSize
+    size = dataSize * MICROPACKETS
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory, \
+         contextlib.redirect_stdout(io.StringIO()):
+        source = os.path.join(directory, "source")
+        makeFile(source, size)
+
+        def serverWindow():
+            return window.SlidingWindow(
+                source, packetSize=packetSize, mode='Server',
+                windowSize=windowSize, tagSize=tagSize,
+                wireFormat=wireFormat)
+
+        # Every packet is acknowledged in turn, and the window slides past it
+        server = serverWindow()
+        seconds = 0.0
+        packets = []
+        while not server.isDone():
+            packets.append(bytes(server.buffer.packet(0)))
+            server.buffer.mark(0)
+            start = time.perf_counter()
+            server.slideServer()
+            seconds += time.perf_counter() - start
+        server.close()
+        results.append(_microResult('slideServer', params, len(packets),
+                                    seconds))
+
+        # The window never slides, so every call returns it whole
+        server = serverWindow()
+        start = time.perf_counter()
+        for i in range(MICROPACKETS):
+            server.getPackets()
+        seconds = time.perf_counter() - start
+        server.close()
+        results.append(_microResult('getPackets', params, MICROPACKETS,
+                                    seconds))
+
+        def clientWindow(name):
+            return window.SlidingWindow(
+                os.path.join(directory, name), packetSize=packetSize,
+                mode='Client', fileSize=size, windowSize=windowSize,
+                tagSize=tagSize, wireFormat=wireFormat)
+
+        # The packets sent above arrive in order, and the window slides past
+        # each one as it is saved
+        client = clientWindow("dest")
+        start = time.perf_counter()
+        for packet in packets:
+            client.saveBytes(packet)
+        seconds = time.perf_counter() - start
+        client.close()
+        results.append(_microResult('saveBytes', params, len(packets),
+                                    seconds))
+
+        # Every packet is marked as received in turn, without being saved,
+        # and the window slides past it
+        client = clientWindow("marked")
+        seconds = 0.0
+        for i in range(len(packets)):
+            client.buffer.mark(0)
+            start = time.perf_counter()
+            client.slideClient()
+            seconds += time.perf_counter() - start
+        client.close()
+        results.append(_microResult('slideClient', params, len(packets),
+                                    seconds))
+
+    for result in results:
+        report(result)
+    return results
+# End of benchmarkWindow()
+
+def benchmarkHashes(packetSize, report):
+    """
+    Times the original SHA-224 calculateHash() of the Server, and the
+    calculation of every integrity check available, over packets of the
+    given size, and returns a result for each.
+
+    :type packetSize: int
+    :param packetSize: the size of the packets
+
+    :type report: function
+    :param report: called with each result as it is measured
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        import Server
+        server = Server.Server(ADDRESS, 0)
+    packet = bytearray(os.urandom(packetSize))
+    params = {'packetSize': packetSize}
+
+    results = []
+    start = time.perf_counter()
+    for i in range(MICROPACKETS):
+        server.calculateHash(packet)
+    results.append(_microResult('calculateHash', params, MICROPACKETS,
+                                time.perf_counter() - start))
+
+    headerSize = WireFormat.FORMATS[WireFormat.VERSION].headerSize
+    for code in sorted(Integrity.CHECKSUMS):
+        checksum = Integrity.CHECKSUMS[code]
+        start = time.perf_counter()
+        for i in range(MICROPACKETS):
+            checksum.calculate(packet, headerSize)
+        results.append(_microResult(
+            'checksum', dict(params, checksum=checksum.name), MICROPACKETS,
+            time.perf_counter() - start))
+
+    for result in results:
+        report(result)
+    return results
+# End of benchmarkHashes()
+
+def _commit():
+    """
+    Returns the commit the code being measured is at, or None if it is not
+    in a git repository.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+# End of _commit()
+
+def _describe(result):
+    """
+    Returns a line describing a result, for following a run as it goes.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    params = " ".join("%s=%s" % item for item in result['params'].items())
+    metrics = " ".join("%s=%.4g" % item for item in result['metrics'].items())
+    return "%s %s: %s" % (result['benchmark'], params, metrics)
+# End of _describe()
+
+def run(arguments):
+    """
+    Runs the benchmarks asked for on the command line, and writes the results.
+
+    :type arguments: argparse.Namespace
+    :param arguments: the command line
+    """
+    packetSizes = [parseSize(size)
+                   for size in arguments.packet_sizes.split(",")]
+    windowSizes = [int(size) for size in arguments.windows.split(",")]
+    report = lambda result: print(_describe(result), file=sys.stderr)
+
+    results = []
+    if not arguments.transfers_only:
+        for packetSize in packetSizes:
+            for windowSize in windowSizes:
+                results.extend(benchmarkWindow(packetSize, windowSize, report))
+            results.extend(benchmarkHashes(packetSize, report))
+    if not arguments.micro_only:
+        sizes = [parseSize(size) for size in arguments.sizes.split(",")]
+        results.extend(benchmarkTransfers(
+            sizes, packetSizes, windowSizes, arguments.repeat,
+            arguments.cache_budget, report))
+
+    document = {
+        'commit': _commit(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    if arguments.output == None:
+        json.dump(document, sys.stdout, indent=1)
+        print()
+    else:
+        with io.open(arguments.output, 'w') as output:
+            json.dump(document, output, indent=1)
+# End of run()
+
+def compare(arguments):
+    """
+    Compares the key metric of every benchmark measured in both of two
+    results files, and returns the number of regressions: results at least
+    threshold percent worse in the newer file.
+
+    :type arguments: argparse.Namespace
+    :param arguments: the command line
+    """
+    documents = []
+    for path in (arguments.old, arguments.new):
+        with io.open(path) as resultsFile:
+            documents.append(json.load(resultsFile))
+    (old, new) = [
+        {(result['benchmark'], json.dumps(result['params'], sort_keys=True)):
+         result['metrics'] for result in document['results']}
+        for document in documents]
+    print("Comparing %s with %s" % (documents[0]['commit'],
+                                    documents[1]['commit']))
+
+    regressions = 0
+    for key in old:
+        if not key in new:
+            continue
+        (metric, largerIsBetter) = KEYMETRICS.get(key[0], MICROMETRIC)
+        (before, after) = (old[key][metric], new[key][metric])
+        if before == 0:
+            continue
+        change = (after - before) * 100.0 / before
+        worse = -change if largerIsBetter else change
+        flag = ""
+        if worse >= arguments.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%s %s %s: %.4g -> %.4g (%+.1f%%)%s" %
+              (key[0], key[1], metric, before, after, change, flag))
+    return regressions
+# End of compare()
+
+if __name__ == "__main__":
+    # Files are served from files/ next to this script
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(
+        description="Measures file transfers and the code run for every "
+                    "packet, or compares two sets of results.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    runParser = commands.add_parser(
+        "run", help="run the benchmarks and write their results as JSON")
+    runParser.add_argument("--sizes", default=SIZES,
+                           help="sizes of the files transferred, such as "
+                                "64K,1M,1G")
+    runParser.add_argument("--packet-sizes", default=PACKETSIZES,
+                           help="sizes of file packets")
+    runParser.add_argument("--windows", default=WINDOWSIZES,
+                           help="numbers of packets in the windows of the "
+                                "Server and the Client")
+    runParser.add_argument("--repeat", type=int, default=REPEAT,
+                           help="number of times each transfer is repeated")
+    runParser.add_argument("--cache-budget", type=int, default=0,
+                           help="bytes of the Server's packet cache, none by "
+                                "default so every transfer reads the file")
+    runParser.add_argument("--output", default=None,
+                           help="file the results are written to, instead "
+                                "of the standard output")
+    only = runParser.add_mutually_exclusive_group()
+    only.add_argument("--micro-only", action="store_true",
+                      help="only time the code run for every packet")
+    only.add_argument("--transfers-only", action="store_true",
+                      help="only time file transfers")
+
+    compareParser = commands.add_parser(
+        "compare", help="compare two results files")
+    compareParser.add_argument("old", help="the results to compare against")
+    compareParser.add_argument("new", help="the results being checked")
+    compareParser.add_argument("--threshold", type=float, default=THRESHOLD,
+                               help="percent worse that counts as a "
+                                    "regression")
+
+    arguments = parser.parse_args()
+    if arguments.command == "run":
+        run(arguments)
+    else:
+        sys.exit(1 if compare(arguments) > 0 else 0)
@@ -1,34 +1,81 @@
-# 
+#
 # Author: Frank Derry Wanye
 # Author: Gloire Rubambiza
 # Date: 12/03/2016
 #
+# Downloads files from the Server. Can be run as a script, which asks which
+# files to download, or imported, in which case download() fetches a file
+# from an event loop, with any number of downloads running at the same time,
+# and downloadSync() does the same without one.
+#
 
 import SlidingWindow as window
-import socket
+import Integrity
+import Compression
+import Delta
+import Metrics
+import Trace
+import WireFormat
+from WireFormat import FNAME, FSIZE, FREADYACK, FPACKET, FSACK
+from WireFormat import FRESUME, FRANGE, FPROBE, FZPACKET, FPARITY
+from WireFormat import FDELTA, FSIG, FWAIT
+from Journal import Journal
+import asyncio
 import hashlib
-from threading import Thread
+import os
+import socket
+import sys
+
+# The number of times the Server will try to send a packet before it gives up
+NUMTRIES = 5
 
-###############################################################################
-# Defining the codes that identify messages
-###############################################################################
-# Packet containing file name
-FNAME = (1).to_bytes(1, byteorder='big')
+# The number of packets in the sliding window, must be at least as large as
+# the Server's sliding window
+WINDOWSIZE = 256
 
-# Packet containing file size
-FSIZE = (2).to_bytes(1, byteorder='big')
+# The number of bytes in the bitmap of a selective acknowledgement, with one
+# bit per packet in the sliding window
+BITMAPSIZE = (WINDOWSIZE + 7) // 8
 
-# Packet signifying that the Client is ready to receive file
-FREADYACK = (3).to_bytes(1, byteorder='big')
+# An acknowledgement is sent once this many packets have been saved...
+ACKEVERY = 8
 
-# Packet containing bytes of file
-FPACKET = (4).to_bytes(1, byteorder='big')
+# ...or this many seconds after the first packet it acknowledges was saved
+ACKDELAY = 0.01
 
-# Packet containing file acknowledgement
-FILEACK = (5).to_bytes(1, byteorder='big')
+# The number of seconds without a packet after which the connection is assumed
+# to be broken
+TIMEOUT = 2.0
 
-# The number of times the Server will try to send a packet before it gives up
-NUMTRIES = 5
+# The number of seconds after which an unanswered file request is sent again
+REQUESTTIMEOUT = 1.0
+
+# The size of file packets when no other size can be agreed on
+PACKETSIZE = 1024
+
+# The largest file packet asked for, filling a 9000 byte jumbo frame less the
+# IP and UDP headers
+MAXPACKETSIZE = 8972
+
+# The packet sizes probed for, largest first: jumbo frames, and Ethernet
+# frames without and with tunnel overhead
+PROBESIZES = [MAXPACKETSIZE, 4068, 1472, 1392]
+
+# The number of seconds to wait for probes to be echoed by the Server
+PROBETIMEOUT = 0.5
+
+# Linux socket options for sending packets without fragmenting them, and for
+# reading the path MTU, which not every version of Python names
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+
+# The bytes taken up by the IP and UDP headers
+UDPHEADERSIZE = 28
+
+# The size asked for the receive buffer of the Client socket, so a window of
+# large packets is not dropped. The system may grant less
+SOCKETBUFFERSIZE = 4 * 1024 * 1024
 
 print("Flags: %s %s %s %s" % (FNAME[0], FSIZE[0], FREADYACK[0], FPACKET[0]))
 
@@ -57,12 +104,13 @@ def getHash(packet, start=10):
     return hashStr
 # End of getHash()
         
+
 def calculateHash(packet):
     """
     Calculates the hash of the given packet, assuming that the bytes 
     containing the hash are already zeroed out.
     
-    :type packet: a list of bytes | bytes object
+    :type packet: a list of bytes | bytes-like object
     :param packet: the packet to be hashed
     
     :return type: string
@@ -72,228 +120,1022 @@ def calculateHash(packet):
         print("Error: no packet given")
         return ""
     
-    packetBytes = bytes(packet)
-    #packetStr = packetBytes.decode("UTF-8")
-    hashStr = hashlib.sha224(packetBytes).hexdigest()
+    # Lists have to be converted, other bytes-like objects are hashed as-is
+    if isinstance(packet, list):
+        packet = bytes(packet)
+    hashStr = hashlib.sha224(packet).hexdigest()
     return hashStr
 # End of calculateHash()
 
-def compareHash(packet, start=10):
+def compareHash(packet, start=10, checksum=None, verbose=True):
     """
     Compares the hash included in the packet with the calculated 
     value of what the hash is supposed to be. Returns True if 
     they are the same, False if they are not, or there is an 
-    error in the function parameters.
+    error in the function parameters. The packet is checked in place,
+    without being copied.
     
-    :type packet: list of bytes
+    :type packet: bytes-like object
     :param packet: the packet containing a hash
     
     :type start: int
     :param start: the position from which the hash function starts
+
+    :type checksum: Integrity.Checksum
+    :param checksum: the integrity check used by the packet. Defaults to
+                     the SHA-224 hash used by the handshake.
+
+    :type verbose: bool
+    :param verbose: prints why the packet failed the check
     """
+    if checksum == None:
+        checksum = Integrity.CHECKSUMS[Integrity.SHA224]
+
     if packet == None:
         print("Error: no packet given")
         return False
         
-    if len(packet) < (start + 56):
-        print("Error: packet not long enough to contain hash function")
+    if len(packet) < (start + checksum.size):
+        if verbose:
+            print("Error: packet not long enough to contain hash function")
         return False
-        
-    hashStr = getHash(packet, start)
-    
-    # Convert bytes object to list - bytes object cannot be edited
-    packetList = []
-    packetList.extend(packet)
-    
-    # Zero out hash in packet
-    for i in range(56):
-        packetList[i + start] = 0
-    
-    calcHash = calculateHash(packetList)
-    
-    if hashStr == calcHash:
+
+    if checksum.verify(packet, start):
         return True
     else:
-        print("Incorrect hash in packet. Given %s, calculated %s" %
-              (hashStr, calcHash))
+        if verbose:
+            print("Incorrect %s in packet. Given %s, calculated %s" %
+                  (checksum.name, bytes(packet[start:(start + checksum.size)]),
+                   checksum.calculate(packet, start)))
         return False
 # End of compareHash()
 
-def recvFilePacket(clientSocket, counter):
+class ClientSession(asyncio.DatagramProtocol):
     """
-    Receives a file packet from the Client. Compares the hash of the file and
-    passes it on to be saved if it meets all requirements.
-    
-    :type clientSocket: UDP socket
-    :param clientSocket: the socket on which the Client receives/sends packets
-    
-    :type counter: int
-    :param counter: keeps track of how many times the wrong packet has been
-                    received from the Server.
-                    
-    :return type: (list, int) tuple 
-    :return param: the packet converted to list format, and the index of the
-                   packet.
+    A single download from the Server, on a socket of its own. The session
+    requests the file, builds a sliding window in Client mode once the
+    Server answers with the size of the file, and saves the file packets it
+    receives, acknowledging them a few at a time. Every step is driven by the
+    event loop, so any number of sessions can run at the same time.
+    Progress is kept in a Journal next to the file, so a download that breaks
+    off resumes from where it stopped the next time the file is requested.
+    The outcome of the download is set on the finished future: the size of
+    the file once it has been saved, or an exception if the download failed.
     """
-    (packet, address) = clientSocket.recvfrom(1024)
-    
-    if compareHash(packet, start=10):
-        if packet[0] == FPACKET[0]:
-            index = (int).from_bytes(packet[1:10], byteorder='big')
+
+    def __init__(self, remoteName, dest, finished, part=None, parts=1,
+                 packetSize=None, compression=Compression.NONE, level=0,
+                 fecGroup=0, delta=False, metrics=None, trace=None,
+                 verbose=False):
+        """
+        Initializes a ClientSession. The file is requested once the session's
+        socket has been created.
+
+        :type remoteName: string
+        :param remoteName: the name of the file to be downloaded from the
+                           Server
+
+        :type dest: string
+        :param dest: the path the file is saved to
+
+        :type finished: asyncio.Future
+        :param finished: gets the outcome of the download
+
+        :type part: int
+        :param part: the part of the file to be downloaded, if the file is
+                     split into parts downloaded by separate sessions. The
+                     Server decides which range of bytes each part covers.
+
+        :type parts: int
+        :param parts: the number of parts the file is split into
+
+        :type packetSize: int
+        :param packetSize: the size of file packets to ask the Server for. By
+                           default, the largest size that gets through without
+                           being fragmented is probed for first.
+
+        :type compression: int
+        :param compression: the code of the codec the Server is asked to
+                            compress file packets with, Compression.NONE for
+                            none
+
+        :type level: int
+        :param level: the level the Server is asked to compress at, 0 for the
+                      codec's default
+
+        :type fecGroup: int
+        :param fecGroup: the number of file packets the Server is asked to
+                         protect with each parity packet, 0 for none
+
+        :type delta: bool
+        :param delta: asks the Server for only the changes from the copy of
+                      the file already saved at dest, if there is one and it
+                      is not a partly received file
+
+        :type metrics: Metrics.Metrics
+        :param metrics: counts what happens during the download. Shared by
+                        every session of a download over several streams.
+
+        :type trace: Trace.Tracer
+        :param trace: records what happens to every packet of the download,
+                      if given. Shared by every session of a download over
+                      several streams.
+
+        :type verbose: bool
+        :param verbose: prints every packet received and acknowledged
+        """
+
+        # The name of the file on the Server, and where it is saved
+        self.remoteName = remoteName
+        self.dest = dest
+
+        # Gets the outcome of the download
+        self.finished = finished
+
+        # The part of the file downloaded by this session
+        self.part = part
+        self.parts = parts
+
+        # The compression asked for, and the codec chosen by the Server
+        self.compression = compression
+        self.level = level
+        self.codec = None
+
+        # The parity asked for, and the number of packets each parity packet
+        # protects, as chosen by the Server
+        self.fecGroup = fecGroup
+        self.fecChosen = 0
+
+        # The size of file packets asked for, None until probed
+        self.packetSize = packetSize
+
+        # The largest probe echoed by the Server so far, and the probe sizes
+        self.probed = 0
+        self.probeSizes = []
+
+        # One of 'Probe', 'Handshake', 'Transfer' or 'Done'
+        self.state = 'Probe' if packetSize == None else 'Handshake'
+
+        # Set once the socket is created
+        self.transport = None
+        self.loop = None
+
+        # The integrity check chosen by the Server for file packets
+        self.checksum = None
+
+        # The format of the header of file packets and acknowledgements, and
+        # the id of the transfer written into it, chosen by the Server
+        self.wireFormat = None
+        self.sessionId = 0
+
+        # The size of the file, sent by the Server
+        self.fileSize = None
+
+        # The sliding window the file is saved through
+        self.client = None
+
+        # Records how much of the file is on disk, and what an earlier
+        # download of it left behind, as a (fileSize, offset) tuple
+        self.journal = Journal(dest, part)
+        self.resume = self.journal.load()
+
+        # Whether the changes from the old copy at dest are asked for, where
+        # they are saved, and the size of the file they rebuild. The delta is
+        # not journalled, as the old copy stays as it is until it is rebuilt
+        self.delta = (delta and part == None and self.resume == None and
+                      os.path.exists(dest))
+        self.deltaPath = dest + Delta.EXTENSION
+        self.targetSize = None
+
+        # The packets holding the signatures of the old copy, sent before the
+        # delta request
+        self.signaturePackets = []
+
+        # The packets sent during the handshake, kept so they can be resent,
+        # the number of times they have been sent, and when the file request
+        # was first sent
+        self.filenamePacket = None
+        self.readyPacket = None
+        self.numTries = 0
+        self.requestSentTime = None
+
+        # Whether the Server asked the Client to wait while it built a delta
+        self.waited = False
+
+        # Counts what happens during the download
+        self.metrics = Metrics.Metrics() if metrics == None else metrics
+
+        # Records what happens to every packet, None if not traced
+        self.trace = trace
+
+        # Whether what happens to each packet is printed
+        self.verbose = verbose
+
+        # The number of packets saved but not acknowledged yet
+        self.pendingAcks = 0
+
+        # The time at which the last packet was received from the Server
+        self.lastReceived = 0.0
+
+        # Sends the file request again, or checks for a broken connection
+        self.timer = None
+
+        # Sends held back acknowledgements
+        self.ackTimer = None
+
+        # Reused buffer that selective acknowledgements are built in, with
+        # room for the largest header and hash
+        self.sackBuffer = bytearray(
+            WireFormat.BinaryFormat.HEADER.size + 56 + BITMAPSIZE)
+        self.sackView = memoryview(self.sackBuffer)
+    # End of constructor()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.lastReceived = self.loop.time()
+        sock = transport.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKETBUFFERSIZE)
+        if self.state == 'Probe':
+            self.sendProbes()
+        else:
+            self.sendFileRequest()
+    # End of connection_made()
+
+    def datagram_received(self, packet, addr):
+        self.lastReceived = self.loop.time()
+        self.metrics.count('packetsReceived')
+        self.metrics.count('bytesReceived', len(packet))
+
+        if self.state == 'Probe':
+            self.recvProbe(packet)
+        elif self.state == 'Handshake':
+            if packet[0] == FWAIT[0]:
+                self.recvWait(packet)
+            else:
+                self.recvFileSize(packet)
+        elif self.state == 'Transfer':
+            self.recvFilePacket(packet)
+    # End of datagram_received()
+
+    def error_received(self, exc):
+        print("Error on client socket: %s" % exc)
+    # End of error_received()
+
+    def connection_lost(self, exc):
+        if not self.state == 'Done':
+            self.fail(ConnectionError("Client socket closed: %s" % exc))
+    # End of connection_lost()
+
+    def sendProbes(self):
+        """
+        Sends the Server a probe of every packet size that might get through
+        without being fragmented, with fragmentation turned off, all at once.
+        The Server echoes back every probe it receives. Sizes larger than the
+        path MTU known to the kernel are left out.
+        """
+        sock = self.transport.get_extra_info('socket')
+        upper = MAXPACKETSIZE
+        if sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER,
+                                IP_PMTUDISC_PROBE)
+                mtu = sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+                upper = min(upper, mtu - UDPHEADERSIZE)
+            except OSError:
+                pass
+
+        self.probeSizes = sorted(
+            set([size for size in PROBESIZES if size <= upper] +
+                [max(upper, PACKETSIZE)]), reverse=True)
+        for size in self.probeSizes:
+            probe = bytearray(size)
+            probe[0] = FPROBE[0]
+            probe[1:57] = calculateHash(probe).encode("ISO-8859-1")
+            self.transport.sendto(probe)
+        print("Probing for packet sizes: %s" % self.probeSizes)
+        self.timer = self.loop.call_later(PROBETIMEOUT, self.endProbe)
+    # End of sendProbes()
+
+    def recvProbe(self, probe):
+        """
+        Receives a probe echoed by the Server, which shows that packets of
+        its size get through. Stops probing once the largest probe is back.
+
+        :type probe: bytes
+        :param probe: the packet received from the Server
+        """
+        if not (probe[0] == FPROBE[0] and compareHash(probe, 1)):
+            return
+
+        self.probed = max(self.probed, len(probe))
+        if self.probed == self.probeSizes[0]:
+            self.endProbe()
+    # End of recvProbe()
+
+    def endProbe(self):
+        """
+        Settles on the largest packet size that got through, or the default
+        size if no probe came back, and requests the file.
+        """
+        self.timer.cancel()
+        self.packetSize = max(self.probed, PACKETSIZE)
+        print("Asking for %d byte packets" % self.packetSize)
+        self.state = 'Handshake'
+        self.sendFileRequest()
+    # End of endProbe()
+
+    def sendFileRequest(self):
+        """
+        Sends the name of the requested file to the Server, along with the
+        integrity checks offered for file packets, the packet size asked for,
+        the newest version of the header known here, the compression asked for
+        and the parity asked for, and sends it again if the Server does not
+        answer in time. If part of the file was received before, the Server is
+        asked to resume from there instead. If only the changes from the old
+        copy of the file are asked for, the signatures of its blocks are sent
+        first.
+        """
+        if self.numTries == NUMTRIES:
+            self.fail(TimeoutError(
+                "Could not receive file name acknowledgement from Server"))
+            return
+        if self.numTries > 0 and not self.trace == None:
+            self.trace.record(Trace.TIMEOUT, self.filenamePacket[0], 0, 0,
+                              self.numTries)
+
+        if self.filenamePacket == None:
+            filenameBytes = self.remoteName.encode("UTF-8")
+            filenameBuffer = []
+            if not self.part == None:
+                filenameBuffer.extend(FRANGE)
+            elif self.delta:
+                filenameBuffer.extend(FDELTA)
+            elif self.resume == None:
+                filenameBuffer.extend(FNAME)
+            else:
+                filenameBuffer.extend(FRESUME)
+            filenameBuffer.extend([0]*56)
+            filenameBuffer.extend(
+                (len(filenameBytes)).to_bytes(9, byteorder='big'))
+            filenameBuffer.extend(filenameBytes)
+            # Offer the Server every integrity check available for file
+            # packets
+            offer = Integrity.encodeOffer()
+            filenameBuffer.extend(offer)
+            # Followed by the packet size asked for, the version of the
+            # header, the compression and parity asked for, the part asked
+            # for, and the progress of the earlier download, if resuming
+            progress = []
+            progress.extend(self.packetSize.to_bytes(9, byteorder='big'))
+            progress.append(WireFormat.VERSION)
+            progress.extend([self.compression, self.level, self.fecGroup])
+            if self.delta:
+                progress.extend(self._buildSignatures())
+            if not self.part == None:
+                progress.extend(self.part.to_bytes(9, byteorder='big'))
+                progress.extend(self.parts.to_bytes(9, byteorder='big'))
+            if not self.resume == None:
+                (fileSize, offset) = self.resume
+                progress.extend(fileSize.to_bytes(9, byteorder='big'))
+                progress.extend(offset.to_bytes(9, byteorder='big'))
+            elif not self.part == None:
+                progress.extend([0]*18)
+            filenameBuffer.extend(progress)
+            filenameBuffer.extend(
+                [0]*(1024-10-56-len(filenameBytes)-len(offer)-len(progress)))
+            hashBytes = calculateHash(filenameBuffer).encode("ISO-8859-1")
+            for i in range(56):
+                filenameBuffer[1 + i] = hashBytes[i]
+            self.filenamePacket = bytes(filenameBuffer)
+
+        for packet in self.signaturePackets:
+            self.transport.sendto(packet)
+        self.transport.sendto(self.filenamePacket)
+        if self.numTries == 0:
+            self.requestSentTime = self.loop.time()
+        self.numTries += 1
+        print("Waiting for file request acknowledgement...")
+        self.timer = self.loop.call_later(REQUESTTIMEOUT,
+                                          self.sendFileRequest)
+    # End of sendFileRequest()
+
+    def _buildSignatures(self):
+        """
+        Builds the packets holding the signatures of the blocks of the old
+        copy of the file, each of them signed like the file request, and
+        returns the fields of the delta request: the size of the blocks and
+        the number of packets the signatures are sent in.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        blockSize = Delta.blockSizeFor(os.path.getsize(self.dest))
+        signatures = Delta.signatures(self.dest, blockSize)
+        # Type, hash, number of the packet and number of packets come first
+        perPacket = (self.packetSize - 75) // Delta.SIGNATURESIZE
+        perPacket = max(1, perPacket) * Delta.SIGNATURESIZE
+        chunks = (len(signatures) + perPacket - 1) // perPacket
+
+        self.signaturePackets = []
+        for chunk in range(chunks):
+            packet = []
+            packet.extend(FSIG)
+            packet.extend([0]*56)
+            packet.extend(chunk.to_bytes(9, byteorder='big'))
+            packet.extend(chunks.to_bytes(9, byteorder='big'))
+            packet.extend(
+                signatures[(chunk * perPacket):((chunk + 1) * perPacket)])
+            hashBytes = calculateHash(packet).encode("ISO-8859-1")
+            for i in range(56):
+                packet[1 + i] = hashBytes[i]
+            self.signaturePackets.append(bytes(packet))
+        print("Asking for the changes from the old copy, in %d byte blocks" %
+              blockSize)
+
+        fields = []
+        fields.extend(blockSize.to_bytes(9, byteorder='big'))
+        fields.extend(chunks.to_bytes(9, byteorder='big'))
+        return fields
+    # End of _buildSignatures()
+
+    def recvWait(self, packet):
+        """
+        Receives the Server's answer to a delta request while it is still
+        building the delta, and keeps asking for it without giving up.
+
+        :type packet: bytes
+        :param packet: the packet received from the Server
+        """
+        if not compareHash(packet, 1):
+            return
+        if not self.waited:
+            print("Waiting for the Server to build the delta...")
+        self.waited = True
+        self.numTries = 0
+        self.metrics.count('waits')
+    # End of recvWait()
+
+    def recvFileSize(self, acknowledgement):
+        """
+        Receives the file request acknowledgement from the Server, holding
+        the size of the file, the integrity check chosen for it, the format
+        of the header of file packets and the compression and parity chosen
+        for them. Builds the
+        sliding window the file is saved through, and tells the Server that
+        the Client is ready to receive the file.
+
+        :type acknowledgement: bytes
+        :param acknowledgement: the packet received from the Server
+        """
+        if not (acknowledgement[0] == FSIZE[0] and
+                compareHash(acknowledgement, 1)):
+            return
+
+        self.timer.cancel()
+        # The round trip time is only known if the request was sent once, and
+        # answered straight away
+        if self.numTries == 1 and not self.waited:
+            self.metrics.observe('rtt',
+                                 self.loop.time() - self.requestSentTime)
+        self.fileSize = int.from_bytes(
+            acknowledgement[57:66], byteorder='big')
+        # The integrity check chosen by the Server follows the fileSize,
+        # unless the Server predates the negotiation
+        if len(acknowledgement) > 66:
+            self.checksum = Integrity.CHECKSUMS[acknowledgement[66]]
+        else:
+            self.checksum = Integrity.CHECKSUMS[Integrity.SHA224]
+        # Followed by the packet size chosen by the Server, unless the Server
+        # predates the negotiation
+        position = 67
+        packetSize = PACKETSIZE
+        if len(acknowledgement) >= position + 9:
+            packetSize = int.from_bytes(
+                acknowledgement[position:(position + 9)], byteorder='big')
+            position += 9
+        # Followed by the version of the header chosen by the Server, and the
+        # id of the transfer if the header holds it, unless the Server
+        # predates the negotiation
+        version = WireFormat.LEGACY
+        if len(acknowledgement) > position:
+            version = acknowledgement[position]
+            position += 1
+        self.wireFormat = WireFormat.choose(version)
+        if (self.wireFormat.version >= WireFormat.BINARY and
+            len(acknowledgement) >= position + 4):
+            self.sessionId = int.from_bytes(
+                acknowledgement[position:(position + 4)], byteorder='big')
+            position += 4
+        # Followed by the codec chosen by the Server and its level, if
+        # compression was asked for. The Server may refuse it
+        if not self.compression == Compression.NONE:
+            if len(acknowledgement) >= position + 2:
+                self.codec = Compression.CODECS.get(acknowledgement[position])
+                level = acknowledgement[position + 1]
+            position += 2
+        # Followed by the number of packets protected by each parity packet,
+        # if parity was asked for
+        if self.fecGroup > 0:
+            if len(acknowledgement) > position:
+                self.fecChosen = acknowledgement[position]
+            position += 1
+        # Followed by where the transfer resumes from, if resuming. The
+        # Server starts over if the file changed since the earlier download.
+        # A part also starts there, and ends where the Server says it does
+        startOffset = 0
+        endOffset = None
+        if ((not self.resume == None or not self.part == None) and
+            len(acknowledgement) >= position + 9):
+            startOffset = int.from_bytes(
+                acknowledgement[position:(position + 9)], byteorder='big')
+        if not self.part == None:
+            if len(acknowledgement) < position + 18:
+                self.fail(ConnectionError(
+                    "Server cannot send parts of a file"))
+                return
+            endOffset = int.from_bytes(
+                acknowledgement[(position + 9):(position + 18)],
+                byteorder='big')
+            print("Downloading bytes %d to %d" % (startOffset, endOffset))
+        # Followed by the size of the file the delta rebuilds, if a delta was
+        # asked for
+        savePath = self.dest
+        if self.delta:
+            if len(acknowledgement) < position + 9:
+                self.fail(ConnectionError(
+                    "Server cannot send the changes to a file"))
+                return
+            self.targetSize = int.from_bytes(
+                acknowledgement[position:(position + 9)], byteorder='big')
+            savePath = self.deltaPath
+            print("Receiving a %d byte delta of a %d byte file" %
+                  (self.fileSize, self.targetSize))
+        print("Filesize: %d bytes" % self.fileSize)
+        print("Using %s to check packets" % self.checksum.name)
+        print("Using %d byte packets" % packetSize)
+        print("Using version %d headers" % self.wireFormat.version)
+        if not self.codec == None:
+            print("Server compresses packets with %s at level %d" %
+                  (self.codec.name, level))
+        if self.fecChosen > 0:
+            print("Server sends a parity packet every %d packets" %
+                  self.fecChosen)
+        if startOffset > 0:
+            print("Resuming from byte %d" % startOffset)
+
+        #######################################################################
+        # Build sliding window, start receiving file
+        #######################################################################
+        self.client = window.SlidingWindow(
+            savePath, packetSize=packetSize, mode='Client',
+            fileSize=self.fileSize, windowSize=WINDOWSIZE,
+            tagSize=self.checksum.size, startOffset=startOffset,
+            endOffset=endOffset, wireFormat=self.wireFormat,
+            sessionId=self.sessionId, codec=self.codec,
+            fecGroup=self.fecChosen, trace=self.trace, verbose=self.verbose)
+        if not self.delta:
+            self.journal.save(self.fileSize, startOffset)
+
+        # Send same acknowledgement back to server to let it know that it can
+        # start sending file
+        ack = []
+        ack.extend(acknowledgement)
+        ack[0] = FREADYACK[0]
+        # Zero out the hash
+        for i in range(56):
+            ack[i + 1] = 0
+        hashBytes = calculateHash(ack).encode("ISO-8859-1")
+        # Append new hash to packet
+        for i in range(56):
+            ack[i + 1] = hashBytes[i]
+        self.readyPacket = bytes(ack)
+
+        # Send acknowledgment back to Server, this time with the file ready
+        # flag. It is sent again whenever the fileSize packet comes in again.
+        self.transport.sendto(self.readyPacket)
+        self.state = 'Transfer'
+        self.numTries = 0
+        if self.client.isDone():
+            print("Done receiving file.")
+            self.finish()
+            return
+        self.timer = self.loop.call_later(TIMEOUT, self.checkBroken)
+    # End of recvFileSize()
+
+    def recvFilePacket(self, data):
+        """
+        Receives a file packet from the Server. Compares the hash of the
+        packet and saves it if it meets all requirements. Acknowledgements are
+        held back until ACKEVERY packets have been saved or ACKDELAY seconds
+        have passed, then sent all at once. Parity packets are handed to the
+        sliding window, and a packet recovered from one is acknowledged
+        straight away, before the Server decides it was lost.
+
+        :type data: bytes
+        :param data: the packet received from the Server
+        """
+        headerSize = self.wireFormat.headerSize
+        if not compareHash(data, headerSize, self.checksum, self.verbose):
+            # If it is not a file packet, the ready acknowledgement was lost
+            if data[0] == FSIZE[0]:
+                if self.numTries == NUMTRIES:
+                    self.fail(TimeoutError(
+                        "Could not receive file packet from Server."))
+                    return
+                self.transport.sendto(self.readyPacket)
+                self.numTries += 1
+            else:
+                if self.verbose:
+                    print("Received a corrupted packet")
+                self.metrics.count('hashFailures')
+                if not self.trace == None:
+                    self.trace.record(Trace.CORRUPT, data[0], self.sessionId,
+                                      0, len(data))
+            return
+
+        (packetType, sessionId, index, length) = self.wireFormat.unpack(data)
+        if not (packetType == FPACKET[0] or packetType == FZPACKET[0] or
+                packetType == FPARITY[0]):
+            if self.verbose:
+                print("Received a packet that isn't a file packet.")
+            return
+
+        if not sessionId == self.sessionId:
+            if self.verbose:
+                print("Received a packet from an earlier transfer.")
+            self.metrics.count('stalePackets')
+            return
+
+        self.numTries = 0
+        recovered = self.client.recovered
+        if packetType == FPARITY[0]:
+            if self.verbose:
+                print("Received parity of packets from %d" % index)
+            self.metrics.count('parityPackets')
+            if not self.trace == None:
+                self.trace.record(Trace.PARITY, packetType, sessionId, index,
+                                  len(data))
+            bytesSent = self.client.saveParity(data)
+            if not bytesSent == -1:
+                self.metrics.count('recovered')
+                self.sendSelectiveAcknowledgement()
+            if bytesSent == "Done":
+                print("Done receiving file.")
+                self.finish()
+            return
+
+        if self.verbose:
             print("Received file packet %d" % index)
-            packetarr = []
-            packetarr.extend(packet)
-            packetarr[0] = (0).to_bytes(1, byteorder='big')[0]
-            return (packetarr, index)
+        self.metrics.count('filePackets')
+        if packetType == FZPACKET[0]:
+            self.metrics.count('compressedPackets')
+        if not self.trace == None:
+            self.trace.record(Trace.RECEIVE, packetType, sessionId, index,
+                              len(data))
+
+        bytesSent = self.client.saveBytes(data)
+        if not self.client.recovered == recovered:
+            self.metrics.count('recovered', self.client.recovered - recovered)
+        if bytesSent == -2:
+            # A duplicate means an acknowledgement was lost, so it is
+            # acknowledged straight away
+            self.metrics.count('duplicates')
+            if not self.trace == None:
+                self.trace.record(Trace.DUPLICATE, packetType, sessionId,
+                                  index, len(data))
+            self.sendSelectiveAcknowledgement()
+        elif bytesSent == -1:
+            self.metrics.count('packetsDropped')
         else:
-            print("Received a packet that isn't a file packet.")
-            numFailed += 1
-            return ([], -1)
-    else:
-        print("Received a corrupted packet from %s" % address[0])
-        return ([], -1)
-# End of recvFilePacket()
+            self.pendingAcks += 1
+            if self.pendingAcks >= ACKEVERY or bytesSent == "Done":
+                self.sendSelectiveAcknowledgement()
+                if self.verbose:
+                    print("Sent acknowledgement after packet %d" % index)
+            elif self.pendingAcks == 1:
+                self.ackTimer = self.loop.call_later(
+                    ACKDELAY, self.sendDelayedAcknowledgement)
+
+        if bytesSent == "Done":
+            print("Done receiving file.")
+            self.finish()
+    # End of recvFilePacket()
+
+    def sendSelectiveAcknowledgement(self):
+        """
+        Sends an acknowledgement of every packet saved so far, including the
+        calculated hash value: the index of the first byte not yet received,
+        followed by a bitmap of the packets received after it. The index is
+        recorded in the journal as well.
+        """
+        if not self.ackTimer == None:
+            self.ackTimer.cancel()
+            self.ackTimer = None
+        self.pendingAcks = 0
 
-def sendFileAcknowledgement(clientSocket, packet, host, port):
+        (cumulative, bitmap) = self.client.getAckState()
+        headerSize = self.wireFormat.headerSize
+        bitmapStart = headerSize + self.checksum.size
+        sack = self.sackView[:(bitmapStart + BITMAPSIZE)]
+        self.wireFormat.pack(sack, FSACK[0], self.sessionId, cumulative,
+                             BITMAPSIZE)
+        sack[bitmapStart:] = bitmap.to_bytes(BITMAPSIZE, byteorder='little')
+        self.checksum.sign(sack, headerSize)
+        self.transport.sendto(sack)
+        self.metrics.count('acksSent')
+        if not self.trace == None:
+            self.trace.record(Trace.ACK, FSACK[0], self.sessionId, cumulative,
+                              len(sack))
+        if not self.delta:
+            self.journal.save(self.fileSize, cumulative)
+    # End of sendSelectiveAcknowledgement()
+
+    def sendDelayedAcknowledgement(self):
+        """
+        Sends the acknowledgements held back for ACKDELAY seconds.
+        """
+        self.ackTimer = None
+        if self.pendingAcks > 0 and self.state == 'Transfer':
+            if self.verbose:
+                print("Sent delayed acknowledgement of %d packets" %
+                      self.pendingAcks)
+            self.metrics.count('delayedAcks')
+            self.sendSelectiveAcknowledgement()
+    # End of sendDelayedAcknowledgement()
+
+    def checkBroken(self):
+        """
+        Fails the download if nothing has been received from the Server in
+        TIMEOUT seconds, and checks again later otherwise.
+        """
+        silence = self.loop.time() - self.lastReceived
+        if silence >= TIMEOUT:
+            if not self.trace == None:
+                self.trace.record(Trace.TIMEOUT, 0, self.sessionId,
+                                  self.client.start, 0)
+            self.fail(TimeoutError(
+                "Socket timed out, connection assumed to be broken."))
+            return
+        self.timer = self.loop.call_later(TIMEOUT - silence, self.checkBroken)
+    # End of checkBroken()
+
+    def finish(self):
+        """
+        Ends the session after the whole file has been saved. A delta is
+        applied to the old copy of the file first.
+        """
+        self._close()
+        self.journal.remove()
+        self.metrics.count('bytesSaved', self.client.fileSize -
+                           self.client.origin)
+        fileSize = self.fileSize
+        if self.delta:
+            try:
+                fileSize = Delta.apply(self.deltaPath, self.dest)
+            except (ValueError, OSError) as error:
+                self.fail(ValueError("Could not apply delta: %s" % error))
+                return
+        if not self.finished.done():
+            self.finished.set_result(fileSize)
+    # End of finish()
+
+    def fail(self, exc):
+        """
+        Ends the session without saving the whole file.
+
+        :type exc: Exception
+        :param exc: the reason the download failed
+        """
+        print(exc)
+        self._close()
+        # What led up to the failure is kept, even if the trace is never
+        # closed
+        if not self.trace == None:
+            self.trace.flush()
+        if not self.finished.done():
+            self.finished.set_exception(exc)
+    # End of fail()
+
+    def _close(self):
+        """
+        Cancels the timers of the session, and closes its file, journal and
+        socket.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        self.state = 'Done'
+        if not self.timer == None:
+            self.timer.cancel()
+        if not self.ackTimer == None:
+            self.ackTimer.cancel()
+        if not self.client == None:
+            self.client.close()
+        self.journal.close()
+        if not self.transport == None:
+            self.transport.close()
+    # End of _close()
+
+# End of ClientSession class
+
+async def download(host, port, remoteName, dest, streams=1, packetSize=None,
+                   compression=Compression.NONE, level=0, fecGroup=0,
+                   delta=False, metrics=None, trace=None, verbose=False):
     """
-    Sends the acknowledgement for a saved packet, including the calculated 
-    hash value.
-    
-    :type clientSocket: UDP socket
-    :param clientSocket: the socket on which the Client receives/sends packets
-    
-    :type packet: list of bytes
-    :param packet: the packet that is being acknowledged 
-    
-    :type host: string 
-    :param host: the hostname to which the acknowledgement will be sent 
-    
+    Downloads a file from the Server and saves it. Returns the size of the
+    file once it has been saved. Raises TimeoutError if the Server stops
+    answering, in which case the file is left incomplete, and downloading it
+    again to the same path resumes from where it stopped.
+    Any number of downloads can run at the same time on one event loop.
+
+    :type host: string
+    :param host: the address of the Server
+
     :type port: int
-    :param port: the port number on the host to which the packet will be 
-                 passed
+    :param port: the port number the Server listens on
+
+    :type remoteName: string
+    :param remoteName: the name of the file to be downloaded from the Server
+
+    :type dest: string
+    :param dest: the path the file is saved to
+
+    :type streams: int
+    :param streams: the number of sessions the file is downloaded over. With
+                    more than one, the file is split into that many parts,
+                    each downloaded on a socket of its own and written
+                    straight to its place in the file.
+
+    :type packetSize: int
+    :param packetSize: the size of file packets to ask the Server for. By
+                       default, the largest size that gets through without
+                       being fragmented is probed for.
+
+    :type compression: int
+    :param compression: the code of the codec the Server is asked to compress
+                        file packets with, such as Compression.ZLIB or
+                        Compression.LZMA. Each packet is compressed on its
+                        own, and only if that makes it smaller. The Server may
+                        refuse, in which case the file is sent as it is.
+
+    :type level: int
+    :param level: the level the Server is asked to compress at, 0 for the
+                  codec's default
+
+    :type fecGroup: int
+    :param fecGroup: the number of file packets the Server is asked to
+                     protect with each parity packet, 0 for none. Any one
+                     packet lost from a group is rebuilt from the others and
+                     the parity, without waiting for it to be sent again, at
+                     the cost of one extra packet per group.
+
+    :type delta: bool
+    :param delta: if a copy of the file is already saved at dest, only the
+                  changes from it are downloaded, and the copy is rebuilt
+                  from them. If the rebuilt file does not match the Server's,
+                  the whole file is downloaded instead. Only used with a
+                  single stream.
+
+    :type metrics: Metrics.Metrics
+    :param metrics: counts what happens during the download: the packets and
+                    bytes received, duplicates, hash failures, packets
+                    recovered from parity, acknowledgements sent and the
+                    round trip time of the handshake. The seconds the
+                    download took, and its goodput, are set as gauges once it
+                    is done.
+
+    :type trace: Trace.Tracer
+    :param trace: records every packet received, every acknowledgement sent,
+                  and every slide of the window, for Trace.py to analyze once
+                  the download is over. Left for the caller to close.
+
+    :type verbose: bool
+    :param verbose: prints every packet received and acknowledged, which slows
+                    fast downloads down
     """
-    acknowledgement = []
-    acknowledgement.extend(FILEACK)
-    acknowledgement.extend(packet[1:10])
-    acknowledgement.extend([0] * 56)
-    hashBytes = calculateHash(acknowledgement).encode("ISO-8859-1")
-    for i in range(56):
-        acknowledgement[10 + i] = hashBytes[i]
-    clientSocket.sendto(bytes(acknowledgement), (host, port))
-# End of sendFileAcknowledgement()
-
-#############################################################################
-# Starting the Client socket
-#############################################################################
-
-userInput = input("What port number would you like to connect to?\n")
-port = int(userInput)
-print ("Creating connection to the server")
-clientSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-clientSocket.settimeout(2.0)
-host = input("Please specify a server IP Address:\n")
-
-#Send the file request to the server
-while 1:
-    failed = False
-    
-    ###########################################################################
-    # Send fileName of requested file to the Server
-    ###########################################################################
-    filename = input("Please enter the name of the file you want to download " +
-                     "from the Server: ")
-                     
-    dest = input("What should the file be saved as? ")
-    
-    filenameBytes = filename.encode("UTF-8")
-    filenameBuffer = []
-    filenameBuffer.extend(FNAME)
-    filenameBuffer.extend([0]*56)
-    filenameBuffer.extend((len(filenameBytes)).to_bytes(9, byteorder='big'))
-    filenameBuffer.extend(filenameBytes)
-    filenameBuffer.extend([0]*(1024-10-56-len(filenameBytes)))
-    hashBytes = calculateHash(filenameBuffer).encode("ISO-8859-1")
-    for i in range(56):
-        filenameBuffer[1 + i] = hashBytes[i]
-    filenameBuffer = bytes(filenameBuffer)
-    # Will eventually attach a checksum to this before sending, resend if
-    # acknowledgement not received within a time limit
-    clientSocket.sendto(filenameBuffer, (host, port))
-    
-    ###########################################################################
-    # Receive filename acknowledgement from the Server
-    # Acknowledgement should contain 10 bytes of fileSize
-    ###########################################################################
-    for i in range(NUMTRIES):
-        print("Waiting for file request acknowledgement...")
-        
+    if not (compression == Compression.NONE or
+            compression in Compression.CODECS):
+        raise ValueError("Compression codec %d is not available" %
+                         compression)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    fileSize = await _download(host, port, remoteName, dest, streams,
+                               packetSize, compression, level, fecGroup,
+                               delta, metrics, trace, verbose)
+    if not metrics == None:
+        seconds = loop.time() - started
+        metrics.set('seconds', seconds)
+        metrics.set('goodput', fileSize / seconds if seconds > 0 else None)
+    return fileSize
+# End of download()
+
+async def _download(host, port, remoteName, dest, streams, packetSize,
+                    compression, level, fecGroup, delta, metrics, trace,
+                    verbose):
+    """
+    Downloads a file, as download() does, once the parameters have been
+    checked.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    if streams == 1 and delta and os.path.exists(dest):
         try:
-            (acknowledgement, addr) = clientSocket.recvfrom(66)
-        except socket.timeout:
-            print("Timed out on receive, assuming connection broken")
-            failed = True
-            break
-        
-        if compareHash(acknowledgement, 1) and acknowledgement[0] == FSIZE[0]:
-            fileSize = int.from_bytes(
-                acknowledgement[57:66], byteorder='big')
-            print("Filesize: %d bytes" % fileSize)
-            break
-        
-        if i == (NUMTRIES - 1):
-            print("Could not receive file name acknowledgement from Server")
-            failed = True
-            break
-        
-        clientSocket.sendto(acknowledgement, (host, port))
-    
-    if failed:
-        continue
-    
+            return await _downloadPart(host, port, remoteName, dest,
+                                       packetSize=packetSize,
+                                       compression=compression, level=level,
+                                       fecGroup=fecGroup, delta=True,
+                                       metrics=metrics, trace=trace,
+                                       verbose=verbose)
+        except ValueError as error:
+            print("Downloading the whole file instead: %s" % error)
+
+    if streams == 1:
+        return await _downloadPart(host, port, remoteName, dest,
+                                   packetSize=packetSize,
+                                   compression=compression, level=level,
+                                   fecGroup=fecGroup, metrics=metrics,
+                                   trace=trace, verbose=verbose)
+
+    # The parts are written into the same file, which must not be truncated
+    # by any of them
+    if not os.path.exists(dest):
+        open(dest, 'wb').close()
+
+    results = await asyncio.gather(
+        *[_downloadPart(host, port, remoteName, dest, part, streams,
+                        packetSize, compression, level, fecGroup,
+                        metrics=metrics, trace=trace, verbose=verbose)
+          for part in range(streams)],
+        return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    # A file saved over a larger one keeps none of the old file's end
+    fileSize = results[0]
+    os.truncate(dest, fileSize)
+    return fileSize
+# End of _download()
+
+async def _downloadPart(host, port, remoteName, dest, part=None, parts=1,
+                        packetSize=None, compression=Compression.NONE,
+                        level=0, fecGroup=0, delta=False, metrics=None,
+                        trace=None, verbose=False):
+    """
+    Downloads a part of a file, or the whole of it, over a single session.
+    Returns the size of the file once the part has been saved.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+    (transport, session) = await loop.create_datagram_endpoint(
+        lambda: ClientSession(remoteName, dest, finished, part, parts,
+                              packetSize, compression, level, fecGroup,
+                              delta, metrics, trace, verbose),
+        remote_addr=(host, int(port)))
+    try:
+        return await finished
+    finally:
+        session._close()
+# End of _downloadPart()
+
+def downloadSync(host, port, remoteName, dest, streams=1, packetSize=None,
+                 compression=Compression.NONE, level=0, fecGroup=0,
+                 delta=False, metrics=None, trace=None, verbose=False):
+    """
+    Downloads a file from the Server and saves it, on an event loop of its
+    own. Takes the same parameters and returns the same as download().
+    Must not be called from a running event loop.
+    """
+    return asyncio.run(
+        download(host, port, remoteName, dest, streams, packetSize,
+                 compression, level, fecGroup, delta, metrics, trace,
+                 verbose))
+# End of downloadSync()
+
+if __name__ == "__main__":
     ###########################################################################
-    # Build sliding window, start receiving file
+    # Asking for the Server to download from
     ###########################################################################
-    client = window.SlidingWindow(
-        "saved/" + dest, mode='Client', fileSize=fileSize)
-        
-    # Send same acknowledgement back to server to let it know that it can
-    # start sending file
-    # Keep sending acknowledgement until server starts sending actual file
-    ack = []
-    ack.extend(acknowledgement)
-    ack[0] = FREADYACK[0]
-    # Zero out the hash
-    for i in range(56):
-        ack[i + 1] = 0
-    hashBytes = calculateHash(ack).encode("ISO-8859-1")
-    # Append new hash to packet
-    for i in range(56):
-        ack[i + 1] = hashBytes[i]
-    
-    # Send acknowledgment back to Server, this time with the file ready flag
-    clientSocket.sendto(bytes(ack), (host, port))
-    #
-    # Save file using slidingWindow
-    numFailed = 0
+    userInput = input("What port number would you like to connect to?\n")
+    port = int(userInput)
+    host = input("Please specify a server IP Address:\n")
+
     while 1:
+        #######################################################################
+        # Download each requested file into saved/
+        #######################################################################
+        filename = input("Please enter the name of the file you want to " +
+                         "download from the Server: ")
+
+        dest = input("What should the file be saved as? ")
+
         try:
-            (packetarr, index) = recvFilePacket(clientSocket, numFailed)
-        except socket.timeout:
-            print("Socket timed out, connection assumed to be broken.")
-            break
-        
-        if not packetarr == []:
-            numFailed = 0
-            bytesSent = client.saveBytes(packetarr)
-            if bytesSent != -1:
-                sendFileAcknowledgement(clientSocket, packetarr, host, port)
-                print("Sent acknowledgement of packet %d" % index)
-            if bytesSent == "Done":
-                print("Done receiving file.")
-                break;
-        else: # If it is not a file packet, send ready acknowledgement again
-            if numFailed == 5: 
-                print("Could not receive file packet from Server.")
-                break
-            clientSocket.sendto(bytes(ack), (host, port))
-            numFailed += 1
\ No newline at end of file
+            downloadSync(host, port, filename, "saved/" + dest)
+        except (TimeoutError, ConnectionError):
+            continue
@@ -0,0 +1,191 @@
+import zlib # For the zlib codec
+
+# LZMA is only offered if Python was built with it
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+###############################################################################
+# Defining the codes that identify compression codecs on the wire
+###############################################################################
+# File packets are sent as they are
+NONE = 0
+
+# Each file packet is compressed on its own with zlib (deflate)
+ZLIB = 1
+
+# Each file packet is compressed on its own with raw LZMA2
+LZMA = 2
+
+# The dictionary size used by LZMA2. Packets are compressed one at a time, so
+# a larger dictionary would never be filled, but would still be allocated by
+# the Client for every packet
+LZMADICTSIZE = 1 << 16
+
+# A packet is only sent compressed if that saves at least 1/MINSAVING of its
+# size, since the Client has to spend time decompressing it
+MINSAVING = 16
+
+# After this many packets in a row are sent as they are, the file is
+# assumed to be incompressible...
+GIVEUPAFTER = 8
+
+# ...and only every this many packets is compressed, in case that changes
+RETRYEVERY = 64
+
+def _zlibCompress(data, level):
+    """
+    Returns the given data compressed with zlib, without the zlib header.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+# End of _zlibCompress()
+
+def _zlibDecompress(data, maxLength):
+    """
+    Returns the given zlib data decompressed, up to maxLength bytes.
+    """
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    return decompressor.decompress(data, maxLength)
+# End of _zlibDecompress()
+
+def _lzmaFilters(level):
+    """
+    Returns the raw LZMA2 filter chain for the given preset level.
+    """
+    return [{'id': lzma.FILTER_LZMA2, 'preset': level,
+             'dict_size': LZMADICTSIZE}]
+# End of _lzmaFilters()
+
+def _lzmaCompress(data, level):
+    """
+    Returns the given data compressed with raw LZMA2, without the xz
+    container.
+    """
+    return lzma.compress(data, format=lzma.FORMAT_RAW,
+                         filters=_lzmaFilters(level))
+# End of _lzmaCompress()
+
+def _lzmaDecompress(data, maxLength):
+    """
+    Returns the given raw LZMA2 data decompressed, up to maxLength bytes.
+    """
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW,
+                                         filters=_lzmaFilters(0))
+    return decompressor.decompress(data, maxLength)
+# End of _lzmaDecompress()
+
+class Codec(object):
+    """
+    A compression codec for file packets. Each packet is compressed on its
+    own, so that it can be decompressed whatever order packets arrive in, and
+    whichever of them are lost.
+    """
+
+    def __init__(self, code, name, levels, defaultLevel, compress,
+                 decompress):
+        """
+        Initializes a Codec.
+
+        :type code: int
+        :param code: the code identifying the codec in the handshake
+
+        :type name: string
+        :param name: a readable name for the codec
+
+        :type levels: range
+        :param levels: the compression levels supported by the codec
+
+        :type defaultLevel: int
+        :param defaultLevel: the level used if the Client does not ask for one
+
+        :type compress: function
+        :param compress: compresses the given data at the given level
+
+        :type decompress: function
+        :param decompress: decompresses the given data, up to a maximum
+                           number of bytes
+        """
+        self.code = code
+        self.name = name
+        self.levels = levels
+        self.defaultLevel = defaultLevel
+        self.compress = compress
+        self.decompress = decompress
+    # End of constructor()
+
+    def chooseLevel(self, level):
+        """
+        Returns the level to compress at: the level asked for by the Client,
+        kept within the levels supported by the codec, or the default level if
+        the Client did not ask for one.
+
+        :type level: int
+        :param level: the level asked for by the Client, 0 if none
+        """
+        if level == 0:
+            return self.defaultLevel
+        return max(self.levels[0], min(level, self.levels[-1]))
+    # End of chooseLevel()
+
+# End of Codec class
+
+# Every codec available in this installation, by code
+CODECS = {
+    ZLIB: Codec(ZLIB, "zlib", range(1, 10), 6, _zlibCompress,
+                _zlibDecompress),
+}
+if not lzma == None:
+    CODECS[LZMA] = Codec(LZMA, "LZMA", range(1, 10), 6, _lzmaCompress,
+                         _lzmaDecompress)
+
+class Compressor(object):
+    """
+    Compresses the file packets of one transfer with the codec and level
+    negotiated for it. Keeps track of how well the file compresses, and stops
+    trying once it looks incompressible, like an image or an archive, only
+    trying again every RETRYEVERY packets.
+    """
+
+    def __init__(self, codec, level):
+        """
+        Initializes a Compressor.
+
+        :type codec: Compression.Codec
+        :param codec: the codec negotiated for the transfer
+
+        :type level: int
+        :param level: the level to compress at
+        """
+        self.codec = codec
+        self.level = level
+
+        # The number of packets in a row that were sent as they are
+        self.misses = 0
+    # End of constructor()
+
+    def compress(self, data):
+        """
+        Returns the given data compressed, or None if it is sent as it is:
+        when compressing does not make it noticeably smaller, or when the file
+        looks incompressible.
+
+        :type data: bytes-like object
+        :param data: the file data of one packet
+        """
+        if (self.misses >= GIVEUPAFTER and
+            (self.misses - GIVEUPAFTER) % RETRYEVERY != 0):
+            self.misses += 1
+            return None
+
+        compressed = self.codec.compress(data, self.level)
+        if len(compressed) > len(data) - len(data) // MINSAVING:
+            self.misses += 1
+            return None
+
+        self.misses = 0
+        return compressed
+    # End of compress()
+
+# End of Compressor class
@@ -0,0 +1,307 @@
+# The number of packets the congestion window starts out with
+INITIALWINDOW = 4
+
+# The smallest the congestion window is allowed to get
+MINWINDOW = 1
+
+# The number of packets acknowledged past an unacknowledged packet before that
+# packet is considered lost
+DUPTHRESH = 3
+
+# The retransmission timeout used before any round trip time has been measured
+INITIALRTO = 1.0
+
+# The smallest and largest the retransmission timeout is allowed to get
+MINRTO = 0.05
+MAXRTO = 60.0
+
+# The weights given to new samples in the smoothed round trip time and its
+# variation, and the number of variations added to the retransmission timeout
+ALPHA = 0.125
+BETA = 0.25
+K = 4
+
+# How far ahead of the congestion window the pacing rate is set, when it is
+# derived from the window and the round trip time: twice the window per round
+# trip in slow start, where the window doubles every round trip, and a little
+# over the window otherwise, so the pacer spreads the window out without
+# holding it back
+SLOWSTARTGAIN = 2.0
+PACINGGAIN = 1.2
+
+# The number of packets the pacer lets out back to back at most
+PACINGBURST = 4
+
+# The number of seconds a timer of the event loop can fire late by. The pacer
+# lets out enough packets at a time to make up for it, so late timers do not
+# lower the rate
+TIMERSLACK = 0.001
+
+class CongestionController(object):
+    """
+    An AIMD (additive increase, multiplicative decrease) congestion controller
+    for the Server side of the Sliding Window protocol. Keeps track of how many
+    packets the Server is allowed to have in flight, growing that number as
+    packets are acknowledged and cutting it in half when packets are lost.
+    Starts out in slow start, where the window grows by one packet per
+    acknowledgement, until the first loss is seen.
+    """
+
+    def __init__(self, maxWindow, initialWindow=INITIALWINDOW):
+        """
+        Initializes a CongestionController with the given limits.
+
+        :type maxWindow: int
+        :param maxWindow: the largest the congestion window is allowed to get,
+                          usually the size of the sliding window
+
+        :type initialWindow: int
+        :param initialWindow: the number of packets allowed in flight at first
+        """
+
+        # The largest the congestion window is allowed to get
+        self.maxWindow = maxWindow
+
+        # The number of packets allowed in flight, kept as a float so it can
+        # grow by fractions of a packet
+        self.cwnd = float(min(initialWindow, maxWindow))
+
+        # The window size at which slow start ends
+        self.ssthresh = float(maxWindow)
+
+        # Losses of packets before this index have already been reacted to
+        self.recoveryPoint = -1
+    # End of constructor()
+
+    def window(self):
+        """
+        Returns the number of packets currently allowed in flight.
+        """
+        return max(MINWINDOW, int(self.cwnd))
+    # End of window()
+
+    def inSlowStart(self):
+        """
+        Returns True if the congestion window is still in slow start.
+        """
+        return self.cwnd < self.ssthresh
+    # End of inSlowStart()
+
+    def onAck(self):
+        """
+        Grows the congestion window after a new packet has been acknowledged:
+        by one packet in slow start, or by one packet per window of
+        acknowledgements otherwise.
+        """
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, float(self.maxWindow))
+    # End of onAck()
+
+    def onLoss(self, index, highest):
+        """
+        Halves the congestion window after a packet has been lost. Only one
+        decrease is made per window of packets, so losses of packets that were
+        in flight when the window was last cut are ignored. Returns True if the
+        window was cut, False if the loss was ignored.
+
+        :type index: int
+        :param index: the index of the packet that was lost
+
+        :type highest: int
+        :param highest: the index of the last packet currently in flight
+        """
+        if index <= self.recoveryPoint:
+            return False
+
+        self.recoveryPoint = highest
+        self.ssthresh = max(float(MINWINDOW), self.cwnd / 2)
+        self.cwnd = self.ssthresh
+        return True
+    # End of onLoss()
+
+# End of CongestionController class
+
+class RttEstimator(object):
+    """
+    Estimates the round trip time between the Server and the Client from
+    samples taken as packets are acknowledged, and derives the retransmission
+    timeout from it. The smoothed round trip time (SRTT), its variation
+    (RTTVAR) and the timeout (RTO) are calculated as in RFC 6298.
+    Samples should only be taken from packets that were sent once, since the
+    acknowledgement of a resent packet could belong to any of its sends.
+    """
+
+    def __init__(self):
+        """
+        Initializes an RttEstimator with no samples taken.
+        """
+
+        # The smoothed round trip time, in seconds
+        self.srtt = None
+
+        # The variation of the round trip time, in seconds
+        self.rttvar = None
+
+        # The retransmission timeout, in seconds
+        self.rto = INITIALRTO
+    # End of constructor()
+
+    def sample(self, rtt):
+        """
+        Updates the smoothed round trip time and the retransmission timeout
+        with a newly measured round trip time.
+
+        :type rtt: float
+        :param rtt: the measured round trip time, in seconds
+        """
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = ((1 - BETA) * self.rttvar +
+                           BETA * abs(self.srtt - rtt))
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+
+        self.rto = min(MAXRTO, max(MINRTO, self.srtt + K * self.rttvar))
+    # End of sample()
+
+    def backoff(self):
+        """
+        Doubles the retransmission timeout after a timer has expired. The
+        timeout goes back to being calculated from the round trip time with the
+        next sample.
+        """
+        self.rto = min(MAXRTO, self.rto * 2)
+    # End of backoff()
+
+# End of RttEstimator class
+
+class Pacer(object):
+    """
+    A token bucket that spaces out the packets the Server sends, so the
+    congestion window goes out spread over the round trip time instead of in
+    one burst that overflows the queues of switches and the socket buffer of
+    the Client, losing the very packets that then have to be sent again.
+    Tokens are bytes, and come in at the pacing rate, measured against the
+    clock rather than counted per timer, so the rate holds however late the
+    timers fire. A packet can be sent whenever the bucket is not in debt, and
+    its size is taken out of it.
+    The rate is either fixed, or derived from the congestion window and the
+    smoothed round trip time each time packets are sent.
+    """
+
+    def __init__(self, packetSize, rate=None, burst=PACINGBURST):
+        """
+        Initializes a Pacer with a full bucket.
+
+        :type packetSize: int
+        :param packetSize: the size of the packets sent, in bytes
+
+        :type rate: float
+        :param rate: the number of bytes sent per second. By default, the
+                     rate is derived from the congestion window, see
+                     update().
+
+        :type burst: int
+        :param burst: the number of packets let out back to back at most
+        """
+        self.packetSize = packetSize
+        self.burst = burst
+
+        # The rate asked for, or None if the rate is derived
+        self.fixedRate = rate
+
+        # The current rate in bytes per second, or None if packets are not
+        # held back, as before a round trip time has been measured
+        self.rate = rate
+
+        # The number of bytes that can be sent now, below zero when in debt,
+        # and the time at which it was last topped up
+        self.tokens = float(self.capacity())
+        self.lastUpdate = None
+    # End of constructor()
+
+    def capacity(self):
+        """
+        Returns the most tokens the bucket holds: a burst of packets, or as
+        many bytes as are sent while a timer is late, whichever is larger.
+        """
+        capacity = self.burst * self.packetSize
+        if not self.rate == None:
+            capacity = max(capacity, int(self.rate * TIMERSLACK))
+        return capacity
+    # End of capacity()
+
+    def update(self, window, srtt, slowStart=False):
+        """
+        Derives the rate from the congestion window, unless the rate is
+        fixed: the window, times the gain, is sent every round trip time.
+
+        :type window: int
+        :param window: the number of packets allowed in flight
+
+        :type srtt: float
+        :param srtt: the smoothed round trip time in seconds, or None if it
+                     has not been measured yet
+
+        :type slowStart: bool
+        :param slowStart: whether the congestion window is in slow start
+        """
+        if not self.fixedRate == None:
+            return
+        if srtt == None or srtt <= 0:
+            self.rate = None
+            return
+        gain = SLOWSTARTGAIN if slowStart else PACINGGAIN
+        self.rate = gain * window * self.packetSize / srtt
+    # End of update()
+
+    def allowance(self, now):
+        """
+        Returns the number of packets that can be sent now, or None if
+        packets are not held back.
+
+        :type now: float
+        :param now: the current time, as given by the event loop
+        """
+        if self.rate == None:
+            self.lastUpdate = now
+            return None
+        if not self.lastUpdate == None:
+            self.tokens = min(float(self.capacity()), self.tokens +
+                              (now - self.lastUpdate) * self.rate)
+        self.lastUpdate = now
+        # Less than a byte of debt is left over from rounding
+        if self.tokens <= -1:
+            return 0
+        return int(max(0.0, self.tokens) // self.packetSize) + 1
+    # End of allowance()
+
+    def consume(self, size):
+        """
+        Takes the bytes of a packet that was just sent out of the bucket.
+
+        :type size: int
+        :param size: the size of the packet, in bytes
+        """
+        if not self.rate == None:
+            self.tokens -= size
+    # End of consume()
+
+    def nextSend(self, now):
+        """
+        Returns the time at which the next packet can be sent: now, unless
+        the bucket is in debt.
+
+        :type now: float
+        :param now: the current time, as given by the event loop
+        """
+        if self.rate == None or self.tokens > -1:
+            return now
+        return now - self.tokens / self.rate
+    # End of nextSend()
+
+# End of Pacer class
@@ -0,0 +1,277 @@
+import hashlib # For the strong hash of each block, and of the whole file
+import io # For reading and writing files
+import mmap # For scanning the file being sent without copying it
+import os # For replacing the old copy of the file
+import struct # For packing the instructions of a delta
+import zlib # For the weak checksum of each block
+
+###############################################################################
+# Defining the instructions a delta is made of
+###############################################################################
+# Copy a range of bytes from the Client's old copy of the file
+COPY = 1
+
+# Insert the bytes that follow
+LITERAL = 2
+
+# The layout of each instruction: its code, followed by the offset in the old
+# copy and the length for COPY, or just the length for LITERAL
+COPYINSTRUCTION = struct.Struct('!BQQ')
+LITERALINSTRUCTION = struct.Struct('!BQ')
+
+# The layout of the start of a delta: the size of the file it rebuilds, and
+# the SHA-256 digest of that file
+HEADER = struct.Struct('!Q32s')
+
+# The number of bytes of each block signature: a 4 byte weak checksum and an
+# 8 byte strong hash
+STRONGSIZE = 8
+SIGNATURESIZE = 4 + STRONGSIZE
+
+# The smallest and largest blocks the old copy is split into
+MINBLOCKSIZE = 1024
+MAXBLOCKSIZE = 128 * 1024
+
+# The modulus of the Adler-32 weak checksum
+ADLERMOD = 65521
+
+# The file name extension of a delta, kept next to the file it rebuilds on the
+# Client
+EXTENSION = ".delta"
+
+# The number of bytes read at a time when a delta is applied
+CHUNKSIZE = 1024 * 1024
+
+def blockSizeFor(fileSize):
+    """
+    Returns the size of the blocks a file of the given size is split into: the
+    square root of its size, which balances the number of signatures sent
+    against the data sent again around each change, rounded to a multiple of
+    1 KB and kept between MINBLOCKSIZE and MAXBLOCKSIZE.
+
+    :type fileSize: int
+    :param fileSize: the size of the Client's old copy of the file
+    """
+    blockSize = (int(fileSize ** 0.5) // 1024) * 1024
+    return max(MINBLOCKSIZE, min(blockSize, MAXBLOCKSIZE))
+# End of blockSizeFor()
+
+def strongHash(data):
+    """
+    Returns the strong hash of a block, as bytes.
+    """
+    return hashlib.blake2b(data, digest_size=STRONGSIZE).digest()
+# End of strongHash()
+
+def signatures(path, blockSize):
+    """
+    Returns the signatures of every whole block of the file at the given path,
+    one after the other, as bytes. Each signature is the Adler-32 checksum of
+    the block, which can be rolled along the file being sent one byte at a
+    time, followed by its strong hash.
+
+    :type path: string
+    :param path: the path to the Client's old copy of the file
+
+    :type blockSize: int
+    :param blockSize: the size of each block
+    """
+    result = bytearray()
+    with io.open(path, 'rb') as oldCopy:
+        while True:
+            block = oldCopy.read(blockSize)
+            if len(block) < blockSize:
+                break
+            result.extend(zlib.adler32(block).to_bytes(4, byteorder='big'))
+            result.extend(strongHash(block))
+    return bytes(result)
+# End of signatures()
+
+def encode(path, blockSize, signatureBytes, deltaPath):
+    """
+    Writes the delta that rebuilds the file at the given path from a Client's
+    old copy of it to deltaPath, and returns the number of bytes of the file
+    the delta copies from the old copy. The file is scanned with a rolling
+    Adler-32 checksum: wherever the checksum and then the strong hash match a
+    block of the old copy, the block is copied, and everything between
+    copied blocks is sent as it is.
+
+    :type path: string
+    :param path: the path to the file being sent
+
+    :type blockSize: int
+    :param blockSize: the size of the blocks of the old copy
+
+    :type signatureBytes: bytes-like object
+    :param signatureBytes: the signatures of the blocks of the old copy, as
+                           returned by signatures()
+
+    :type deltaPath: string
+    :param deltaPath: the path the delta is written to
+    """
+    # The blocks of the old copy, by weak checksum
+    blocks = {}
+    for i in range(len(signatureBytes) // SIGNATURESIZE):
+        signature = signatureBytes[(i * SIGNATURESIZE):
+                                   ((i + 1) * SIGNATURESIZE)]
+        weak = int.from_bytes(signature[:4], byteorder='big')
+        blocks.setdefault(weak, []).append((bytes(signature[4:]), i))
+
+    with io.open(path, 'rb') as source, io.open(deltaPath, 'wb') as delta:
+        fileSize = os.fstat(source.fileno()).st_size
+        data = b''
+        if fileSize > 0:
+            fileMap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(fileMap)
+        digest = hashlib.sha256(data).digest()
+        delta.write(HEADER.pack(fileSize, digest))
+
+        copied = 0
+        # The range of the old copy waiting to be copied, and the start of
+        # the bytes waiting to be sent as they are
+        copyStart = copyEnd = 0
+        literalStart = 0
+        position = 0
+        # The two halves of the Adler-32 checksum of the block at position,
+        # or None if it has to be calculated from scratch
+        low = high = None
+        while blocks and position + blockSize <= fileSize:
+            if low == None:
+                weak = zlib.adler32(data[position:(position + blockSize)])
+                low = weak & 0xffff
+                high = weak >> 16
+            match = None
+            candidates = blocks.get((high << 16) | low)
+            if not candidates == None:
+                strong = strongHash(data[position:(position + blockSize)])
+                for (blockStrong, index) in candidates:
+                    if blockStrong == strong:
+                        match = index
+                        break
+            if not match == None:
+                # Bytes before the block are sent as they are, and the block
+                # is copied, joined onto the copy before it if they follow on
+                if literalStart < position:
+                    _writeCopy(delta, copyStart, copyEnd)
+                    copyStart = copyEnd = 0
+                    _writeLiteral(delta, data[literalStart:position])
+                offset = match * blockSize
+                if not copyEnd == offset:
+                    _writeCopy(delta, copyStart, copyEnd)
+                    copyStart = offset
+                copyEnd = offset + blockSize
+                copied += blockSize
+                position += blockSize
+                literalStart = position
+                low = high = None
+                continue
+
+            # Roll the checksum one byte along
+            if position + blockSize < fileSize:
+                out = data[position]
+                low = (low - out + data[position + blockSize]) % ADLERMOD
+                high = (high - blockSize * out + low - 1) % ADLERMOD
+            position += 1
+
+        if literalStart < fileSize:
+            _writeCopy(delta, copyStart, copyEnd)
+            copyStart = copyEnd = 0
+            _writeLiteral(delta, data[literalStart:fileSize])
+        _writeCopy(delta, copyStart, copyEnd)
+
+        if fileSize > 0:
+            data.release()
+            fileMap.close()
+    return copied
+# End of encode()
+
+def _writeCopy(delta, start, end):
+    """
+    Writes an instruction to copy the bytes of the old copy from start up to
+    end, unless there are none.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    if end > start:
+        delta.write(COPYINSTRUCTION.pack(COPY, start, end - start))
+# End of _writeCopy()
+
+def _writeLiteral(delta, data):
+    """
+    Writes an instruction to insert the given bytes.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    delta.write(LITERALINSTRUCTION.pack(LITERAL, len(data)))
+    delta.write(data)
+# End of _writeLiteral()
+
+def apply(deltaPath, path):
+    """
+    Rebuilds the file at the given path from the old copy there and the
+    delta at deltaPath, then deletes the delta. The old copy is only
+    replaced once the rebuilt file has the size and SHA-256 digest the delta
+    says it should. Returns the size of the rebuilt file. Raises ValueError,
+    leaving the old copy in place, if the delta is malformed or the rebuilt
+    file does not match.
+
+    :type deltaPath: string
+    :param deltaPath: the path to the delta
+
+    :type path: string
+    :param path: the path to the old copy, which is replaced by the new file
+    """
+    newPath = path + ".new"
+    digest = hashlib.sha256()
+    try:
+        with io.open(deltaPath, 'rb') as delta, \
+             io.open(path, 'rb') as oldCopy, \
+             io.open(newPath, 'wb') as newCopy:
+            header = delta.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("Delta is too short")
+            (fileSize, expected) = HEADER.unpack(header)
+
+            while True:
+                code = delta.read(1)
+                if code == b'':
+                    break
+                if code[0] == COPY:
+                    fields = delta.read(COPYINSTRUCTION.size - 1)
+                    if len(fields) < COPYINSTRUCTION.size - 1:
+                        raise ValueError("Delta ends in an instruction")
+                    (_, offset, length) = COPYINSTRUCTION.unpack(code + fields)
+                    oldCopy.seek(offset)
+                    source = oldCopy
+                elif code[0] == LITERAL:
+                    fields = delta.read(LITERALINSTRUCTION.size - 1)
+                    if len(fields) < LITERALINSTRUCTION.size - 1:
+                        raise ValueError("Delta ends in an instruction")
+                    (_, length) = LITERALINSTRUCTION.unpack(code + fields)
+                    source = delta
+                else:
+                    raise ValueError("Unknown delta instruction %d" % code[0])
+                while length > 0:
+                    chunk = source.read(min(length, CHUNKSIZE))
+                    if chunk == b'':
+                        raise ValueError("Delta reaches past its data")
+                    newCopy.write(chunk)
+                    digest.update(chunk)
+                    length -= len(chunk)
+
+            if not newCopy.tell() == fileSize:
+                raise ValueError("Rebuilt file has %d bytes instead of %d" %
+                                 (newCopy.tell(), fileSize))
+        if not digest.digest() == expected:
+            raise ValueError("Rebuilt file does not match the Server's")
+    except Exception:
+        if os.path.exists(newPath):
+            os.remove(newPath)
+        raise
+
+    os.replace(newPath, path)
+    os.remove(deltaPath)
+    return fileSize
+# End of apply()
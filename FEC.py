@@ -0,0 +1,131 @@
+# The largest number of file packets protected by a single parity packet
+MAXGROUPSIZE = 16
+
+# The smallest group worth sending parity for
+MINGROUPSIZE = 2
+
+class ParityGroup(object):
+    """
+    A group of consecutive file packets protected by one parity packet: the
+    XOR of the data of every packet in the group, each padded with zeros to
+    the length of the longest, along with the XOR of their lengths. The Server
+    adds each packet to the group as it fills it into its window, and sends
+    the parity once the group is complete. The Client adds each packet it
+    receives, and the parity, and once it has the parity and all but one
+    packet, the XOR of everything it has is the missing packet, so the packet
+    is recovered without waiting for it to be sent again.
+    The XOR is kept as a single integer, so each packet is folded in with one
+    operation on the whole of its data.
+    """
+
+    def __init__(self, first, count):
+        """
+        Initializes a ParityGroup.
+
+        :type first: int
+        :param first: the index of the first byte of the first packet in the
+                      group
+
+        :type count: int
+        :param count: the number of file packets in the group
+        """
+        self.first = first
+        self.count = count
+
+        # The indexes of the packets added so far
+        self.members = set()
+
+        # Whether the parity has been added
+        self.hasParity = False
+
+        # The XOR of the data added so far, as a little-endian integer, so
+        # shorter data is padded with zeros at its end
+        self.parity = 0
+
+        # The length of the longest data added so far
+        self.length = 0
+
+        # The XOR of the lengths of the data added so far
+        self.lengths = 0
+    # End of constructor()
+
+    def add(self, index, data):
+        """
+        Folds the data of a file packet into the group.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+
+        :type data: bytes-like object
+        :param data: the data of the packet, as sent
+        """
+        self.members.add(index)
+        self._fold(data, len(data))
+    # End of add()
+
+    def addParity(self, data, lengths):
+        """
+        Folds the parity of the group into it.
+
+        :type data: bytes-like object
+        :param data: the data of the parity packet
+
+        :type lengths: int
+        :param lengths: the XOR of the lengths of every packet in the group
+        """
+        self.hasParity = True
+        self._fold(data, lengths)
+    # End of addParity()
+
+    def _fold(self, data, length):
+        """
+        XORs the given data and length into the group.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        self.parity ^= int.from_bytes(data, byteorder='little')
+        self.length = max(self.length, len(data))
+        self.lengths ^= length
+    # End of _fold()
+
+    def isComplete(self):
+        """
+        Returns True once every file packet of the group has been added.
+        """
+        return len(self.members) == self.count
+    # End of isComplete()
+
+    def canRecover(self):
+        """
+        Returns True if the parity and all but one of the file packets have
+        been added, so the missing packet can be recovered.
+        """
+        return self.hasParity and len(self.members) == self.count - 1
+    # End of canRecover()
+
+    def parityData(self):
+        """
+        Returns the data of the parity packet of a complete group.
+        """
+        return self.parity.to_bytes(self.length, byteorder='little')
+    # End of parityData()
+
+    def recover(self, dataSize):
+        """
+        Returns the missing file packet of the group as an (index, data)
+        tuple. Only meaningful once canRecover() is True.
+
+        :type dataSize: int
+        :param dataSize: the number of bytes of the file between the starts of
+                         consecutive packets
+        """
+        for i in range(self.count):
+            index = self.first + i * dataSize
+            if not index in self.members:
+                break
+        data = self.parity.to_bytes(self.length, byteorder='little')
+        return (index, data[:self.lengths])
+    # End of recover()
+
+# End of ParityGroup class
@@ -0,0 +1,200 @@
+import hashlib # For the SHA-224 and BLAKE2b digests
+import zlib # For the CRC32 checksum
+
+# CRC32C is only offered if the crc32c package is installed
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+###############################################################################
+# Defining the codes that identify integrity checks on the wire
+###############################################################################
+# 56 byte hex string of the SHA-224 digest, the original integrity check
+SHA224 = 0
+
+# 4 byte CRC32 checksum
+CRC32 = 1
+
+# 4 byte CRC32C (Castagnoli) checksum
+CRC32C = 2
+
+# 8 byte BLAKE2b digest
+BLAKE2B8 = 3
+
+# 16 byte BLAKE2b digest
+BLAKE2B16 = 4
+
+# Placeholder for the SHA-224 hash while the hash of a packet is calculated
+ZEROHASH = bytes(56)
+
+def _sha224(head, tail):
+    """
+    Returns the hex string of the SHA-224 digest of the packet, with the hash
+    zeroed out, as the original protocol calculated it.
+    """
+    digest = hashlib.sha224(head)
+    digest.update(ZEROHASH)
+    digest.update(tail)
+    return digest.hexdigest().encode("ISO-8859-1")
+# End of _sha224()
+
+def _crc32(head, tail):
+    """
+    Returns the CRC32 checksum of the packet, leaving out the checksum itself.
+    """
+    return zlib.crc32(tail, zlib.crc32(head)).to_bytes(4, byteorder='big')
+# End of _crc32()
+
+def _crc32c(head, tail):
+    """
+    Returns the CRC32C checksum of the packet, leaving out the checksum itself.
+    """
+    value = crc32c.crc32c(tail, crc32c.crc32c(head))
+    return value.to_bytes(4, byteorder='big')
+# End of _crc32c()
+
+def _blake2b(size):
+    """
+    Returns a function that calculates the BLAKE2b digest of a packet,
+    truncated to size bytes, leaving out the digest itself.
+    """
+    def calculate(head, tail):
+        digest = hashlib.blake2b(head, digest_size=size)
+        digest.update(tail)
+        return digest.digest()
+    return calculate
+# End of _blake2b()
+
+class Checksum(object):
+    """
+    An integrity check for packets. The check is stored in the packet itself,
+    as a tag of a fixed size at a given position, and is calculated over the
+    rest of the packet through memoryviews, so the packet is never copied.
+    """
+
+    def __init__(self, code, name, size, function):
+        """
+        Initializes a Checksum.
+
+        :type code: int
+        :param code: the code identifying the check in the handshake
+
+        :type name: string
+        :param name: a readable name for the check
+
+        :type size: int
+        :param size: the number of bytes taken up by the tag in each packet
+
+        :type function: function
+        :param function: calculates the tag from the bytes of the packet before
+                         and after it, given as two memoryviews
+        """
+        self.code = code
+        self.name = name
+        self.size = size
+        self.function = function
+    # End of constructor()
+
+    def calculate(self, packet, start):
+        """
+        Returns the tag for the given packet, as bytes.
+
+        :type packet: bytes-like object
+        :param packet: the packet to be checked
+
+        :type start: int
+        :param start: the position of the tag in the packet
+        """
+        view = memoryview(packet)
+        return self.function(view[:start], view[(start + self.size):])
+    # End of calculate()
+
+    def sign(self, packet, start):
+        """
+        Calculates the tag for the given packet and writes it into the packet.
+
+        :type packet: writable bytes-like object
+        :param packet: the packet to be signed
+
+        :type start: int
+        :param start: the position of the tag in the packet
+        """
+        packet[start:(start + self.size)] = self.calculate(packet, start)
+    # End of sign()
+
+    def verify(self, packet, start):
+        """
+        Returns True if the tag in the packet matches the tag calculated for
+        it, False if not or if the packet is too short to contain a tag.
+
+        :type packet: bytes-like object
+        :param packet: the packet to be checked
+
+        :type start: int
+        :param start: the position of the tag in the packet
+        """
+        if packet == None or len(packet) < (start + self.size):
+            return False
+
+        return packet[start:(start + self.size)] == \
+               self.calculate(packet, start)
+    # End of verify()
+
+# End of Checksum class
+
+# Every check available in this installation, by code
+CHECKSUMS = {
+    SHA224: Checksum(SHA224, "SHA-224", 56, _sha224),
+    CRC32: Checksum(CRC32, "CRC32", 4, _crc32),
+    BLAKE2B8: Checksum(BLAKE2B8, "BLAKE2b-64", 8, _blake2b(8)),
+    BLAKE2B16: Checksum(BLAKE2B16, "BLAKE2b-128", 16, _blake2b(16)),
+}
+if not crc32c == None:
+    CHECKSUMS[CRC32C] = Checksum(CRC32C, "CRC32C", 4, _crc32c)
+
+# The checks offered in the handshake, most preferred first
+PREFERENCE = [code for code in [CRC32C, CRC32, BLAKE2B8, BLAKE2B16, SHA224]
+              if code in CHECKSUMS]
+
+def encodeOffer(codes=None):
+    """
+    Returns the list of checks offered by the Client, as bytes: the number of
+    checks, followed by the code of each check.
+
+    :type codes: list of int
+    :param codes: the codes of the checks offered, most preferred first.
+                  Defaults to every available check.
+    """
+    if codes == None:
+        codes = PREFERENCE
+    return bytes([len(codes)] + codes)
+# End of encodeOffer()
+
+def decodeOffer(data):
+    """
+    Returns the codes of the checks offered by the Client, from the bytes
+    produced by encodeOffer(). An empty offer comes from a Client that
+    predates the negotiation.
+
+    :type data: bytes-like object
+    :param data: the offer, and possibly other bytes after it
+    """
+    if len(data) == 0:
+        return []
+    return list(data[1:(1 + data[0])])
+# End of decodeOffer()
+
+def choose(offer):
+    """
+    Returns the Checksum to be used for a transfer: the first check in the
+    Client's offer that is available here, or SHA-224 if there is none.
+
+    :type offer: list of int
+    :param offer: the codes of the checks offered by the Client
+    """
+    for code in offer:
+        if code in CHECKSUMS:
+            return CHECKSUMS[code]
+    return CHECKSUMS[SHA224]
+# End of choose()
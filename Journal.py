@@ -0,0 +1,107 @@
+import os # For reading and writing the journal file
+
+# The file name extension of a journal, kept next to the file being received
+EXTENSION = ".journal"
+
+# The number of bytes taken up by each number in the journal
+FIELDSIZE = 9
+
+class Journal(object):
+    """
+    Keeps track of how much of a file has been received, in a small file next
+    to it, so that a transfer that breaks off can be resumed later instead of
+    starting over. The journal holds the size of the file being received and
+    the index of the first byte not yet received: every byte before it is
+    on disk. Each update overwrites the journal in place.
+    """
+
+    def __init__(self, dest, part=None):
+        """
+        Initializes a Journal for the file saved at the given path. The
+        journal file itself is only created by the first save().
+
+        :type dest: string
+        :param dest: the path the file being received is saved to
+
+        :type part: int
+        :param part: the part of the file being received, if the file is
+                     being downloaded in parts. Each part has a journal of
+                     its own.
+        """
+
+        # The path of the file being received
+        self.dest = dest
+
+        # The path of the journal file
+        if part == None:
+            self.path = dest + EXTENSION
+        else:
+            self.path = "%s.part%d%s" % (dest, part, EXTENSION)
+
+        # The open journal file, once something has been saved
+        self.fd = None
+    # End of constructor()
+
+    def load(self):
+        """
+        Returns the progress recorded by an earlier transfer of the file as a
+        (fileSize, offset) tuple, or None if there is nothing to resume: no
+        journal, no partly received file, or a journal that cannot be read.
+        """
+        if not (os.path.exists(self.path) and os.path.exists(self.dest)):
+            return None
+
+        with open(self.path, 'rb') as journal:
+            record = journal.read(2 * FIELDSIZE)
+        if len(record) < 2 * FIELDSIZE:
+            return None
+
+        fileSize = int.from_bytes(record[:FIELDSIZE], byteorder='big')
+        offset = int.from_bytes(record[FIELDSIZE:], byteorder='big')
+        if offset > fileSize or os.path.getsize(self.dest) < offset:
+            return None
+        return (fileSize, offset)
+    # End of load()
+
+    def save(self, fileSize, offset):
+        """
+        Records that every byte of the file before offset has been received.
+
+        :type fileSize: int
+        :param fileSize: the size of the file being received
+
+        :type offset: int
+        :param offset: the index of the first byte not yet received
+        """
+        if self.fd == None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+
+        record = (fileSize.to_bytes(FIELDSIZE, byteorder='big') +
+                  offset.to_bytes(FIELDSIZE, byteorder='big'))
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, record, 0)
+        else:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            os.write(self.fd, record)
+    # End of save()
+
+    def close(self):
+        """
+        Closes the journal file, leaving it in place for a later transfer to
+        resume from.
+        """
+        if not self.fd == None:
+            os.close(self.fd)
+            self.fd = None
+    # End of close()
+
+    def remove(self):
+        """
+        Deletes the journal once the whole file has been received.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    # End of remove()
+
+# End of Journal class
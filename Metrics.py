@@ -0,0 +1,272 @@
+import asyncio # For the stats socket
+import bisect # For finding the bucket of a value
+import json # For snapshots
+import sys # For the command line of the stats query
+
+# The upper bounds of the buckets of histograms of times, in seconds: from
+# 100 microseconds up, doubling each time, to about 100 seconds
+TIMEBUCKETS = [0.0001 * 2 ** i for i in range(21)]
+
+# The upper bounds of the buckets of histograms of numbers of packets: powers
+# of two up to 4096
+COUNTBUCKETS = [2 ** i for i in range(13)]
+
+# The percentiles estimated in the snapshot of each histogram
+PERCENTILES = [50, 90, 99]
+
+# The number of bytes read at a time from the stats socket
+READSIZE = 65536
+
+class Histogram(object):
+    """
+    Counts how many of the values observed fall into each of a fixed set of
+    buckets, along with their count, sum, smallest and largest, so values
+    observed for every packet take up no more memory than a few counters.
+    Percentiles are estimated as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, bounds):
+        """
+        Initializes an empty Histogram.
+
+        :type bounds: list of numbers
+        :param bounds: the upper bound of each bucket, in increasing order.
+                       Values above the last bound are counted in a bucket of
+                       their own.
+        """
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+    # End of constructor()
+
+    def observe(self, value):
+        """
+        Counts a value.
+
+        :type value: number
+        :param value: the value observed
+        """
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+    # End of observe()
+
+    def merge(self, other):
+        """
+        Adds the values counted by another Histogram with the same bounds.
+
+        :type other: Metrics.Histogram
+        :param other: the histogram added
+        """
+        for i in range(len(self.buckets)):
+            self.buckets[i] += other.buckets[i]
+        self.count += other.count
+        self.sum += other.sum
+        if self.min == None or (not other.min == None and
+                                other.min < self.min):
+            self.min = other.min
+        if self.max == None or (not other.max == None and
+                                other.max > self.max):
+            self.max = other.max
+    # End of merge()
+
+    def percentile(self, percent):
+        """
+        Returns an estimate of the given percentile of the values counted, or
+        None if there are none.
+
+        :type percent: number
+        :param percent: the percentile, between 0 and 100
+        """
+        if self.count == 0:
+            return None
+        rank = percent * self.count / 100.0
+        seen = 0
+        for (i, bucketCount) in enumerate(self.buckets):
+            seen += bucketCount
+            if seen >= rank and bucketCount > 0:
+                if i == len(self.bounds):
+                    return self.max
+                return min(self.bounds[i], self.max)
+        return self.max
+    # End of percentile()
+
+    def snapshot(self):
+        """
+        Returns what the histogram has counted, as a dict that can be written
+        as JSON. Only the buckets holding values are listed, as
+        [upper bound, count] pairs, with None as the bound of the last.
+        """
+        snapshot = {'count': self.count, 'sum': self.sum, 'min': self.min,
+                    'max': self.max,
+                    'mean': self.sum / self.count if self.count else None}
+        for percent in PERCENTILES:
+            snapshot['p%d' % percent] = self.percentile(percent)
+        bounds = self.bounds + [None]
+        snapshot['buckets'] = [[bounds[i], bucketCount]
+                               for (i, bucketCount) in enumerate(self.buckets)
+                               if bucketCount > 0]
+        return snapshot
+    # End of snapshot()
+
+# End of Histogram class
+
+class Metrics(object):
+    """
+    The counters, gauges and histograms of one transfer, or of every transfer
+    of a Server or a download. Counters only ever grow, gauges hold the
+    latest value set, and histograms count values observed. Each is created
+    the first time it is used, so a snapshot only holds what happened.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty Metrics.
+        """
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+    # End of constructor()
+
+    def count(self, name, amount=1):
+        """
+        Adds to a counter.
+
+        :type name: string
+        :param name: the name of the counter
+
+        :type amount: int
+        :param amount: the amount added
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+    # End of count()
+
+    def set(self, name, value):
+        """
+        Sets a gauge.
+
+        :type name: string
+        :param name: the name of the gauge
+
+        :type value: number
+        :param value: the current value
+        """
+        self.gauges[name] = value
+    # End of set()
+
+    def observe(self, name, value, bounds=TIMEBUCKETS):
+        """
+        Counts a value in a histogram.
+
+        :type name: string
+        :param name: the name of the histogram
+
+        :type value: number
+        :param value: the value observed
+
+        :type bounds: list of numbers
+        :param bounds: the upper bounds of the buckets of the histogram, if it
+                       has not been used yet
+        """
+        histogram = self.histograms.get(name)
+        if histogram == None:
+            histogram = Histogram(bounds)
+            self.histograms[name] = histogram
+        histogram.observe(value)
+    # End of observe()
+
+    def merge(self, other):
+        """
+        Adds the counters and histograms of another Metrics, as when a
+        transfer ends and is added to the totals. Gauges describe a single
+        transfer, so they are left out.
+
+        :type other: Metrics.Metrics
+        :param other: the metrics added
+        """
+        for (name, value) in other.counters.items():
+            self.count(name, value)
+        for (name, histogram) in other.histograms.items():
+            if not name in self.histograms:
+                self.histograms[name] = Histogram(histogram.bounds)
+            self.histograms[name].merge(histogram)
+    # End of merge()
+
+    def snapshot(self):
+        """
+        Returns every counter, gauge and histogram, as a dict that can be
+        written as JSON.
+        """
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {name: histogram.snapshot() for (name, histogram)
+                           in self.histograms.items()},
+        }
+    # End of snapshot()
+
+# End of Metrics class
+
+async def serveStats(snapshot, addr, port):
+    """
+    Starts the stats socket: a TCP socket on which every connection is sent
+    a snapshot, as a line of JSON, and closed. Returns the asyncio.Server
+    listening on it.
+
+    :type snapshot: function
+    :param snapshot: returns the snapshot sent, as a dict
+
+    :type addr: string
+    :param addr: the address the socket listens on, which should be local,
+                 since the snapshot is sent to anyone who asks
+
+    :type port: int
+    :param port: the port number the socket listens on
+    """
+    async def sendSnapshot(reader, writer):
+        try:
+            writer.write(json.dumps(snapshot()).encode("UTF-8") + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(sendSnapshot, addr, port)
+# End of serveStats()
+
+async def queryStats(addr, port):
+    """
+    Returns the snapshot sent by a stats socket, as a dict.
+
+    :type addr: string
+    :param addr: the address of the stats socket
+
+    :type port: int
+    :param port: the port number of the stats socket
+    """
+    (reader, writer) = await asyncio.open_connection(addr, port)
+    try:
+        data = b''
+        while True:
+            chunk = await reader.read(READSIZE)
+            if chunk == b'':
+                break
+            data += chunk
+    finally:
+        writer.close()
+    return json.loads(data.decode("UTF-8"))
+# End of queryStats()
+
+if __name__ == "__main__":
+    # Prints the snapshot of a running Server: Metrics.py [address] port
+    if len(sys.argv) == 2:
+        (addr, port) = ("127.0.0.1", sys.argv[1])
+    else:
+        (addr, port) = (sys.argv[1], sys.argv[2])
+    print(json.dumps(asyncio.run(queryStats(addr, int(port))), indent=1))
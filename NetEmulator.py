@@ -0,0 +1,653 @@
+#
+# Emulates a lossy network between a Client and the Server on one machine.
+# Listens for Clients on a local port and relays their packets to the Server,
+# and the Server's answers back to them, dropping, delaying, reordering,
+# duplicating and corrupting packets in each direction on the way. Can be run
+# as a script in front of a running Server, or imported, in which case a
+# NetEmulator is started on the same event loop as the downloads it carries.
+#
+# Every random decision is drawn from a generator seeded from the given seed,
+# so the same seed gives the same decisions for the same packets.
+#
+
+import argparse # For reading the emulated conditions from the command line
+import asyncio # For relaying packets without blocking
+import random # For deciding what happens to each packet
+import socket # For the sockets of the emulator
+
+# The number of bytes a direction holds waiting for its bandwidth before it
+# drops packets, like the buffer of a router on a slow link
+QUEUESIZE = 256 * 1024
+
+# The number of seconds a packet picked for reordering is held back on top
+# of its usual delay, so the packets behind it overtake it
+REORDERDELAY = 0.01
+
+# The number of seconds without a packet in either direction after which a
+# Client is forgotten, and the socket relaying its packets closed
+IDLETIMEOUT = 60.0
+
+# The size asked for the receive buffer of every socket of the emulator, as
+# large as the Server's and the Client's, so bursts of large packets reach
+# the links instead of being dropped by the system uncounted. The system may
+# grant less
+SOCKETBUFFERSIZE = 4 * 1024 * 1024
+
+class Link(object):
+    """
+    The conditions packets meet going one way through the emulator, and the
+    counts of what happened to them. Each packet is, in turn:
+    dropped, either at random or in bursts; duplicated; corrupted by flipping
+    one of its bits; queued behind the packets before it for as long as the
+    bandwidth needs to send them, or dropped if the queue is full; and then
+    delayed by the latency, give or take the jitter, and held back further if
+    it is picked to be reordered.
+    """
+
+    def __init__(self, loss=0.0, burst=1.0, latency=0.0, jitter=0.0,
+                 bandwidth=None, queueSize=QUEUESIZE, reorder=0.0,
+                 reorderDelay=REORDERDELAY, duplicate=0.0, corrupt=0.0):
+        """
+        Initializes a Link with the given conditions. By default, packets
+        get through as they are.
+
+        :type loss: float
+        :param loss: the fraction of packets dropped, between 0 and 1
+
+        :type burst: float
+        :param burst: the average number of packets dropped in a row. Losses
+                      are independent of each other at 1, and come in
+                      bursts, as on a congested or wireless link, above it,
+                      with the overall fraction still given by loss. Bursts
+                      must be long enough for that fraction to be reached:
+                      loss can be at most burst / (burst + 1). Raises
+                      ValueError otherwise.
+
+        :type latency: float
+        :param latency: the number of seconds each packet is delayed
+
+        :type jitter: float
+        :param jitter: the most the delay of a packet is randomly shortened or
+                       lengthened by, in seconds. Packets may overtake each
+                       other when it is larger than the gap between them.
+
+        :type bandwidth: float
+        :param bandwidth: the number of bytes sent each second, None for no
+                          limit
+
+        :type queueSize: int
+        :param queueSize: the number of bytes held waiting for the bandwidth
+                          before packets are dropped
+
+        :type reorder: float
+        :param reorder: the fraction of packets held back for reorderDelay
+                        seconds on top of their delay
+
+        :type reorderDelay: float
+        :param reorderDelay: the number of seconds a reordered packet is held
+                             back
+
+        :type duplicate: float
+        :param duplicate: the fraction of packets sent twice
+
+        :type corrupt: float
+        :param corrupt: the fraction of packets with one bit flipped
+        """
+        if not 0 <= loss <= 1:
+            raise ValueError("Loss %g is not between 0 and 1" % loss)
+        if burst < 1:
+            raise ValueError("Bursts of %g losses are shorter than one" %
+                             burst)
+        if burst > 1 and loss > burst / (burst + 1):
+            raise ValueError("Loss %g is too high for bursts of %g losses, "
+                             "at most %g" % (loss, burst, burst / (burst + 1)))
+        self.loss = loss
+        self.burst = burst
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.queueSize = queueSize
+        self.reorder = reorder
+        self.reorderDelay = reorderDelay
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+
+        # Makes every random decision for this direction, seeded by the
+        # NetEmulator
+        self.random = random.Random(0)
+
+        # Whether the last packet was dropped in a burst of losses
+        self.losing = False
+
+        # The time at which the packets queued so far will all have been
+        # sent, going by the bandwidth
+        self.busyUntil = 0.0
+
+        # What happened to the packets that went through the link
+        self.counts = {'received': 0, 'dropped': 0, 'overflowed': 0,
+                       'duplicated': 0, 'corrupted': 0, 'reordered': 0,
+                       'delivered': 0, 'bytes': 0}
+    # End of constructor()
+
+    def seed(self, seed):
+        """
+        Restarts the random decisions of the link from the given seed, and
+        clears its state and counts.
+
+        :type seed: string
+        :param seed: the seed of the random decisions
+        """
+        self.random.seed(seed)
+        self.losing = False
+        self.busyUntil = 0.0
+        for name in self.counts:
+            self.counts[name] = 0
+    # End of seed()
+
+    def schedule(self, packet, now):
+        """
+        Decides what happens to a packet entering the link, and returns the
+        packets to deliver, with the time at which to deliver each, as a list
+        of (time, packet) tuples. The list is empty if the packet is dropped,
+        and has two entries if it is duplicated.
+
+        :type packet: bytes
+        :param packet: the packet entering the link
+
+        :type now: float
+        :param now: the time at which the packet entered the link, in the
+                    clock of the event loop
+        """
+        self.counts['received'] += 1
+        if self._isLost():
+            self.counts['dropped'] += 1
+            return []
+
+        copies = [packet]
+        if self.duplicate > 0 and self.random.random() < self.duplicate:
+            self.counts['duplicated'] += 1
+            copies.append(packet)
+
+        scheduled = []
+        for copy in copies:
+            if self.corrupt > 0 and self.random.random() < self.corrupt:
+                copy = self._flipBit(copy)
+                self.counts['corrupted'] += 1
+
+            sendTime = now
+            if not self.bandwidth == None:
+                self.busyUntil = max(self.busyUntil, now)
+                if (self.busyUntil - now) * self.bandwidth > self.queueSize:
+                    self.counts['overflowed'] += 1
+                    continue
+                self.busyUntil += len(copy) / self.bandwidth
+                sendTime = self.busyUntil
+
+            delay = self.latency
+            if self.jitter > 0:
+                delay += self.random.uniform(-self.jitter, self.jitter)
+            if self.reorder > 0 and self.random.random() < self.reorder:
+                delay += self.reorderDelay
+                self.counts['reordered'] += 1
+            scheduled.append((sendTime + max(0.0, delay), copy))
+        return scheduled
+    # End of schedule()
+
+    def _isLost(self):
+        """
+        Returns True if the next packet is dropped. With bursts of one,
+        each packet is dropped on its own with the given chance. Longer
+        bursts follow a Gilbert model with two states: every packet is
+        dropped in the losing state, which lasts burst packets on average,
+        and none in the other. The losing state is entered just often enough
+        for the given fraction of packets to be dropped overall.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        if self.loss <= 0:
+            return False
+        if self.loss >= 1:
+            return True
+        if self.burst == 1:
+            return self.random.random() < self.loss
+
+        if self.losing:
+            self.losing = self.random.random() >= 1.0 / self.burst
+        else:
+            startChance = self.loss / (self.burst * (1.0 - self.loss))
+            self.losing = self.random.random() < startChance
+        return self.losing
+    # End of _isLost()
+
+    def _flipBit(self, packet):
+        """
+        Returns a copy of the packet with one random bit flipped.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        if len(packet) == 0:
+            return packet
+        corrupted = bytearray(packet)
+        bit = self.random.randrange(len(packet) * 8)
+        corrupted[bit // 8] ^= 1 << (bit % 8)
+        return bytes(corrupted)
+    # End of _flipBit()
+
+    def describe(self):
+        """
+        Returns the counts of what happened to the packets that went through
+        the link, as a string.
+        """
+        return ", ".join("%s %d" % (name, count)
+                         for (name, count) in self.counts.items())
+    # End of describe()
+
+# End of Link class
+
+class Relay(asyncio.DatagramProtocol):
+    """
+    Relays the packets of one Client to the Server, from a socket of its own,
+    so the Server sees every Client at a different address, just as it would
+    without the emulator. Receives the Server's answers to the Client.
+    """
+
+    def __init__(self, emulator, clientAddress):
+        """
+        Initializes a Relay for the given Client.
+
+        :type emulator: NetEmulator
+        :param emulator: the emulator the relay belongs to
+
+        :type clientAddress: (string, int) tuple
+        :param clientAddress: the address of the Client
+        """
+        self.emulator = emulator
+        self.clientAddress = clientAddress
+
+        # Set once the socket to the Server has been created, by the task
+        # creating it
+        self.transport = None
+        self.connecting = None
+
+        # The packets from the Client that arrived before the socket was
+        # created
+        self.waiting = []
+
+        # The time the last packet went through the relay
+        self.lastActive = emulator.loop.time()
+    # End of constructor()
+
+    async def connect(self):
+        """
+        Creates the socket to the Server. The relay is forgotten if it cannot
+        be created, so the next packet from the Client tries again.
+        """
+        try:
+            relaySocket = _bufferedSocket()
+            relaySocket.connect(self.emulator.serverAddress)
+            await self.emulator.loop.create_datagram_endpoint(
+                lambda: self, sock=relaySocket)
+        except OSError as error:
+            print("Could not relay to the server for %s:%d: %s" %
+                  (self.clientAddress + (error,)))
+            if self.emulator.relays.get(self.clientAddress) is self:
+                del self.emulator.relays[self.clientAddress]
+    # End of connect()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for packet in self.waiting:
+            self.transport.sendto(packet)
+        self.waiting = []
+    # End of connection_made()
+
+    def datagram_received(self, data, addr):
+        self.lastActive = self.emulator.loop.time()
+        self.emulator.forward(self.emulator.downstream, data,
+                              self.emulator.sendToClient, self.clientAddress)
+    # End of datagram_received()
+
+    def error_received(self, exc):
+        print("Error relaying to the server for %s:%d: %s" %
+              (self.clientAddress + (exc,)))
+    # End of error_received()
+
+    def sendToServer(self, packet):
+        """
+        Sends a packet that made it through the link to the Server.
+
+        :type packet: bytes
+        :param packet: the packet from the Client
+        """
+        if self.transport == None:
+            self.waiting.append(packet)
+        elif not self.transport.is_closing():
+            self.transport.sendto(packet)
+    # End of sendToServer()
+
+    def close(self):
+        """
+        Closes the socket to the Server.
+        """
+        if not self.connecting == None:
+            self.connecting.cancel()
+        if not self.transport == None:
+            self.transport.close()
+    # End of close()
+
+# End of Relay class
+
+class ListenProtocol(asyncio.DatagramProtocol):
+    """
+    Hands every packet a Client sends to the emulator over to it.
+    """
+
+    def __init__(self, emulator):
+        """
+        Initializes a ListenProtocol for the given NetEmulator.
+
+        :type emulator: NetEmulator
+        :param emulator: the emulator the packets are handed over to
+        """
+        self.emulator = emulator
+    # End of constructor()
+
+    def connection_made(self, transport):
+        self.emulator.transport = transport
+    # End of connection_made()
+
+    def datagram_received(self, data, addr):
+        self.emulator.clientPacket(data, addr)
+    # End of datagram_received()
+
+    def error_received(self, exc):
+        print("Error on emulator socket: %s" % exc)
+    # End of error_received()
+
+# End of ListenProtocol class
+
+class NetEmulator(object):
+    """
+    A UDP proxy standing in for the Server: Clients download from the
+    emulator's address, and their packets reach the Server, and the Server's
+    reach them, through an upstream and a downstream Link.
+    """
+
+    def __init__(self, addr, port, serverAddr, serverPort, upstream=None,
+                 downstream=None, seed=0):
+        """
+        Initializes a NetEmulator. Packets are not relayed until start(),
+        serve() or run() is called.
+
+        :type addr: string
+        :param addr: the address Clients send to
+
+        :type port: int
+        :param port: the port number Clients send to, 0 for any free port
+
+        :type serverAddr: string
+        :param serverAddr: the address of the Server
+
+        :type serverPort: int
+        :param serverPort: the port number of the Server
+
+        :type upstream: Link
+        :param upstream: the conditions met by packets from Clients to the
+                         Server. By default, they get through as they are.
+
+        :type downstream: Link
+        :param downstream: the conditions met by packets from the Server to
+                           Clients. By default, they get through as they are.
+
+        :type seed: int
+        :param seed: the seed of every random decision
+        """
+        self.addr = addr
+        self.port = int(port)
+        self.serverAddress = (serverAddr, int(serverPort))
+
+        self.upstream = Link() if upstream == None else upstream
+        self.downstream = Link() if downstream == None else downstream
+        self.upstream.seed("%d upstream" % seed)
+        self.downstream.seed("%d downstream" % seed)
+
+        # The relays of the Clients seen so far, by Client address
+        self.relays = {}
+
+        # Set once the emulator is started
+        self.loop = None
+        self.transport = None
+        self.idleTimer = None
+    # End of constructor()
+
+    async def start(self):
+        """
+        Creates the socket Clients send to on the running event loop. Packets
+        are relayed from then on, for as long as the loop runs. If the port
+        number was 0, it is set to the port picked by the system.
+        """
+        self.loop = asyncio.get_running_loop()
+        listenSocket = _bufferedSocket()
+        listenSocket.bind((self.addr, self.port))
+        await self.loop.create_datagram_endpoint(
+            lambda: ListenProtocol(self), sock=listenSocket)
+        self.port = self.transport.get_extra_info('sockname')[1]
+        print("Emulating the network to %s:%d on port %d, address %s." %
+              (self.serverAddress + (self.port, self.addr)))
+        self.idleTimer = self.loop.call_later(IDLETIMEOUT, self.closeIdle)
+    # End of start()
+
+    async def serve(self):
+        """
+        Starts the emulator and relays packets until cancelled.
+        """
+        await self.start()
+        try:
+            await asyncio.Future()
+        finally:
+            self.close()
+    # End of serve()
+
+    def run(self):
+        """
+        Relays packets on a new event loop until interrupted.
+        """
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Emulator stopped")
+    # End of run()
+
+    def clientPacket(self, packet, address):
+        """
+        Sends a packet from a Client through the upstream link, starting a
+        relay for the Client if it does not have one.
+
+        :type packet: bytes
+        :param packet: the packet received
+
+        :type address: (string, int) tuple
+        :param address: the address of the Client that sent it
+        """
+        relay = self.relays.get(address)
+        if relay == None:
+            relay = Relay(self, address)
+            self.relays[address] = relay
+            relay.connecting = self.loop.create_task(relay.connect())
+        relay.lastActive = self.loop.time()
+        self.forward(self.upstream, packet, relay.sendToServer)
+    # End of clientPacket()
+
+    def forward(self, link, packet, send, *args):
+        """
+        Sends a packet through a link, calling send with each packet that
+        comes out of the other end, at the time it does.
+
+        :type link: Link
+        :param link: the link the packet goes through
+
+        :type packet: bytes
+        :param packet: the packet
+
+        :type send: function
+        :param send: sends a packet on, given the packet and args
+        """
+        now = self.loop.time()
+        for (when, copy) in link.schedule(packet, now):
+            if when <= now:
+                self._deliver(link, send, copy, *args)
+            else:
+                self.loop.call_at(when, self._deliver, link, send, copy,
+                                  *args)
+    # End of forward()
+
+    def _deliver(self, link, send, packet, *args):
+        """
+        Sends on a packet that came out of a link.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        link.counts['delivered'] += 1
+        link.counts['bytes'] += len(packet)
+        send(packet, *args)
+    # End of _deliver()
+
+    def sendToClient(self, packet, address):
+        """
+        Sends a packet from the Server that made it through the downstream
+        link to the Client it was meant for.
+
+        :type packet: bytes
+        :param packet: the packet
+
+        :type address: (string, int) tuple
+        :param address: the address of the Client
+        """
+        if not self.transport == None and not self.transport.is_closing():
+            self.transport.sendto(packet, address)
+    # End of sendToClient()
+
+    def closeIdle(self):
+        """
+        Forgets the Clients that have not sent or received a packet for
+        IDLETIMEOUT seconds, and checks again later.
+        """
+        now = self.loop.time()
+        for (address, relay) in list(self.relays.items()):
+            if now - relay.lastActive > IDLETIMEOUT:
+                relay.close()
+                del self.relays[address]
+        self.idleTimer = self.loop.call_later(IDLETIMEOUT, self.closeIdle)
+    # End of closeIdle()
+
+    def close(self):
+        """
+        Closes every socket of the emulator, and prints what happened to the
+        packets that went through it.
+        """
+        if not self.idleTimer == None:
+            self.idleTimer.cancel()
+        for relay in self.relays.values():
+            relay.close()
+        self.relays.clear()
+        if not self.transport == None:
+            self.transport.close()
+        print("Upstream: %s" % self.upstream.describe())
+        print("Downstream: %s" % self.downstream.describe())
+    # End of close()
+
+# End of NetEmulator class
+
+def _bufferedSocket():
+    """
+    Returns a new non-blocking UDP socket with a receive buffer of
+    SOCKETBUFFERSIZE bytes, for the event loop to use.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    newSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    newSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                         SOCKETBUFFERSIZE)
+    newSocket.setblocking(False)
+    return newSocket
+# End of _bufferedSocket()
+
+def _addLinkArguments(parser, direction):
+    """
+    Adds the command line options for the conditions in one direction.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    group = parser.add_argument_group(
+        "%s, from %s" % (direction, "Client to Server" if direction == "up"
+                         else "Server to Client"))
+    prefix = "--" + direction + "-"
+    group.add_argument(prefix + "loss", type=float, default=0.0,
+                       help="fraction of packets dropped")
+    group.add_argument(prefix + "burst", type=float, default=1.0,
+                       help="average number of packets dropped in a row")
+    group.add_argument(prefix + "latency", type=float, default=0.0,
+                       help="delay of each packet, in milliseconds")
+    group.add_argument(prefix + "jitter", type=float, default=0.0,
+                       help="most the delay varies by, in milliseconds")
+    group.add_argument(prefix + "bandwidth", type=float, default=None,
+                       help="kilobits sent per second, unlimited by default")
+    group.add_argument(prefix + "queue", type=int, default=QUEUESIZE,
+                       help="bytes held waiting for the bandwidth")
+    group.add_argument(prefix + "reorder", type=float, default=0.0,
+                       help="fraction of packets held back to be overtaken")
+    group.add_argument(prefix + "duplicate", type=float, default=0.0,
+                       help="fraction of packets sent twice")
+    group.add_argument(prefix + "corrupt", type=float, default=0.0,
+                       help="fraction of packets with a bit flipped")
+# End of _addLinkArguments()
+
+def _linkFromArguments(arguments, direction):
+    """
+    Returns the Link for one direction described by the command line.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    option = lambda name: getattr(arguments, direction + "_" + name)
+    bandwidth = option("bandwidth")
+    if not bandwidth == None:
+        bandwidth = bandwidth * 1000 / 8
+    return Link(loss=option("loss"), burst=option("burst"),
+                latency=option("latency") / 1000,
+                jitter=option("jitter") / 1000, bandwidth=bandwidth,
+                queueSize=option("queue"), reorder=option("reorder"),
+                duplicate=option("duplicate"), corrupt=option("corrupt"))
+# End of _linkFromArguments()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Relays UDP packets between Clients and a Server, "
+                    "emulating a lossy network.")
+    parser.add_argument("port", type=int,
+                        help="port number Clients download from")
+    parser.add_argument("server", help="address of the Server")
+    parser.add_argument("serverPort", type=int,
+                        help="port number of the Server")
+    parser.add_argument("--addr", default="127.0.0.1",
+                        help="address Clients download from")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of every random decision")
+    _addLinkArguments(parser, "up")
+    _addLinkArguments(parser, "down")
+    arguments = parser.parse_args()
+
+    try:
+        upstream = _linkFromArguments(arguments, "up")
+        downstream = _linkFromArguments(arguments, "down")
+    except ValueError as error:
+        parser.error(str(error))
+
+    NetEmulator(arguments.addr, arguments.port, arguments.server,
+                arguments.serverPort, upstream=upstream,
+                downstream=downstream, seed=arguments.seed).run()
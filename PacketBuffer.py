@@ -0,0 +1,311 @@
+class Bitset(object):
+    """
+    A compact set of flags, stored one bit per flag in a bytearray. Used by
+    the SlidingWindow to keep track of which packets have been acknowledged
+    or received without allocating a Python object per packet.
+    """
+
+    def __init__(self, size):
+        """
+        Initializes a Bitset with every flag cleared.
+
+        :type size: int
+        :param size: the number of flags held by the Bitset
+        """
+
+        # The number of flags in the Bitset
+        self.size = size
+
+        # The flags themselves, 8 to a byte
+        self.bits = bytearray((size + 7) // 8)
+    # End of constructor()
+
+    def set(self, index):
+        """
+        Sets the flag at the given index.
+
+        :type index: int
+        :param index: the position of the flag to be set
+        """
+        self.bits[index >> 3] |= (1 << (index & 7))
+    # End of set()
+
+    def clear(self, index):
+        """
+        Clears the flag at the given index.
+
+        :type index: int
+        :param index: the position of the flag to be cleared
+        """
+        self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+    # End of clear()
+
+    def test(self, index):
+        """
+        Returns True if the flag at the given index is set, False if not.
+
+        :type index: int
+        :param index: the position of the flag to be tested
+        """
+        return (self.bits[index >> 3] >> (index & 7)) & 1 == 1
+    # End of test()
+
+    def toInt(self):
+        """
+        Returns the flags as an int, with the flag at index 0 as the lowest bit.
+        """
+        return int.from_bytes(self.bits, byteorder='little')
+    # End of toInt()
+
+    def fromInt(self, value):
+        """
+        Sets the flags from an int, with the lowest bit as the flag at index 0.
+
+        :type value: int
+        :param value: the flags to be held by the Bitset, which must fit in
+                      size bits
+        """
+        self.bits[:] = value.to_bytes(len(self.bits), byteorder='little')
+    # End of fromInt()
+
+    def clearAll(self):
+        """
+        Clears every flag in the Bitset.
+        """
+        self.bits[:] = bytes(len(self.bits))
+    # End of clearAll()
+
+# End of Bitset class
+
+class PacketBuffer(object):
+    """
+    The storage engine behind the SlidingWindow. Keeps a fixed number of
+    packets in a single preallocated bytearray, divided into slots of
+    slotSize bytes each. The length of the packet held in each slot is kept
+    separately, so packets can be handed out as memoryviews of the buffer
+    without copying them.
+    The slots form a ring: slot positions passed to the methods of this class
+    are counted from the head of the ring, and advancing the ring only moves
+    the head, recycling the first slot as the new last slot.
+    """
+
+    def __init__(self, numSlots, slotSize):
+        """
+        Initializes a PacketBuffer with every slot empty and unmarked.
+
+        :type numSlots: int
+        :param numSlots: the number of packets the buffer can hold
+
+        :type slotSize: int
+        :param slotSize: the maximum size of a packet
+        """
+
+        # The number of slots in the buffer
+        self.numSlots = numSlots
+
+        # The size of each slot
+        self.slotSize = slotSize
+
+        # The bytes of every packet in the buffer
+        self.buffer = bytearray(numSlots * slotSize)
+
+        # A view of the buffer, used to hand out packets without copying
+        self.view = memoryview(self.buffer)
+
+        # The length of the packet held in each slot
+        self.lengths = [0] * numSlots
+
+        # Keeps track of which slots are marked
+        self.marks = Bitset(numSlots)
+
+        # The time at which the packet held in each slot was last sent
+        self.sentTimes = [0.0] * numSlots
+
+        # The number of times the packet held in each slot has been sent
+        self.sendCounts = [0] * numSlots
+
+        # The physical position of the first slot of the ring
+        self.head = 0
+    # End of constructor()
+
+    def _physical(self, slot):
+        """
+        Returns the physical position in the buffer of the given slot.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        slot += self.head
+        if slot >= self.numSlots:
+            slot -= self.numSlots
+        return slot
+    # End of _physical()
+
+    def slot(self, slot):
+        """
+        Returns a writable memoryview covering the whole of the given slot,
+        regardless of the length of the packet held in it.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        start = self._physical(slot) * self.slotSize
+        return self.view[start:(start + self.slotSize)]
+    # End of slot()
+
+    def packet(self, slot):
+        """
+        Returns a memoryview of the packet held in the given slot.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        slot = self._physical(slot)
+        start = slot * self.slotSize
+        return self.view[start:(start + self.lengths[slot])]
+    # End of packet()
+
+    def store(self, slot, data):
+        """
+        Copies a packet into the given slot.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+
+        :type data: bytes-like object
+        :param data: the packet to be stored, at most slotSize bytes long
+        """
+        slot = self._physical(slot)
+        start = slot * self.slotSize
+        self.view[start:(start + len(data))] = data
+        self.lengths[slot] = len(data)
+    # End of store()
+
+    def setLength(self, slot, length):
+        """
+        Sets the length of the packet held in the given slot, for packets
+        that were written directly into the slot.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+
+        :type length: int
+        :param length: the length of the packet held in the slot
+        """
+        self.lengths[self._physical(slot)] = length
+    # End of setLength()
+
+    def length(self, slot):
+        """
+        Returns the length of the packet held in the given slot.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        return self.lengths[self._physical(slot)]
+    # End of length()
+
+    def mark(self, slot):
+        """
+        Marks the packet held in the given slot.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        self.marks.set(self._physical(slot))
+    # End of mark()
+
+    def isMarked(self, slot):
+        """
+        Returns True if the packet held in the given slot is marked.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        return self.marks.test(self._physical(slot))
+    # End of isMarked()
+
+    def markedBits(self):
+        """
+        Returns an int with bit i set if the slot i positions from the head of
+        the ring is marked.
+        """
+        mask = (1 << self.numSlots) - 1
+        value = self.marks.toInt()
+        return ((value >> self.head) |
+                (value << (self.numSlots - self.head))) & mask
+    # End of markedBits()
+
+    def markBits(self, bits):
+        """
+        Marks every slot whose bit is set in bits, where bit i stands for the
+        slot i positions from the head of the ring.
+
+        :type bits: int
+        :param bits: the slots to be marked
+        """
+        mask = (1 << self.numSlots) - 1
+        bits &= mask
+        physical = ((bits << self.head) |
+                    (bits >> (self.numSlots - self.head))) & mask
+        self.marks.fromInt(self.marks.toInt() | physical)
+    # End of markBits()
+
+    def recordSend(self, slot, now):
+        """
+        Records that the packet held in the given slot has just been sent.
+        Returns the number of times the packet has been sent.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+
+        :type now: float
+        :param now: the time at which the packet was sent
+        """
+        slot = self._physical(slot)
+        self.sentTimes[slot] = now
+        self.sendCounts[slot] += 1
+        return self.sendCounts[slot]
+    # End of recordSend()
+
+    def sentTime(self, slot):
+        """
+        Returns the time at which the packet held in the given slot was last
+        sent.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        return self.sentTimes[self._physical(slot)]
+    # End of sentTime()
+
+    def sendCount(self, slot):
+        """
+        Returns the number of times the packet held in the given slot has been
+        sent.
+
+        :type slot: int
+        :param slot: the position of the slot from the head of the ring
+        """
+        return self.sendCounts[self._physical(slot)]
+    # End of sendCount()
+
+    def advance(self):
+        """
+        Drops the packet in the first slot by moving the head of the ring
+        forward by one slot. The freed slot becomes the last slot of the ring,
+        empty and unmarked, without any of the other packets being moved.
+        """
+        self.lengths[self.head] = 0
+        self.marks.clear(self.head)
+        self.sentTimes[self.head] = 0.0
+        self.sendCounts[self.head] = 0
+        self.head += 1
+        if self.head == self.numSlots:
+            self.head = 0
+    # End of advance()
+
+# End of PacketBuffer class
@@ -0,0 +1,232 @@
+import collections # For keeping entries in order of use
+import io # For opening the files being sent
+import mmap # For mapping the files being sent into memory
+import os # For telling whether a file changed
+
+# The default number of bytes of prepared packet data kept in memory
+BUDGET = 64 * 1024 * 1024
+
+# The default number of files kept open and mapped while no transfer uses them
+MAXFILES = 32
+
+# The number of bytes each cached packet is counted as taking up on top of
+# its data, for the key and the bookkeeping around it
+ENTRYOVERHEAD = 128
+
+# Returned by lookup() for packets not in the cache, since None is a valid
+# entry
+MISSING = object()
+
+class MappedFile(object):
+    """
+    A file being sent, open and mapped into memory. Shared by every transfer
+    of the same version of the file, and only closed once none of them uses
+    it anymore.
+    """
+
+    def __init__(self, path, key):
+        """
+        Opens and maps the file at the given path.
+
+        :type path: string
+        :param path: the path to the file
+
+        :type key: tuple
+        :param key: the (path, mtime, size) of the file when it was opened
+        """
+        self.path = path
+        self.key = key
+        self.size = key[2]
+
+        # The number of transfers using the file
+        self.refs = 0
+
+        self.file = io.open(path, 'rb')
+        self.map = None
+        self.view = None
+        # Empty files cannot be mapped, and have nothing to send anyway
+        if self.size > 0:
+            self.map = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+    # End of constructor()
+
+    def close(self):
+        """
+        Unmaps and closes the file.
+        """
+        if not self.map == None:
+            self.view.release()
+            self.map.close()
+            self.map = None
+            self.view = None
+        self.file.close()
+    # End of close()
+
+# End of MappedFile class
+
+class PacketCache(object):
+    """
+    Keeps the files being sent open and mapped between transfers, along with
+    the packet data prepared from them, so popular files are served from
+    memory without reopening them or compressing their packets again.
+    Entries are keyed by the path, modification time and size of the file,
+    so a file that changes is never served from stale entries, which are
+    dropped as they fall out of use. Packet data is dropped least recently
+    used first once it takes up more than the memory budget, and unused files
+    once more than maxFiles of them are open.
+    """
+
+    def __init__(self, budget=BUDGET, maxFiles=MAXFILES):
+        """
+        Initializes an empty PacketCache.
+
+        :type budget: int
+        :param budget: the number of bytes of packet data kept in memory
+
+        :type maxFiles: int
+        :param maxFiles: the number of files kept open while no transfer uses
+                         them
+        """
+        self.budget = budget
+        self.maxFiles = maxFiles
+
+        # The open files, and the prepared packet data, least recently used
+        # first
+        self.files = collections.OrderedDict()
+        self.packets = collections.OrderedDict()
+
+        # The number of bytes taken up by the packet data
+        self.used = 0
+
+        # The number of lookups that found packet data, and that did not
+        self.hits = 0
+        self.misses = 0
+    # End of constructor()
+
+    def openFile(self, path):
+        """
+        Returns the MappedFile for the current version of the file at the
+        given path, opening and mapping it if it is not open already. Every
+        call must be matched by a call to closeFile() once the transfer is
+        over.
+
+        :type path: string
+        :param path: the path to the file
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        mapped = self.files.get(key)
+        if mapped == None:
+            mapped = MappedFile(path, key)
+            self.files[key] = mapped
+        else:
+            self.files.move_to_end(key)
+        mapped.refs += 1
+        self._evictFiles()
+        return mapped
+    # End of openFile()
+
+    def closeFile(self, mapped):
+        """
+        Hands back a file returned by openFile(). The file is kept open for
+        later transfers, until it falls out of use.
+
+        :type mapped: PacketCache.MappedFile
+        :param mapped: the file
+        """
+        mapped.refs -= 1
+        if mapped.refs == 0 and not self.files.get(mapped.key) is mapped:
+            mapped.close()
+        self._evictFiles()
+    # End of closeFile()
+
+    def lookup(self, key):
+        """
+        Returns the packet data cached under the given key, or MISSING if
+        there is none.
+
+        :type key: tuple
+        :param key: the key of the file the packet belongs to, followed by
+                    whatever else decides what the packet holds
+        """
+        value = self.packets.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.packets.move_to_end(key)
+        return value
+    # End of lookup()
+
+    def store(self, key, value):
+        """
+        Caches the given packet data under the given key, dropping the least
+        recently used packet data until it fits in the budget.
+
+        :type key: tuple
+        :param key: the key of the file the packet belongs to, followed by
+                    whatever else decides what the packet holds
+
+        :type value: bytes or None
+        :param value: the packet data
+        """
+        if key in self.packets:
+            return
+
+        self.packets[key] = value
+        self.used += self._sizeOf(value)
+        while self.used > self.budget and self.packets:
+            (oldKey, oldValue) = self.packets.popitem(last=False)
+            self.used -= self._sizeOf(oldValue)
+    # End of store()
+
+    def close(self):
+        """
+        Closes every file no transfer is using, and drops all packet data.
+        """
+        for mapped in list(self.files.values()):
+            if mapped.refs == 0:
+                mapped.close()
+        self.files.clear()
+        self.packets.clear()
+        self.used = 0
+    # End of close()
+
+    def _sizeOf(self, value):
+        """
+        Returns the number of bytes the given packet data is counted as.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        return ENTRYOVERHEAD + (0 if value == None else len(value))
+    # End of _sizeOf()
+
+    def _evictFiles(self):
+        """
+        Closes the files no transfer is using that have changed since they
+        were opened, then the least recently used of the others, until at most
+        maxFiles of them are left open.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        latest = {}
+        for key in self.files:
+            if not key[0] in latest or key[1] > latest[key[0]][1]:
+                latest[key[0]] = key
+
+        idle = []
+        for (key, mapped) in list(self.files.items()):
+            if not mapped.refs == 0:
+                continue
+            if latest[key[0]] == key:
+                idle.append(key)
+            else:
+                self.files.pop(key).close()
+        while len(idle) > self.maxFiles:
+            self.files.pop(idle.pop(0)).close()
+    # End of _evictFiles()
+
+# End of PacketCache class
@@ -1,265 +1,1319 @@
 import SlidingWindow as window
+import Integrity
+import Compression
+import FEC
+import Delta
+import WireFormat
+from WireFormat import FNAME, FSIZE, FREADYACK, FPACKET, FILEACK, FSACK
+from WireFormat import FRESUME, FRANGE, FPROBE, FDELTA, FSIG, FWAIT
+from CongestionControl import CongestionController, RttEstimator, DUPTHRESH
+from CongestionControl import Pacer
+from BatchSender import BatchSender
+import PacketCache as cache
+import Metrics
+import Trace
+import asyncio
+import concurrent.futures
 import socket
 import os
-import time
 import hashlib
-from threading import Thread
-from threading import Lock
+import multiprocessing
+import random
+import tempfile
 
-###############################################################################
-# Defining the codes that identify messages
-###############################################################################
-# Packet containing file name
-FNAME = (1).to_bytes(1, byteorder='big')
+# The number of times the Server will try to send a packet before it gives up
+NUMTRIES = 5
 
-# Packet containing file size
-FSIZE = (2).to_bytes(1, byteorder='big')
+# The number of seconds without hearing from the Client after which the
+# connection is assumed to be broken is never less than this
+MINBROKENTIMEOUT = 1.0
 
-# Packet signifying that the Client is ready to receive file
-FREADYACK = (3).to_bytes(1, byteorder='big')
+# The largest number of packets in the sliding window. The congestion window
+# decides how many of them are actually sent at a time
+WINDOWSIZE = 256
 
-# Packet containing bytes of file
-FPACKET = (4).to_bytes(1, byteorder='big')
+# The most bytes of signatures of an old copy of a file a Client can send,
+# enough for the blocks of a file of about a terabyte. A Client sending more
+# is given up on, so it cannot make the Server hold more than this
+MAXSIGNATUREBYTES = 96 * 1024 * 1024
 
-# Packet containing file acknowledgement
-FILEACK = (5).to_bytes(1, byteorder='big')
+# The number of processes deltas are built in, each building one at a time
+# without holding up the event loop
+DELTAWORKERS = 2
 
-# The number of times the Server will try to send a packet before it gives up
-NUMTRIES = 5
+# The smallest file request: its type, hash and the length of the file name
+MINREQUESTSIZE = 66
+
+# The size of file packets for Clients that do not ask for a size
+PACKETSIZE = 1024
+
+# The smallest and largest file packets the Server agrees to send. The largest
+# fills a 9000 byte jumbo frame, less the IP and UDP headers
+MINPACKETSIZE = 512
+MAXPACKETSIZE = 8972
+
+# The address the stats socket listens on. Snapshots are sent to anyone who
+# connects, so it is only reachable from this machine
+STATSADDRESS = "127.0.0.1"
+
+# The size asked for the receive buffer of the Server socket, which holds the
+# packets of every Client, so bursts of large packets are not dropped. The
+# system may grant less
+SOCKETBUFFERSIZE = 4 * 1024 * 1024
 
 print("Flags: %s %s %s %s %s" % (FNAME, FSIZE, FREADYACK, FPACKET, FILEACK))
 
-class Server(object):
+def partRange(fileSize, part, parts):
     """
-    An FTP Server implementing the Sliding Window protocol to ensure
-    data reliability.
+    Returns the range of bytes making up one of the parts a file is split
+    into when it is downloaded over several sessions at once, as a
+    (start, end) tuple, where end is the index of the byte after the part.
 
-    author: Frank Derry Wanye
-    author: Gloire Rubambiza
+    :type fileSize: int
+    :param fileSize: the size of the file
 
-    date: 12/05/2016
+    :type part: int
+    :param part: the number of the part, counting from 0
+
+    :type parts: int
+    :param parts: the number of parts the file is split into
     """
+    return (fileSize * part // parts, fileSize * (part + 1) // parts)
+# End of partRange()
 
-    def __init__(self):
+class ServerSession(object):
+    """
+    A single file transfer from the Server to one Client, identified by the
+    Client's address. Every session has its own sliding window, congestion
+    window, round trip time estimate and timers. Sessions do not block: the
+    Server hands them the packets sent by their Client, and resends are
+    scheduled as callbacks on the Server's event loop.
+    """
+
+    def __init__(self, server, address):
         """
-        Initializes a Server on the localhost with a port number of 2876.
+        Initializes a ServerSession waiting for a file request.
+
+        :type server: Server
+        :param server: the Server the session belongs to
+
+        :type address: (string, int) tuple
+        :param address: the address of the Client
         """
 
-        addr = input("What address is the server being set up on?\n")
-        port = input("What port number would you like to connect to?\n")
-        print ("Creating server socket on port %s, address %s." % (port, addr))
+        # The Server the session belongs to
+        self.server = server
 
-        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.serverSocket.bind((addr, int(port)))
-        
-        while 1:
-            self.serverInstance()
-    # End of __init__()
-            
-    def serverInstance(self):
+        # The address of the Client
+        self.address = address
+
+        # The event loop running the session
+        self.loop = server.loop
+
+        # One of 'Handshake', 'Transfer' or 'Done'
+        self.state = 'Handshake'
+
+        # Measures the round trip time to the Client
+        self.rtt = RttEstimator()
+
+        # Counts what happens during the transfer, and is added to the
+        # Server's totals once it ends
+        self.metrics = Metrics.Metrics()
+
+        # Records what happens to every packet, None if the Server is not
+        # traced
+        self.trace = server.trace
+
+        # The name of the file requested, once the request has arrived
+        self.filename = None
+
+        # The request answered by the session, kept to tell copies of it from
+        # a new request by the Client
+        self.request = None
+
+        # The integrity check negotiated for file packets
+        self.checksum = None
+
+        # The size of the file packets sent to the Client
+        self.packetSize = PACKETSIZE
+
+        # The format of the header of file packets and acknowledgements, and
+        # the id of the transfer written into it
+        self.wireFormat = WireFormat.FORMATS[WireFormat.LEGACY]
+        self.sessionId = 0
+
+        # The codec file packets are compressed with, if the Client asked for
+        # one, and the level they are compressed at
+        self.codec = None
+        self.level = 0
+
+        # The number of file packets protected by each parity packet, 0 if
+        # the Client did not ask for parity
+        self.fecGroup = 0
+
+        # The index of the first byte sent, past what the Client already has,
+        # and of the byte after the last byte sent
+        self.startOffset = 0
+        self.endOffset = None
+
+        # The packet holding the file size, kept so it can be resent
+        self.filesizePacket = None
+
+        # The number of times the file size packet has been sent, and when it
+        # was last sent
+        self.filesizeTries = 0
+        self.filesizeSentTime = 0.0
+
+        # The path to what is sent: the requested file, or the delta built
+        # from it
+        self.sendPath = None
+        self.deltaPath = None
+
+        # The signatures of the Client's old copy of the file, by chunk,
+        # their number of bytes, and a delta request waiting for all of them
+        # to arrive
+        self.signatures = {}
+        self.signatureBytes = 0
+        self.pendingRequest = None
+
+        # The delta being built in a worker process, and whether it is built
+        self.building = None
+        self.deltaBuilt = False
+
+        # The packet telling the Client to keep waiting for the delta
+        self.waitPacket = None
+
+        # Set up once the Client is ready to receive the file
+        self.slidingWindow = None
+        self.congestion = None
+
+        # Spaces out the packets sent, None if they are sent as soon as they
+        # are due
+        self.pacer = None
+
+        # The time at which the Client was last heard from
+        self.lastHeard = self.loop.time()
+
+        # The time at which the session started, and at which the file
+        # started being sent
+        self.started = self.lastHeard
+        self.transferStarted = None
+
+        # The number of file packets sent and not acknowledged yet
+        self.inFlight = 0
+
+        # Sends packets again once their timers expire
+        self.resendTimer = None
+
+        # Checks whether the Client has stopped responding, from the start,
+        # so a Client that never finishes the handshake is not waited on
+        # forever
+        self.brokenTimer = self.loop.call_later(
+            self.brokenTimeout(), self.checkBroken)
+    # End of constructor()
+
+    @property
+    def srtt(self):
         """
-        Receives a file requested by the Client. 
+        The smoothed round trip time to the Client in seconds, or None if it
+        has not been measured yet.
         """
-        self.lock = Lock()
-        self.sentCounter = dict()
+        return self.rtt.srtt
+    # End of srtt()
 
-        ###################################################################
-        # Obtaining requested files from the Client
-        # If wrong packet received at this time, wait until right packet 
-        # is received before proceeding.
-        ###################################################################
-        for i in range(NUMTRIES):
-            print("Waiting for file request...")
-            
-            (filerequest, address) = self.serverSocket.recvfrom(1024)
-            
-            if self.compareHash(filerequest, 1) and filerequest[0] == FNAME[0]:
-                filenameLen = int.from_bytes(
-                    filerequest[57:66], byteorder='big')
-                filename = filerequest[66:(66 + filenameLen)].decode("UTF-8")
-                self.serverSocket.settimeout(2.0)
-                print("Requested file name: %s" % filename)
-                break
-            
-            if i == (NUMTRIES - 1):
-                print("Could not receive file name from Client")
-                return
+    @property
+    def rto(self):
+        """
+        The current retransmission timeout in seconds.
+        """
+        return self.rtt.rto
+    # End of rto()
+
+    def brokenTimeout(self):
+        """
+        Returns the number of seconds without hearing from the Client after
+        which the connection is assumed to be broken: enough time for a packet
+        to be sent NUMTRIES times.
+        """
+        return max(MINBROKENTIMEOUT, NUMTRIES * self.rtt.rto)
+    # End of brokenTimeout()
+
+    def datagramReceived(self, packet):
+        """
+        Handles a packet sent by the Client, according to its type and the
+        state of the session.
+
+        :type packet: bytes
+        :param packet: the packet received from the Client
+        """
+        self.lastHeard = self.loop.time()
+        self.metrics.count('packetsReceived')
+        self.metrics.count('bytesReceived', len(packet))
+
+        if self.state == 'Handshake':
+            if packet[0] in (FNAME[0], FRESUME[0], FRANGE[0], FDELTA[0]):
+                if self.filesizePacket == None:
+                    self.recvFileRequest(packet)
+                else:
+                    # The file size packet must have been lost
+                    self.sendFileSize()
+            elif packet[0] == FSIG[0]:
+                self.recvSignatures(packet)
+            elif packet[0] == FREADYACK[0]:
+                self.recvReadyAcknowledgement(packet)
+        elif self.state == 'Transfer':
+            if packet[0] == FSACK[0] or packet[0] == FILEACK[0]:
+                self.clientAcknowledgements(packet)
+    # End of datagramReceived()
+
+    def recvFileRequest(self, filerequest):
+        """
+        Reads the name of the file requested by the Client, the integrity
+        checks it offered, the packet size it asked for, the newest version
+        of the header it knows, the compression it asked for and the number of
+        packets it asked to be protected by each parity packet, then sends it
+        the size of the file, along with the check, packet size, version,
+        compression and parity chosen, and the id of the transfer. The packet
+        size and parity group are kept within the Server's limits.
+        A request for a part of the file then holds the number of the part and
+        the number of parts, and the Client is told which range of bytes the
+        part covers. A request to resume, or for a part, then holds the size
+        of the file the Client was receiving and the index of the first byte
+        it does not have yet. The transfer resumes from there if the file
+        still has the same size, and the Client is told where it resumes from.
+        A request for the changes from the Client's old copy of the file then
+        holds the size of the blocks of the old copy and the number of packets
+        their signatures were sent in. Once they have all arrived, a delta is
+        built and sent instead of the file, and the Client is told the size
+        of the file it rebuilds.
+
+        :type filerequest: bytes
+        :param filerequest: the file name packet sent by the Client
+        """
+        if not self.server.compareHash(filerequest, 1):
+            print("Could not receive file name from Client")
+            self.close()
+            return
+        self.request = bytes(filerequest)
+
+        filenameLen = int.from_bytes(filerequest[57:66], byteorder='big')
+        self.filename = filerequest[66:(66 + filenameLen)].decode("UTF-8")
+        # The integrity checks offered by the Client follow the name
+        offer = Integrity.decodeOffer(filerequest[(66 + filenameLen):])
+        self.checksum = Integrity.choose(offer)
+        print("Requested file name: %s" % self.filename)
+        print("Using %s to check packets" % self.checksum.name)
 
         ###################################################################
         # Sending the acknowledgment to the Client, including fileSize
         ###################################################################
-        filesize = os.path.getsize("files/" + filename)
+        try:
+            filesize = os.path.getsize("files/" + self.filename)
+        except OSError:
+            print("Requested file %s does not exist" % self.filename)
+            self.close()
+            return
+
+        # The part asked for, and the progress of the Client, follow the
+        # integrity check offer
+        position = 66 + filenameLen + 1 + filerequest[66 + filenameLen]
+        packetSize = int.from_bytes(
+            filerequest[position:(position + 9)], byteorder='big')
+        if packetSize > 0:
+            self.packetSize = min(MAXPACKETSIZE,
+                                  max(MINPACKETSIZE, packetSize))
+            print("Using %d byte packets" % self.packetSize)
+        position += 9
+        version = filerequest[position]
+        self.wireFormat = WireFormat.choose(version)
+        if self.wireFormat.version >= WireFormat.BINARY:
+            self.sessionId = random.getrandbits(32)
+        position += 1
+        codecCode = filerequest[position]
+        if codecCode in Compression.CODECS:
+            self.codec = Compression.CODECS[codecCode]
+            self.level = self.codec.chooseLevel(filerequest[position + 1])
+            print("Compressing packets with %s at level %d" %
+                  (self.codec.name, self.level))
+        position += 2
+        # Parity needs the length field of the binary header
+        fecGroup = filerequest[position]
+        if (fecGroup >= FEC.MINGROUPSIZE and
+            self.wireFormat.version >= WireFormat.BINARY):
+            self.fecGroup = min(fecGroup, FEC.MAXGROUPSIZE, WINDOWSIZE)
+            print("Sending a parity packet every %d packets" % self.fecGroup)
+        position += 1
+        self.sendPath = "files/" + self.filename
+        if filerequest[0] == FDELTA[0]:
+            blockSize = int.from_bytes(
+                filerequest[position:(position + 9)], byteorder='big')
+            chunks = int.from_bytes(
+                filerequest[(position + 9):(position + 18)], byteorder='big')
+            if (self.building == None and not self.deltaBuilt and
+                len(self.signatures) < chunks):
+                print("Waiting for %d more signature packets" %
+                      (chunks - len(self.signatures)))
+                self.pendingRequest = filerequest
+                return
+            if not self.deltaBuilt:
+                if not self._buildDelta(filerequest, blockSize, chunks):
+                    self.close()
+                return
+            self.sendPath = self.deltaPath
+            targetSize = filesize
+            filesize = os.path.getsize(self.deltaPath)
+        if filerequest[0] == FRANGE[0]:
+            part = int.from_bytes(
+                filerequest[position:(position + 9)], byteorder='big')
+            parts = int.from_bytes(
+                filerequest[(position + 9):(position + 18)], byteorder='big')
+            if not 0 <= part < parts:
+                print("Invalid part %d of %d requested" % (part, parts))
+                self.close()
+                return
+            (self.startOffset, self.endOffset) = partRange(
+                filesize, part, parts)
+            print("Requested bytes %d to %d" %
+                  (self.startOffset, self.endOffset))
+            position += 18
+        if filerequest[0] == FRESUME[0] or filerequest[0] == FRANGE[0]:
+            resumeSize = int.from_bytes(
+                filerequest[position:(position + 9)], byteorder='big')
+            offset = int.from_bytes(
+                filerequest[(position + 9):(position + 18)], byteorder='big')
+            end = filesize if self.endOffset == None else self.endOffset
+            if resumeSize == filesize and self.startOffset <= offset <= end:
+                self.startOffset = offset
+                print("Resuming %s from byte %d" % (self.filename, offset))
         filesizePacket = []
         filesizePacket.extend(FSIZE)
         filesizePacket.extend([0]*56)
         filesizePacket.extend(filesize.to_bytes(9, byteorder='big'))
+        # Clients that offered integrity checks are told which one was chosen
+        if not offer == []:
+            filesizePacket.append(self.checksum.code)
+        # Clients that asked for a packet size are told which one was chosen
+        if packetSize > 0:
+            filesizePacket.extend(self.packetSize.to_bytes(9, byteorder='big'))
+        # Clients that offered a version are told which one was chosen, and
+        # the id of the transfer if the header holds it
+        if version > 0:
+            filesizePacket.append(self.wireFormat.version)
+            if self.wireFormat.version >= WireFormat.BINARY:
+                filesizePacket.extend(
+                    self.sessionId.to_bytes(4, byteorder='big'))
+        # Clients that asked for compression are told which codec was chosen,
+        # 0 if none, and the level
+        if codecCode > 0:
+            filesizePacket.append(
+                Compression.NONE if self.codec == None else self.codec.code)
+            filesizePacket.append(self.level)
+        # Clients that asked for parity are told how many packets each parity
+        # packet protects, 0 if none are sent
+        if fecGroup > 0:
+            filesizePacket.append(self.fecGroup)
+        # Clients resuming a transfer are told where it resumes from, and
+        # Clients asking for a part where it ends
+        if filerequest[0] == FRESUME[0] or filerequest[0] == FRANGE[0]:
+            filesizePacket.extend(self.startOffset.to_bytes(9, byteorder='big'))
+        if filerequest[0] == FRANGE[0]:
+            filesizePacket.extend(self.endOffset.to_bytes(9, byteorder='big'))
+        # Clients asking for a delta are told the size of the file it rebuilds
+        if filerequest[0] == FDELTA[0]:
+            filesizePacket.extend(targetSize.to_bytes(9, byteorder='big'))
         # Attach hash to packet
-        hashBytes = self.calculateHash(filesizePacket).encode("ISO-8859-1")
-        print("Filesizepacket hash %s" % hashBytes)
+        hashBytes = self.server.calculateHash(filesizePacket).encode(
+            "ISO-8859-1")
         for i in range(56):
             filesizePacket[1 + i] = hashBytes[i]
-        filesizePacket = bytes(filesizePacket)
-        self.serverSocket.sendto(filesizePacket, address)
-        print("Sent fileSize packet to Client")
+        self.filesizePacket = bytes(filesizePacket)
+        self.sendFileSize()
+    # End of recvFileRequest()
 
-        ######################################################################
-        # Receiving ready signal from Client
-        ######################################################################
-        for i in range(NUMTRIES):
-            print("Waiting for ready acknowledgement from Client...")
-            
+    def recvSignatures(self, packet):
+        """
+        Receives a packet of signatures of the blocks of the Client's old copy
+        of the file, and handles the delta request once every packet of
+        signatures has arrived, if it arrived before them.
+
+        :type packet: bytes
+        :param packet: the signature packet sent by the Client
+        """
+        if not self.server.compareHash(packet, 1):
+            return
+        # The delta is being built from the signatures already
+        if not self.building == None or self.deltaBuilt:
+            return
+
+        chunk = int.from_bytes(packet[57:66], byteorder='big')
+        chunks = int.from_bytes(packet[66:75], byteorder='big')
+        if chunk >= chunks or chunk in self.signatures:
+            return
+        self.signatureBytes += len(packet) - 75
+        if self.signatureBytes > MAXSIGNATUREBYTES:
+            print("Client sent more than %d bytes of signatures" %
+                  MAXSIGNATUREBYTES)
+            self.close()
+            return
+        self.signatures[chunk] = packet[75:]
+
+        if not self.pendingRequest == None and len(self.signatures) == chunks:
+            request = self.pendingRequest
+            self.pendingRequest = None
+            self.recvFileRequest(request)
+    # End of recvSignatures()
+
+    def _buildDelta(self, filerequest, blockSize, chunks):
+        """
+        Starts building the delta that rebuilds the requested file from the
+        Client's old copy, in a temporary file that is sent in place of the
+        requested file, unless it is being built already. Scanning a large
+        file takes a while, so the delta is built in a worker process, and
+        the Client is told to keep waiting each time it asks again. The
+        request is answered once the delta is built. Returns False if the
+        delta cannot be built.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type filerequest: bytes
+        :param filerequest: the delta request sent by the Client
+
+        :type blockSize: int
+        :param blockSize: the size of the blocks of the old copy
+
+        :type chunks: int
+        :param chunks: the number of packets the signatures were sent in
+        """
+        if not Delta.MINBLOCKSIZE <= blockSize <= Delta.MAXBLOCKSIZE:
+            print("Invalid block size %d for a delta" % blockSize)
+            return False
+
+        if self.building == None:
+            signatures = b''.join(self.signatures[chunk]
+                                  for chunk in range(chunks))
+            self.signatures = {}
+            if self.deltaPath == None:
+                (fd, self.deltaPath) = tempfile.mkstemp(
+                    suffix=Delta.EXTENSION)
+                os.close(fd)
             try:
-                (fready, address) = self.serverSocket.recvfrom(66)
-            except socket.timeout:
-                print("Socket timed out when receiving ready acknowledgment.")
-                self.serverSocket.settimeout(None)
-                return
-            
-            if fready[0] == FREADYACK[0] and self.compareHash(fready, 1):
-                print("Client ready to receive file.")
-                break
-            else:
-                self.serverSocket.sendto(filesizePacket, address)
-            
-            if i == (NUMTRIES - 1):
-                print("Could not receive ready acknowledgement from Client")
-                return
-        
+                self.building = self.server.encodeDelta(
+                    self.sendPath, blockSize, signatures, self.deltaPath)
+            except (OSError, RuntimeError) as error:
+                print("Could not start building a delta: %s" % error)
+                return False
+            self.building.add_done_callback(
+                lambda building: self._deltaBuilt(filerequest, building))
+        self.sendWait()
+        return True
+    # End of _buildDelta()
+
+    def _deltaBuilt(self, filerequest, building):
+        """
+        Answers the delta request once the delta has been built, or ends the
+        session if it could not be built.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type filerequest: bytes
+        :param filerequest: the delta request sent by the Client
+
+        :type building: asyncio.Future
+        :param building: the building of the delta, done
+        """
+        self.building = None
+        # The session ended while the delta was being built
+        if self.state == 'Done':
+            if os.path.exists(self.deltaPath):
+                os.remove(self.deltaPath)
+            return
+        if building.cancelled():
+            self.close()
+            return
+        try:
+            copied = building.result()
+        except Exception as error:
+            print("Could not build a delta of %s: %s" % (self.filename, error))
+            self.close()
+            return
+        self.deltaBuilt = True
+        print("Sending a delta of %s, copying %d bytes from the old copy" %
+              (self.filename, copied))
+        self.recvFileRequest(filerequest)
+    # End of _deltaBuilt()
+
+    def sendWait(self):
+        """
+        Tells the Client the delta it asked for is still being built, so it
+        keeps waiting for the file size.
+        """
+        if self.waitPacket == None:
+            waitPacket = []
+            waitPacket.extend(FWAIT)
+            waitPacket.extend([0]*56)
+            hashBytes = self.server.calculateHash(waitPacket).encode(
+                "ISO-8859-1")
+            for i in range(56):
+                waitPacket[1 + i] = hashBytes[i]
+            self.waitPacket = bytes(waitPacket)
+        self.server.transport.sendto(self.waitPacket, self.address)
+    # End of sendWait()
+
+    def sendFileSize(self):
+        """
+        Sends the file size packet to the Client, and sends it again if the
+        Client does not answer with a ready acknowledgement in time. Gives up
+        on the Client after NUMTRIES tries.
+        """
+        self._cancelTimers()
+        if self.filesizeTries == NUMTRIES:
+            print("Could not receive ready acknowledgement from Client")
+            self.close()
+            return
+
+        if self.filesizeTries > 0:
+            self.rtt.backoff()
+            if not self.trace == None:
+                self.trace.record(Trace.TIMEOUT, FSIZE[0], self.sessionId, 0,
+                                  self.filesizeTries)
+        self.server.transport.sendto(self.filesizePacket, self.address)
+        self.filesizeTries += 1
+        self.filesizeSentTime = self.loop.time()
+        print("Sent fileSize packet to Client")
+
+        self.resendTimer = self.loop.call_later(
+            self.rtt.rto, self.sendFileSize)
+    # End of sendFileSize()
+
+    def recvReadyAcknowledgement(self, fready):
+        """
+        Builds the sliding window once the Client is ready to receive the
+        file, and starts sending it. The ready acknowledgement is a copy of
+        the file size packet, so one that does not match it, such as one left
+        over from an earlier session with another session id, is ignored.
+
+        :type fready: bytes
+        :param fready: the ready acknowledgement sent by the Client
+        """
+        if self.filesizePacket == None or not self.server.compareHash(
+                fready, 1):
+            return
+        if not fready[57:] == self.filesizePacket[57:]:
+            self.metrics.count('staleAcks')
+            return
+
+        print("Client ready to receive file.")
+        self._cancelTimers()
+
+        # The handshake gives the first round trip time sample, as long as
+        # the fileSize packet was only sent once
+        if self.filesizeTries == 1:
+            rtt = self.loop.time() - self.filesizeSentTime
+            self.rtt.sample(rtt)
+            self.metrics.observe('rtt', rtt)
+
+        # A delta is only sent once, so it is not cached
+        sharedCache = self.server.cache
+        if not self.deltaPath == None:
+            sharedCache = None
         self.slidingWindow = window.SlidingWindow(
-            "files/" + filename, mode='Server')
+            self.sendPath, packetSize=self.packetSize,
+            mode='Server', windowSize=WINDOWSIZE,
+            tagSize=self.checksum.size, startOffset=self.startOffset,
+            endOffset=self.endOffset, wireFormat=self.wireFormat,
+            sessionId=self.sessionId, codec=self.codec, level=self.level,
+            fecGroup=self.fecGroup, cache=sharedCache, trace=self.trace,
+            verbose=self.server.verbose)
 
-        # Thread to handle sending packets to the client
-        self.sendThread = Thread(target=self.HandleClients, args=(address, ))
-        self.sendThread.daemon = True
-        self.sendThread.start()
+        # Decides how much of the sliding window is sent at a time
+        self.congestion = CongestionController(WINDOWSIZE)
+        if self.server.pacing:
+            self.pacer = Pacer(self.packetSize, self.server.pacingRate)
 
-        # Thread to handle acknowledgments from the client
-        self.ackThread = Thread(target=self.clientAcknowledgements)
-        self.ackThread.daemon = True
-        self.ackThread.start()
+        self.state = 'Transfer'
+        self.transferStarted = self.loop.time()
+        print("Sliding Window set up on connection from %s" % self.address[0])
 
-        print("Sliding Window set up on connection from %s" % address[0])
-        
-        self.sendThread.join()
-        self.ackThread.join()
-    # End of serverInstance()
-        
-    def HandleClients(self, address):
-        '''
-        Handles the transfer of the files from server to serverSocket
+        # The Client already had the whole file
+        if self.slidingWindow.isDone():
+            print("Finished sending file to %s" % self.address[0])
+            self.close()
+            return
 
-        TO-DO
-        - Receive file request from the client - DONE
-        - Read from local file and save in memory - DONE
-        - Instantiate a sliding window to keep track of packets sent - DONE
-        - Finish send and potentially wait for another client request
+        self.brokenTimer = self.loop.call_later(
+            self.brokenTimeout(), self.checkBroken)
+        self.handleClient()
+    # End of recvReadyAcknowledgement()
 
+    def handleClient(self):
         '''
-        print("Handling a Client")
-
-        self.lock.acquire()
-        packets = self.slidingWindow.getPackets()
-        self.lock.release()
-        while not packets == []:
-            #time.sleep(1)
-            print("Num packets in sliding window: %d" % len(packets))
-            for packet in packets:
-                if not self.sendFilePacket(packet, address):
+        Sends every packet that is due to be sent: packets that have not been
+        sent yet and fit in the congestion window, and packets whose timers
+        have expired. The parity of each group of packets is sent right after
+        the last packet of the group is first sent. If the session is paced,
+        only as many packets as the pacer lets out are sent. Then schedules
+        itself to run again when the next timer expires, or when the pacer
+        lets out the packets held back. Also run whenever an acknowledgement
+        slides the window.
+        '''
+        if not self.state == 'Transfer':
+            return
+
+        now = self.loop.time()
+        allowed = None
+        if not self.pacer == None:
+            self.pacer.update(self.congestion.window(), self.rtt.srtt,
+                              self.congestion.inSlowStart())
+            allowed = self.pacer.allowance(now)
+            self.metrics.set('pacingRate', self.pacer.rate)
+        packets = self.slidingWindow.getDuePackets(
+            self.rtt.rto, self.congestion.window(), now,
+            None if allowed == None else allowed + 1)
+        # One packet more than the pacer lets out is asked for, to tell
+        # whether any are held back
+        heldBack = not allowed == None and len(packets) > allowed
+        if heldBack:
+            packets = packets[:allowed]
+            self.metrics.count('pacerDelays')
+        if self.server.verbose and not packets == []:
+            print("Num packets due to be sent: %d" % len(packets))
+
+        # Due packets are sent together, so they can go out as a batch
+        burst = []
+        for (index, packet) in packets:
+            sendCount = self.slidingWindow.sendCount(index)
+            if sendCount > 0:
+                if sendCount == NUMTRIES:
+                    print("Client not receiving packet after 5 tries.")
+                    self.close()
                     return
-            time.sleep(0.1)
-            self.lock.acquire()
-            packets = self.slidingWindow.getPackets()
-            self.lock.release()
-        print("Packets left in sliding window: %d" % len(packets))
-        return
-    # End of handleClients()
+                # Timer of the packet expired, so it was lost
+                self.metrics.count('retransmits')
+                if self.congestion.onLoss(index, self.slidingWindow.end):
+                    self.metrics.count('windowCuts')
+                    self._traceCut(index)
+                    self.rtt.backoff()
+            burst.append(packet)
+            self.slidingWindow.recordSend(index, now)
+            if not self.pacer == None:
+                self.pacer.consume(len(packet))
+            if not self.trace == None:
+                self.trace.record(Trace.RESEND if sendCount > 0 else
+                                  Trace.SEND, packet[0], self.sessionId,
+                                  index, len(packet))
+            if sendCount == 0:
+                self.inFlight += 1
+                parity = self.slidingWindow.parityAfter(index)
+                if not parity == None:
+                    self.metrics.count('parityPackets')
+                    burst.append(parity)
+                    if not self.pacer == None:
+                        self.pacer.consume(len(parity))
+                    if not self.trace == None:
+                        self.trace.record(
+                            Trace.PARITY, parity[0], self.sessionId,
+                            self.wireFormat.unpack(parity)[2], len(parity))
+        self.sendFilePackets(burst)
+
+        # How much of the windows the packets in flight take up
+        self.metrics.set('congestionWindow', self.congestion.window())
+        self.metrics.set('inFlight', self.inFlight)
+        if not burst == []:
+            self.metrics.observe('inFlight', self.inFlight,
+                                 Metrics.COUNTBUCKETS)
+            self.metrics.observe('burst', len(burst), Metrics.COUNTBUCKETS)
 
-    def clientAcknowledgements(self):
+        # Run again when the next timer expires, or sooner if the pacer held
+        # back packets
+        if not self.resendTimer == None:
+            self.resendTimer.cancel()
+        expiry = self.slidingWindow.nextExpiry(
+            self.rtt.rto, self.congestion.window())
+        if expiry == None:
+            expiry = now + self.rtt.rto
+        if heldBack:
+            expiry = min(expiry, self.pacer.nextSend(now))
+        self.resendTimer = self.loop.call_at(expiry, self.handleClient)
+    # End of handleClient()
+
+    def clientAcknowledgements(self, packet):
         """
-        Receives acknowledgements from the Client, and marks the sliding
-        window packets as received by the Client.
+        Handles an acknowledgement from the Client, and marks the sliding
+        window packets as received by the Client, a whole range of packets at a
+        time. New acknowledgements grow the congestion window, and
+        acknowledgements that skip over a packet shrink it.
+
+        :type packet: bytes
+        :param packet: the acknowledgement sent by the Client
         """
-        while 1:
-            index = self.recvFileAcknowledgement()
-            
-            if not (index == -1 or index == -2):
-                self.lock.acquire()
-                self.slidingWindow.mark(index)
-                self.lock.release()
-                
-                if self.slidingWindow.isDone():
-                    print("Finished sending file")
-                    self.serverSocket.settimeout(None)
-                    break
-            if index == -2:
-                print("Connection assumed to be broken")
-                return
-        return
+        (cumulative, bitmap) = self.recvFileAcknowledgement(packet)
+        if cumulative == -1:
+            return
+
+        now = self.loop.time()
+        newlyMarked = self.slidingWindow.markSelective(cumulative, bitmap)
+        if not self.trace == None:
+            self.trace.record(Trace.ACK, packet[0], self.sessionId,
+                              cumulative, len(newlyMarked))
+        if newlyMarked == []:
+            return
+
+        self.metrics.count('packetsAcked', len(newlyMarked))
+        self.inFlight = max(0, self.inFlight - len(newlyMarked))
+
+        # Acknowledgements of packets that were only sent once are used to
+        # measure the round trip time, using the most recently sent one
+        latest = None
+        for index in newlyMarked:
+            self.congestion.onAck()
+            if self.slidingWindow.sendCount(index) == 1:
+                sentTime = self.slidingWindow.sentTime(index)
+                if latest == None or sentTime > latest:
+                    latest = sentTime
+        if not latest == None:
+            self.rtt.sample(now - latest)
+            self.metrics.observe('rtt', now - latest)
+
+        # An acknowledgement this far past the first packet of the window
+        # means that packet was most likely lost
+        start = self.slidingWindow.start
+        if (not self.slidingWindow.isMarked(start) and
+            newlyMarked[-1] - start >= DUPTHRESH * self.slidingWindow.dataSize):
+            if self.congestion.onLoss(start, self.slidingWindow.end):
+                self.metrics.count('windowCuts')
+                self._traceCut(start)
+
+        self.slidingWindow.slideServer()
+
+        if self.slidingWindow.isDone():
+            print("Finished sending file to %s" % self.address[0])
+            self.close()
+            return
+
+        # The window slid, so there may be new packets to send
+        self.handleClient()
     # End of clientAcknowledgements()
-    
-    def sendFilePacket(self, packet, address):
+
+    def sendFilePackets(self, packets):
         """
-        Inserts the hash for a packet and sends it to the client. 
-        
-        :type packet: a list of bytes
-        :param packet: the packet to be sent, with the hash positions zeroed out
-        
-        :type address: (string, int) tuple
-        :param address: the address to which the packet will be sent
+        Inserts the hash/checksum negotiated for the transfer into each packet
+        and sends them to the client, in as few system calls as possible.
+        Resends are decided by the caller, from the timers kept in the sliding
+        window.
+
+        :type packets: list of writable bytes-like objects
+        :param packets: the packets to be sent, as views of the sliding window,
+                        and the parity packets built by it
         """
-        packet[0] = FPACKET[0]
-        
-        # Removing unused bytes from packet
-        while packet[-1] == None:
-            del packet[-1]
-            
-        hashBytes = self.calculateHash(packet).encode("ISO-8859-1")
-        
-        # Adding hash to the packet
-        for i in range(56):
-            packet[i + 10] = hashBytes[i]
-            
-        index = int.from_bytes(packet[1:10], byteorder='big')
-        
-        if index in self.sentCounter:
-            if self.sentCounter[index] == NUMTRIES:
-                print("Client not receiving packet after 5 tries.")
-                return False
-            else:
-                self.sentCounter[index] += 1
-        else:
-            self.sentCounter[index] = 1
-        
-        print("Sending packet: %d starting with %d" %
-            (int.from_bytes(packet[1:10], byteorder='big'), packet[0]))
-            
-        self.serverSocket.sendto(bytes(packet), address)
+        for packet in packets:
+            # Adding hash to the packet, after the header written by the
+            # sliding window
+            self.checksum.sign(packet, self.wireFormat.headerSize)
+
+            if self.server.verbose:
+                print("Sending packet: %d starting with %d" %
+                    (self.wireFormat.unpack(packet)[2], packet[0]))
+            self.metrics.count('bytesSent', len(packet))
+
+        self.metrics.count('packetsSent', len(packets))
+
+        self.server.sender.send(packets, self.address)
         return True
-    # End of sendFilePacket()
-    
-    def recvFileAcknowledgement(self):
+    # End of sendFilePackets()
+
+    def recvFileAcknowledgement(self, packet):
         """
-        Receives a file acknowledgement from the Client. Checks the hash of the 
-        packet, and returns the index of the acknowledged packet if the 
-        acknowledgement meets all criteria.
+        Checks the hash of a file acknowledgement from the Client, and returns
+        the packets acknowledged as a (cumulative, bitmap) tuple if the
+        acknowledgement meets all criteria: every packet before byte cumulative
+        has been received, as well as every packet whose bit is set in bitmap,
+        where bit i stands for the packet that starts with byte
+        cumulative + i * dataSize. Acknowledgements of a single packet are
+        turned into the same form. Returns (-1, 0) if the packet is not a valid
+        acknowledgement, or belongs to an earlier transfer.
+
+        :type packet: bytes
+        :param packet: the acknowledgement sent by the Client
         """
-        try:
-            (packet, address) = self.serverSocket.recvfrom(66)
-        except socket.timeout:
-            print("Receive operation timed out.")
-            self.serverSocket.settimeout(None)
-            return -2
-        
+        tagStart = self.wireFormat.headerSize
+        if len(packet) < tagStart + self.checksum.size:
+            return (-1, 0)
+
+        (packetType, sessionId, offset, length) = self.wireFormat.unpack(packet)
+        if not (packetType == FSACK[0] or packetType == FILEACK[0]):
+            return (-1, 0)
+        if not self.server.compareHash(packet, tagStart, self.checksum):
+            self.metrics.count('hashFailures')
+            if not self.trace == None:
+                self.trace.record(Trace.CORRUPT, packetType, self.sessionId,
+                                  0, len(packet))
+            return (-1, 0)
+
+        if not sessionId == self.sessionId:
+            if self.server.verbose:
+                print("Received acknowledgement of an earlier transfer")
+            self.metrics.count('staleAcks')
+            return (-1, 0)
+        self.metrics.count('acksReceived')
+
+        # If it is a selective acknowledgement packet
+        if packetType == FSACK[0]:
+            cumulative = offset
+            bitmap = int.from_bytes(
+                packet[(tagStart + self.checksum.size):], byteorder='little')
+            if self.server.verbose:
+                print("Received acknowledgment from %s up to packet %d" %
+                          (self.address[0], cumulative))
+            return (cumulative, bitmap)
+
         # If it is an acknowledgement packet
-        if packet[0] == FILEACK[0] and self.compareHash(packet, start=10):
-            index = int.from_bytes(packet[1:10], byteorder='big')
-            print("Received acknowledgment from %s for packet %d" % 
-                      (address[0], index))
-            return index 
-        else:
-            return -1
+        if packetType == FILEACK[0]:
+            index = offset
+            if self.server.verbose:
+                print("Received acknowledgment from %s for packet %d" %
+                          (self.address[0], index))
+
+            start = self.slidingWindow.start
+            slot = self.slidingWindow.slotOf(index)
+            if slot == -1:
+                return (start, 0)
+            return (start, 1 << slot)
+
+        return (-1, 0)
     # End of recvFileAcknowledgement()
-    
+
+    def checkBroken(self):
+        """
+        Ends the session if the Client has not been heard from in
+        brokenTimeout() seconds, and checks again later if it has.
+        """
+        self.brokenTimer = None
+        if self.state == 'Done':
+            return
+
+        timeout = self.brokenTimeout()
+        silence = self.loop.time() - self.lastHeard
+        if silence >= timeout:
+            print("Connection to %s assumed to be broken" % self.address[0])
+            if not self.trace == None:
+                start = 0
+                if not self.slidingWindow == None:
+                    start = self.slidingWindow.start
+                self.trace.record(Trace.TIMEOUT, 0, self.sessionId, start, 0)
+            self.close()
+            return
+        self.brokenTimer = self.loop.call_later(
+            timeout - silence, self.checkBroken)
+    # End of checkBroken()
+
+    def _traceCut(self, index):
+        """
+        Records that the congestion window was cut after the packet that
+        starts with byte index was lost.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        if self.server.verbose:
+            print("Packet %d lost, congestion window cut to %d" %
+                  (index, self.congestion.window()))
+        if not self.trace == None:
+            self.trace.record(Trace.CUT, 0, self.sessionId, index,
+                              self.congestion.window())
+    # End of _traceCut()
+
+    def _cancelTimers(self):
+        """
+        Cancels every timer set by the session.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        if not self.resendTimer == None:
+            self.resendTimer.cancel()
+            self.resendTimer = None
+        if not self.brokenTimer == None:
+            self.brokenTimer.cancel()
+            self.brokenTimer = None
+    # End of _cancelTimers()
+
+    def snapshot(self):
+        """
+        Returns the state of the session and what it has counted so far, as a
+        dict that can be written as JSON. The goodput is the number of bytes
+        the Client has acknowledged per second since the file started being
+        sent.
+        """
+        now = self.loop.time()
+        snapshot = {
+            'client': "%s:%d" % self.address,
+            'file': self.filename,
+            'state': self.state,
+            'seconds': now - self.started,
+            'packetSize': self.packetSize,
+            'srtt': self.rtt.srtt,
+            'rto': self.rtt.rto,
+        }
+        if not self.slidingWindow == None:
+            acked = self.slidingWindow.start - self.slidingWindow.origin
+            elapsed = now - self.transferStarted
+            snapshot['fileSize'] = self.slidingWindow.fileSize
+            snapshot['bytesAcked'] = acked
+            snapshot['goodput'] = acked / elapsed if elapsed > 0 else None
+        snapshot.update(self.metrics.snapshot())
+        return snapshot
+    # End of snapshot()
+
+    def close(self):
+        """
+        Ends the session: cancels its timers, closes the file being sent,
+        deletes the delta sent in its place, if any, and removes the session
+        from the Server. Safe to call more than once.
+        """
+        self._cancelTimers()
+        self.state = 'Done'
+        if not self.slidingWindow == None:
+            self.slidingWindow.close()
+        if not self.deltaPath == None and os.path.exists(self.deltaPath):
+            os.remove(self.deltaPath)
+        self.server.removeSession(self)
+    # End of close()
+
+# End of ServerSession class
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    """
+    Hands every packet received on the Server's socket over to the Server.
+    """
+
+    def __init__(self, server):
+        """
+        Initializes a ServerProtocol for the given Server.
+
+        :type server: Server
+        :param server: the Server the packets are handed over to
+        """
+        self.server = server
+    # End of constructor()
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+    # End of connection_made()
+
+    def datagram_received(self, data, addr):
+        self.server.datagramReceived(data, addr)
+    # End of datagram_received()
+
+    def error_received(self, exc):
+        print("Error on server socket: %s" % exc)
+    # End of error_received()
+
+# End of ServerProtocol class
+
+class Server(object):
+    """
+    An FTP Server implementing the Sliding Window protocol to ensure
+    data reliability. Any number of Clients are served at the same time from
+    a single socket and event loop, with a ServerSession for each Client
+    address.
+
+    author: Frank Derry Wanye
+    author: Gloire Rubambiza
+
+    date: 12/05/2016
+    """
+
+    def __init__(self, addr=None, port=None, reusePort=False,
+                 cacheBudget=cache.BUDGET, statsPort=None, trace=None,
+                 pacing=True, pacingRate=None, verbose=False):
+        """
+        Initializes a Server on the given address and port number, asking for
+        them if they are not given. Requests are not served until start(),
+        serve() or run() is called.
+
+        :type addr: string
+        :param addr: the address the server is being set up on
+
+        :type port: int
+        :param port: the port number the server listens on
+
+        :type reusePort: bool
+        :param reusePort: lets other Servers listen on the same port, with
+                          the kernel spreading Clients between them by
+                          address. See runWorkers().
+
+        :type cacheBudget: int
+        :param cacheBudget: the number of bytes of prepared packets kept in
+                            memory for later transfers of the same files. 0
+                            turns off the cache, along with keeping files
+                            open between transfers.
+
+        :type statsPort: int
+        :param statsPort: the port number of the stats socket, on which a
+                          snapshot of the Server is sent as JSON to every
+                          connection from this machine. See snapshot(). None
+                          for no stats socket.
+
+        :type trace: Trace.Tracer
+        :param trace: records what happens to every packet of every session,
+                      if given. The records held in memory are written out
+                      whenever a session fails, and when the Server is
+                      closed, but the Tracer is left for the caller to close.
+
+        :type pacing: bool
+        :param pacing: spaces out the packets of each session, instead of
+                       sending every packet that is due in one burst
+
+        :type pacingRate: float
+        :param pacingRate: the number of bytes per second each session sends
+                           at most. By default, the rate follows the
+                           congestion window of the session, which is sent
+                           over one round trip time.
+
+        :type verbose: bool
+        :param verbose: prints every packet sent and acknowledged, every
+                        corrupted packet and every cut of a congestion window,
+                        which slows fast transfers down
+        """
+        if addr == None:
+            addr = input("What address is the server being set up on?\n")
+        if port == None:
+            port = input("What port number would you like to connect to?\n")
+
+        # The address and port number the Server listens on
+        self.addr = addr
+        self.port = int(port)
+        self.reusePort = reusePort
+
+        # The transfers in progress, by Client address
+        self.sessions = {}
+
+        # Keeps the files being sent open, and the packets prepared from
+        # them, for later transfers of the same files
+        self.cache = None
+        if cacheBudget > 0:
+            self.cache = cache.PacketCache(cacheBudget)
+
+        # The totals of every session that has ended, along with what
+        # happens outside of sessions, and the port of the stats socket
+        self.metrics = Metrics.Metrics()
+        self.statsPort = statsPort
+
+        # Records what happens to every packet, None if not traced
+        self.trace = trace
+
+        # Whether the packets of each session are spaced out, and the rate
+        # they are sent at, None to follow the congestion window
+        self.pacing = pacing
+        self.pacingRate = pacingRate
+
+        # Whether what happens to each packet is printed
+        self.verbose = verbose
+
+        # The worker processes deltas are built in, started when the first
+        # delta is asked for
+        self.deltaPool = None
+
+        # Set once the Server is started
+        self.loop = None
+        self.transport = None
+        self.sender = None
+        self.statsServer = None
+        self.started = None
+    # End of __init__()
+
+    async def start(self):
+        """
+        Creates the Server socket on the running event loop. Requests are
+        served from then on, for as long as the loop runs.
+        """
+        print ("Creating server socket on port %d, address %s." %
+               (self.port, self.addr))
+        self.loop = asyncio.get_running_loop()
+
+        # The socket is created here rather than by the event loop, so that
+        # packets can be sent in batches straight from it
+        serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.reusePort:
+            serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                SOCKETBUFFERSIZE)
+        serverSocket.bind((self.addr, self.port))
+        serverSocket.setblocking(False)
+        await self.loop.create_datagram_endpoint(
+            lambda: ServerProtocol(self), sock=serverSocket)
+        self.sender = BatchSender(self.transport, serverSocket)
+        self.started = self.loop.time()
+
+        if not self.statsPort == None:
+            self.statsServer = await Metrics.serveStats(
+                self.snapshot, STATSADDRESS, self.statsPort)
+            print("Serving stats on port %d, address %s." %
+                  (self.statsPort, STATSADDRESS))
+    # End of start()
+
+    async def serve(self):
+        """
+        Starts the Server and serves requests until cancelled.
+        """
+        await self.start()
+        print("Waiting for file requests...")
+        try:
+            await asyncio.Future()
+        finally:
+            self.close()
+    # End of serve()
+
+    def run(self):
+        """
+        Serves requests on a new event loop until interrupted.
+        """
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server stopped")
+    # End of run()
+
+    def datagramReceived(self, packet, address):
+        """
+        Hands a packet over to the session of the Client that sent it. A file
+        request from a Client without a session starts a new one.
+
+        :type packet: bytes
+        :param packet: the packet received
+
+        :type address: (string, int) tuple
+        :param address: the address of the Client that sent the packet
+        """
+        if len(packet) == 0:
+            return
+
+        # Probes are echoed straight back, without a session
+        if packet[0] == FPROBE[0]:
+            if self.compareHash(packet, 1):
+                self.transport.sendto(packet, address)
+                self.metrics.count('probesEchoed')
+            return
+
+        session = self.sessions.get(address)
+
+        # A new file name packet in the middle of a transfer means the Client
+        # gave up on it and started over. Only a request that passes its
+        # hash check ends the transfer or starts a session, so a corrupted
+        # acknowledgement that looks like a request is dropped, and so is a
+        # copy of the request the session answered, duplicated or held back
+        # on the way
+        request = packet[0] in (FNAME[0], FRESUME[0], FRANGE[0], FDELTA[0])
+        handshake = request or packet[0] == FSIG[0]
+        if (handshake and (session == None or
+                           not session.state == 'Handshake') and
+            not (len(packet) >= MINREQUESTSIZE and
+                 self.compareHash(packet, 1))):
+            self.metrics.count('requestsDropped')
+            return
+        if (request and not session == None and
+            not session.state == 'Handshake'):
+            if packet == session.request:
+                self.metrics.count('duplicateRequests')
+                return
+            session.close()
+            session = None
+
+        # Signatures of the Client's old copy come before its delta request
+        if session == None:
+            if not handshake:
+                return
+            print("File request from %s:%d" % address)
+            self.metrics.count('sessionsStarted')
+            session = ServerSession(self, address)
+            self.sessions[address] = session
+
+        session.datagramReceived(packet)
+    # End of datagramReceived()
+
+    def removeSession(self, session):
+        """
+        Forgets a session once it has ended.
+
+        :type session: ServerSession
+        :param session: the session that ended
+        """
+        if self.sessions.get(session.address) is session:
+            del self.sessions[session.address]
+            self.metrics.merge(session.metrics)
+            if (not session.slidingWindow == None and
+                session.slidingWindow.isDone()):
+                self.metrics.count('sessionsCompleted')
+            else:
+                self.metrics.count('sessionsFailed')
+                # What led up to the failure is kept, even if the Server
+                # stops before the trace is closed
+                if not self.trace == None:
+                    self.trace.flush()
+    # End of removeSession()
+
+    def snapshot(self):
+        """
+        Returns what the Server has counted, as a dict that can be written as
+        JSON: the totals of every session, ended or in progress, the state of
+        each session in progress, and the use of the packet cache. Counters
+        include the packets and bytes sent and received, retransmits,
+        acknowledgements, hash failures and congestion window cuts, and
+        histograms the round trip times and the packets in flight.
+        """
+        totals = Metrics.Metrics()
+        totals.merge(self.metrics)
+        for session in self.sessions.values():
+            totals.merge(session.metrics)
+        snapshot = {
+            'uptime': self.loop.time() - self.started,
+            'sessionsActive': len(self.sessions),
+            'totals': totals.snapshot(),
+            'sessions': [session.snapshot()
+                         for session in self.sessions.values()],
+        }
+        if not self.cache == None:
+            snapshot['cache'] = {
+                'hits': self.cache.hits, 'misses': self.cache.misses,
+                'bytes': self.cache.used, 'files': len(self.cache.files)}
+        return snapshot
+    # End of snapshot()
+
+    def close(self):
+        """
+        Ends every session in progress and closes the Server socket.
+        """
+        for session in list(self.sessions.values()):
+            session.close()
+        if not self.cache == None:
+            self.cache.close()
+        if not self.statsServer == None:
+            self.statsServer.close()
+        if not self.trace == None:
+            self.trace.flush()
+        if not self.deltaPool == None:
+            self.deltaPool.shutdown(wait=False, cancel_futures=True)
+            self.deltaPool = None
+        if not self.transport == None:
+            self.transport.close()
+    # End of close()
+
+    def encodeDelta(self, path, blockSize, signatures, deltaPath):
+        """
+        Builds a delta with Delta.encode() in one of the worker processes,
+        and returns an asyncio.Future that gets the number of bytes the delta
+        copies from the old copy once it is built. Takes the same parameters
+        as Delta.encode().
+        """
+        if self.deltaPool == None:
+            self.deltaPool = concurrent.futures.ProcessPoolExecutor(
+                DELTAWORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return self.loop.run_in_executor(self.deltaPool, Delta.encode, path,
+                                         blockSize, signatures, deltaPath)
+    # End of encodeDelta()
+
     def getHash(self, packet, start=10):
         """
         Returns a string representation of the hash included in the packet.
@@ -285,44 +1339,44 @@ class Server(object):
         return hashStr
     # End of getHash()
         
-    def compareHash(self, packet, start=10):
+    def compareHash(self, packet, start=10, checksum=None):
         """
         Compares the hash included in the packet with the calculated 
         value of what the hash is supposed to be. Returns True if 
         they are the same, False if they are not, or there is an 
-        error in the function parameters.
+        error in the function parameters. The packet is checked in place,
+        without being copied.
         
-        :type packet: list of bytes
+        :type packet: bytes-like object
         :param packet: the packet containing a hash
         
         :type start: int
         :param start: the position from which the hash function starts
+
+        :type checksum: Integrity.Checksum
+        :param checksum: the integrity check used by the packet. Defaults to
+                         the SHA-224 hash used by the handshake.
         """
+        if checksum == None:
+            checksum = Integrity.CHECKSUMS[Integrity.SHA224]
+
         if packet == None:
             print("Error: no packet given")
             return False
             
-        if len(packet) < (start + 56):
-            print("Error: packet not long enough to contain hash function")
+        if len(packet) < (start + checksum.size):
+            if self.verbose:
+                print("Error: packet not long enough to contain hash function")
             return False
-            
-        hashStr = self.getHash(packet, start)
-        
-        # Convert bytes object to list - bytes object cannot be edited
-        packetList = []
-        packetList.extend(packet)
-        
-        # Zero out hash in packet
-        for i in range(56):
-            packetList[i + start] = 0
-        
-        calcHash = self.calculateHash(packetList)
-        
-        if hashStr == calcHash:
+
+        if checksum.verify(packet, start):
             return True
         else:
-            print("Incorrect hash in packet. Given %s, calculated %s" %
-                  (hashStr, calcHash))
+            if self.verbose:
+                print("Incorrect %s in packet. Given %s, calculated %s" %
+                      (checksum.name,
+                       bytes(packet[start:(start + checksum.size)]),
+                       checksum.calculate(packet, start)))
             return False
     # End of compareHash()
         
@@ -331,7 +1385,7 @@ class Server(object):
         Calculates the hash of the given packet, assuming that the bytes 
         containing the hash are already zeroed out.
         
-        :type packet: a list of bytes | bytes object
+        :type packet: a list of bytes | bytes-like object
         :param packet: the packet to be hashed
         
         :return type: string
@@ -341,11 +1395,48 @@ class Server(object):
             print("Error: no packet given")
             return ""
         
-        packetBytes = bytes(packet)
-        #packetStr = packetBytes.decode("UTF-8")
-        hashStr = hashlib.sha224(packetBytes).hexdigest()
+        # Lists have to be converted, other bytes-like objects are hashed as-is
+        if isinstance(packet, list):
+            packet = bytes(packet)
+        hashStr = hashlib.sha224(packet).hexdigest()
         return hashStr
     # End of calculateHash()
         
+# End of Server class
+
+def runWorkers(addr, port, numWorkers):
+    """
+    Runs numWorkers Servers on the same address and port number, each in a
+    process of its own, so that Clients are served from several cores. The
+    kernel sends every packet from a given Client address to the same
+    Server, so each session stays within one process. Only available where
+    the system supports SO_REUSEPORT.
+
+    :type addr: string
+    :param addr: the address the servers are being set up on
+
+    :type port: int
+    :param port: the port number the servers listen on
+
+    :type numWorkers: int
+    :param numWorkers: the number of Server processes
+    """
+    workers = []
+    for i in range(numWorkers):
+        worker = multiprocessing.Process(
+            target=_runWorker, args=(addr, port))
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+# End of runWorkers()
+
+def _runWorker(addr, port):
+    """
+    Runs one of the Servers started by runWorkers().
+    """
+    Server(addr, port, reusePort=True).run()
+# End of _runWorker()
+
 if __name__ == "__main__":
-    Server()
+    Server().run()
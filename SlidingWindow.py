@@ -1,5 +1,19 @@
 import io # For reading to/from files
 import os # For accessing files
+import mmap # For mapping files being sent into memory
+import time # For timing packets in flight
+from PacketBuffer import PacketBuffer
+import WireFormat
+from Compression import Compressor
+from FEC import ParityGroup, MINGROUPSIZE
+import PacketCache
+import Trace
+
+# The default number of bytes after the header holding the hash/checksum
+HASHSIZE = 56
+
+# The default number of packets kept in the sliding window
+WINDOWSIZE = 5
 
 # The variable inside the parentheses acts like extends in Java
 # Basically, SlidingWindow extends object
@@ -9,13 +23,18 @@ class SlidingWindow(object):
     for enforcing reliability in data communications between two nodes on the
     network.
     Our implementation of the sliding window class builds the sliding window
-    out of a file. Using a dafault packet size of 1024, it makes use of an
-    array of 5 * 1024 bytes. Since it has access to the file, the sliding
-    window automatically slides to the right in increments of 1024 bytes once
-    the first group of 1024 bytes is acknowledged or otherwise removed.
+    out of a file. Using a dafault packet size of 1024 and window size of 5, it
+    keeps 5 packets of 1024 bytes each in a ring of slots in a PacketBuffer.
+    Since it has access to the file, the sliding window automatically slides
+    to the right in increments of one packet once the first packet is
+    acknowledged or otherwise removed, recycling the slot of that packet for
+    the next one.
     """
 
-    def __init__(self, filePath, packetSize=1024, mode='Server', fileSize=None):
+    def __init__(self, filePath, packetSize=1024, mode='Server', fileSize=None,
+                 windowSize=WINDOWSIZE, tagSize=HASHSIZE, startOffset=0,
+                 endOffset=None, wireFormat=None, sessionId=0, codec=None,
+                 level=0, fecGroup=0, cache=None, trace=None, verbose=False):
         """
         Initializes a SlidingWindow object, with a specified file and a
         specified packet size.
@@ -36,11 +55,107 @@ class SlidingWindow(object):
         :param fileSize: the size of the file to be transferred. This only
                          needs to be provided if the SlidingWindow is being
                          set up to receive a file.
+
+        :type windowSize: int
+        :param windowSize: the number of packets kept in the sliding window.
+                           The Client's window should be at least as large as
+                           the Server's, or packets will be dropped.
+
+        :type tagSize: int
+        :param tagSize: the number of bytes after the index of each packet
+                        taken up by its hash/checksum, which depends on the
+                        integrity check negotiated for the transfer
+
+        :type startOffset: int
+        :param startOffset: the index of the first byte of the file to be
+                            transferred, for resuming a transfer. Everything
+                            before it is assumed to have been received
+                            already, so a Client window keeps the file's
+                            existing contents instead of truncating it.
+
+        :type endOffset: int
+        :param endOffset: the index of the byte after the last byte to be
+                          transferred, for transferring a range of the file.
+                          The window treats it as the end of the file, and a
+                          Client window keeps the file's existing contents.
+                          Defaults to the end of the file.
+
+        :type wireFormat: WireFormat.LegacyFormat | WireFormat.BinaryFormat
+        :param wireFormat: the format of the header of each packet, as
+                           negotiated for the transfer. Defaults to the
+                           legacy format.
+
+        :type sessionId: int
+        :param sessionId: the id of the transfer, written into the header of
+                          each packet by the Server
+
+        :type codec: Compression.Codec
+        :param codec: the codec negotiated for compressing file packets, or
+                      None if they are sent as they are
+
+        :type level: int
+        :param level: the level the Server compresses file packets at
+
+        :type fecGroup: int
+        :param fecGroup: the number of file packets protected by each parity
+                         packet, or 0 if no parity is sent
+
+        :type cache: PacketCache.PacketCache
+        :param cache: on the Server, shares the mapped file and the packets
+                      prepared from it with other transfers of the same file
+
+        :type trace: Trace.Tracer
+        :param trace: records every slide of the window, and every packet
+                      recovered from parity, if given
+
+        :type verbose: bool
+        :param verbose: prints every packet that is a duplicate, outside the
+                        window or recovered from parity
         """
 
         # The size of each packet
         self.packetSize = packetSize
 
+        # The format of the header of each packet, and the id of the transfer
+        # written into it
+        if wireFormat == None:
+            wireFormat = WireFormat.FORMATS[WireFormat.LEGACY]
+        self.wireFormat = wireFormat
+        self.sessionId = sessionId
+
+        # The codec file packets may be compressed with, and on the Server,
+        # the Compressor that decides which packets are worth compressing
+        self.codec = codec
+        self.compressor = None
+        if not codec == None and mode == 'Server':
+            self.compressor = Compressor(codec, level)
+
+        # The number of file packets protected by each parity packet, the
+        # groups of packets not complete yet, by the index of their first
+        # packet, and on the Server, the parity packets not sent yet, by the
+        # index of the last packet of their group
+        self.fecGroup = fecGroup
+        self.groups = {}
+        self.parity = {}
+
+        # The number of packets the Client has recovered from parity
+        self.recovered = 0
+
+        # Records what happens to the window, None if it is not traced
+        self.trace = trace
+
+        # Whether what happens to each packet is printed
+        self.verbose = verbose
+
+        # The number of bytes in each packet not used for file data
+        self.headerSize = wireFormat.headerSize + tagSize
+
+        # The amount of file data carried by each packet
+        self.dataSize = packetSize - self.headerSize
+
+        # The number of packets kept in the window
+        self.windowSize = windowSize
+
         # The path to the requested file
         self.filePath = filePath
 
@@ -49,191 +164,375 @@ class SlidingWindow(object):
             option = 'rb'
             self.mode = mode
         if not (mode == 'Server'):
-            option = 'wb'
+            option = 'wb' if startOffset == 0 and endOffset == None else 'r+b'
             self.mode = 'Client'
-        self.file = io.open(filePath, option)
+        # The cache the Server shares the file through, and the file as
+        # shared by it
+        self.cache = cache
+        self.mapped = None
+        if self.mode == 'Server' and not cache == None:
+            self.mapped = cache.openFile(filePath)
+            self.file = self.mapped.file
+        else:
+            # Received data is written straight to its place in the file, so
+            # the Client does not buffer writes
+            self.file = io.open(filePath, option,
+                                buffering=(-1 if self.mode == 'Server' else 0))
 
         # The size of the file
-        if fileSize == None:
+        if not self.mapped == None:
+            self.fileSize = self.mapped.size
+        elif fileSize == None:
             self.fileSize = os.path.getsize(filePath)
         else:
             self.fileSize = fileSize
 
-        # Keeps track of which packets are marked
-        self.marks = {}
+        # Only the range of the file is transferred
+        if not endOffset == None:
+            self.fileSize = min(self.fileSize, endOffset)
 
-        # Keeps track of the first key of the marks dictionary
+        # The file being received is given its full size up front
+        if self.mode == 'Client':
+            self._preallocate()
+
+        # Keeps track of the index of the first packet in the window
         self.start = 0
 
-        # Keeps track of the last key of the marks dictionary
+        # Keeps track of the index of the last packet in the window
         self.end = 0
 
-        # The array containing bytes
-        self.window = [None] * self.packetSize * 5;
+        # The file being sent, mapped into memory so packets are filled from
+        # the page cache without a system call each. Empty files cannot be
+        # mapped, and have nothing to send anyway
+        self.map = None
+        self.mapView = None
+        if not self.mapped == None:
+            self.map = self.mapped.map
+            self.mapView = self.mapped.view
+        elif self.mode == 'Server' and os.path.getsize(filePath) > 0:
+            self.map = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapView = memoryview(self.map)
+
+        # Holds the packets in the window, and which of them are marked. The
+        # Client only keeps track of which packets it has received, and how
+        # much data each of them held, so its slots hold no data
+        if self.mode == 'Server':
+            self.buffer = PacketBuffer(self.windowSize, self.packetSize)
+        else:
+            self.buffer = PacketBuffer(self.windowSize, 0)
 
         # Keeps track of the number of bytes read from the file
-        self.bytesRead = 0
+        self.bytesRead = startOffset
+
+        # The index of the first byte transferred, where the first group of
+        # packets protected by parity starts
+        self.origin = startOffset
 
         # Builds the start of the Sliding Window
         if mode == 'Server':
-            self._buildServerWindow()
+            self._buildServerWindow(startOffset)
         else:
-            self._buildClientWindow()
+            self._buildClientWindow(startOffset)
 
         print(
-            ("Initialized a sliding window with packet size: %d, for file %s" +
-            " with size %d") %
-            (self.packetSize, self.filePath, self.fileSize)
+            ("Initialized a sliding window with packet size: %d, window " +
+            "size: %d, for file %s with size %d") %
+            (self.packetSize, self.windowSize, self.filePath, self.fileSize)
         )
     # End of constructor()
 
-    def arraycopy(self, src, destStart, dest=None, srcStart=0, length=1024):
+    def slotOf(self, index):
         """
-        A function to copy data from one list (array) to another. Made to
-        mimic
-
-        :type src: list
-        :param src: the list from which data will be copied
+        Returns the position in the window of the packet that starts with byte
+        index, or -1 if no such packet is within the window.
 
-        :type srcStart: int
-        :param srcStart: the index from which data will be copied
-
-        :type dest: list
-        :param dest: the list to which data will be copied. If it is not
-                     provided, the data will be copied to the sliding window
-
-        :type destStart: int
-        :param destStart: the starting index to which data will be copied
-
-        :type length: int
-        :param length: the amount of data to be copied would be between the
-                       length of src and this value
+        :type index: int
+        :param index: the index of the first byte of the packet
         """
-        if dest == None:
-            dest = self.window
+        offset = index - self.start
+        if offset < 0 or offset % self.dataSize != 0 or index >= self.fileSize:
+            return -1
 
-        for index in range(min(len(src), length)):
-            dest[index + destStart] = src[index + srcStart]
-    # End of arraycopy()
+        slot = offset // self.dataSize
+        if slot >= self.windowSize:
+            return -1
+        return slot
+    # End of slotOf()
 
     def slideServer(self):
         """
-        Shifts the Sliding Window to the right. Shifts all the data in the
-        window left by the packet size, and all the data in the marks list to
-        the left by 1, but only if the first element of marks is not -1 (has
-        been received if on the Client side, or has been acknowledged if on the
-        Server side.) Continues shifting the SlidingWindow to the right until
-        the first element of marks becomes -1.
+        Shifts the Sliding Window to the right. Drops the first packet from the
+        window by advancing the head of the buffer, but only if the first
+        packet has been acknowledged. The freed slot becomes the end of the
+        window and is filled with the next packet read from the file.
+        Continues shifting the SlidingWindow to the right until the first
+        packet is one that has not been acknowledged.
         """
         if not self.mode == 'Server':
             print("Error: Sliding Window not in Server mode: %s" % self.mode)
             return
-        
+
         # Window will shift until index of start of window becomes greater
         # than the size of the file
-        while self.start < self.fileSize and self.marks[self.start]:
-            # Size of the data is = packetSize - index - checksum/hash
-            dataSize = self.packetSize - 10 - 56
-            
-            # Shift sliding window to the right
-            for i in range(len(self.window) - self.packetSize):
-                self.window[i] = self.window[i + self.packetSize]
-                
-            # Nullify end of sliding window
-            self.arraycopy([None] * self.packetSize,
-                           len(self.window) - self.packetSize)
-                           
-            if self.end < self.fileSize:
-                # Add 10 bytes of index to the next packet
-                self.arraycopy((self.end + dataSize).to_bytes(
-                               10, byteorder='big'),
-                               len(self.window) - self.packetSize) 
-                               
-            # Append next bytes of file to SlidingWindow - will append 
-            # an array of None if all file data has been read
-            self.arraycopy(self.readBytes(),
-                           len(self.window) - self.packetSize + 10)
-                           
-            # Slide the marks list to the right
-            del self.marks[self.start]
-            self.start += dataSize
-            if (self.end + dataSize) < self.fileSize:
-                self.end += dataSize
-                self.marks[self.end] = False
+        start = self.start
+        while self.start < self.fileSize and self.buffer.isMarked(0):
+            self.buffer.advance()
+            self.start += self.dataSize
+
+            # Append next packet of file to SlidingWindow
+            index = self.start + (self.windowSize - 1) * self.dataSize
+            if index < self.fileSize:
+                self._fillServerSlot(self.windowSize - 1, index)
+                self.end = index
+
+        if not self.trace == None and not self.start == start:
+            self._traceSlide(start)
     # End of slideServer()
 
-    def _buildServerWindow(self):
+    def _fillServerSlot(self, slot, index):
+        """
+        Writes the packet starting with byte index into the given slot of the
+        window: the header holding its type and index, room for the
+        hash/checksum, and the file data copied straight from the mapped file
+        into the slot. If compression was negotiated, the data is compressed
+        instead where that makes it smaller, and the packet is marked as a
+        compressed packet.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type slot: int
+        :param slot: the position of the packet in the window
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+        """
+        packet = self.buffer.slot(slot)
+        data = self.dataAt(index)
+        self.bytesRead = max(self.bytesRead, index + len(data))
+        packetType = WireFormat.FPACKET[0]
+        if not self.compressor == None:
+            compressed = self._compress(index, data)
+            if not compressed == None:
+                data = compressed
+                packetType = WireFormat.FZPACKET[0]
+        self.wireFormat.pack(packet, packetType, self.sessionId, index,
+                             len(data))
+        packet[self.headerSize:(self.headerSize + len(data))] = data
+        if self.fecGroup > 0:
+            self._addToParity(index, data)
+        self.buffer.setLength(slot, self.headerSize + len(data))
+    # End of _fillServerSlot()
+
+    def _compress(self, index, data):
+        """
+        Returns the data of the packet that starts with byte index compressed,
+        or None if it is sent as it is. Packets compressed by earlier
+        transfers of the same file are taken from the cache.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+
+        :type data: bytes-like object
+        :param data: the file data of the packet
+        """
+        if self.mapped == None:
+            return self.compressor.compress(data)
+
+        key = (self.mapped.key, self.dataSize, self.codec.code,
+               self.compressor.level, index)
+        compressed = self.cache.lookup(key)
+        if compressed is PacketCache.MISSING:
+            compressed = self.compressor.compress(data)
+            self.cache.store(key, compressed)
+        return compressed
+    # End of _compress()
+
+    def _groupOf(self, index):
+        """
+        Returns the group of packets protected by the same parity packet as
+        the packet that starts with byte index, as a (first, count) tuple: the
+        index of the first packet in the group, and the number of packets in
+        it, which is only less than fecGroup at the end of the file.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+        """
+        number = (index - self.origin) // self.dataSize
+        first = self.origin + (number // self.fecGroup) * self.fecGroup * \
+                self.dataSize
+        remaining = (self.fileSize - first + self.dataSize - 1) // self.dataSize
+        return (first, min(self.fecGroup, remaining))
+    # End of _groupOf()
+
+    def _addToParity(self, index, data):
+        """
+        Folds the data of a packet filled into the window into the parity of
+        its group. Once the group is complete, its parity packet is built, to
+        be sent right after the last packet of the group is first sent.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+
+        :type data: bytes-like object
+        :param data: the data of the packet, as sent
+        """
+        (first, count) = self._groupOf(index)
+        if count < MINGROUPSIZE:
+            return
+
+        if not first in self.groups:
+            self.groups[first] = ParityGroup(first, count)
+        group = self.groups[first]
+        group.add(index, data)
+        if not group.isComplete():
+            return
+
+        del self.groups[first]
+        parityData = group.parityData()
+        packet = bytearray(self.headerSize + len(parityData))
+        self.wireFormat.pack(packet, WireFormat.FPARITY[0], self.sessionId,
+                             first, group.lengths)
+        packet[self.headerSize:] = parityData
+        self.parity[index] = packet
+    # End of _addToParity()
+
+    def parityAfter(self, index):
+        """
+        Returns the parity packet to be sent right after the packet that
+        starts with byte index is first sent, or None if that packet is not
+        the last of its group. Each parity packet is only handed out once.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+        """
+        return self.parity.pop(index, None)
+    # End of parityAfter()
+
+    def _buildServerWindow(self, startOffset=0):
         """
-        Builds the marks dictionary and the sliding window from the file
-        specified in the initializaiton. Marks is kept at size 5. The keys for
-        the dictionary are the indexes of the first bytes of the packets. The
-        values are True if those particular packets have been acknowledged/
-        received, False if not. The array containing the packets to be sent,
-        window, is created by reading data from the file to be sent.
+        Builds the sliding window from the file specified in the
+        initializaiton. The window is kept at size windowSize. Packets are kept
+        in order of the indexes of their first bytes, and are marked once
+        they have been acknowledged/received. The buffer containing the
+        packets to be sent is filled by reading data from the file to be sent.
 
         NOTE: This method is NOT meant to be called from outside this class
         i.e. it is meant to be treated as a private method.
+
+        :type startOffset: int
+        :param startOffset: the index of the first byte of the first packet
         """
         if not self.mode == 'Server':
             print("Error: Sliding Window is not in Server mode: %s" % self.mode)
             return
 
-        for i in range(5):
-            index = self.end
-            
+        for i in range(self.windowSize):
+            index = startOffset + i * self.dataSize
+
             if index >= self.fileSize:
-                self.arraycopy([None] * self.packetSize, i * self.packetSize)
-                
-            self.marks[index] = False
-            
-            # Appends index (sized to 10 bytes) to start of packet
-            self.arraycopy((index).to_bytes(10, byteorder='big'),
-                           i * self.packetSize)
-                           
-            # Reads data from file and appends it to the packet
-            self.arraycopy(self.readBytes(), (i * self.packetSize) + 10)
-            
-            if i < 4:
-                self.end += (self.packetSize - 10 - 56)
-                
-        self.start = 0
+                break
+
+            self._fillServerSlot(i, index)
+            self.end = index
+
+        self.start = startOffset
     # End of buildServerWindow()
 
-    def _buildClientWindow(self):
+    def _buildClientWindow(self, startOffset=0):
         """
-        Builds the marks dictionary and the sliding window for the file
-        specified in the initializaiton. Marks is kept at size 5. The keys for
-        the dictionary are the indexes of the first bytes of the packets. The
-        values are True if those particular packets have been acknowledged/
-        received, False if not. The array containing the packets to be received,
-        window, is created to be filled with 'None' values.
+        Builds the sliding window for the file specified in the
+        initializaiton. The window is kept at size windowSize. Packets are kept
+        in order of the indexes of their first bytes, and are marked once
+        they have been received. The buffer is left empty, to be filled by the
+        packets received.
 
         NOTE: This method is NOT meant to be called from outside this class
         i.e. it is meant to be treated as a private method.
+
+        :type startOffset: int
+        :param startOffset: the index of the first byte of the first packet
         """
         if not self.mode == 'Client':
             print("Error: Sliding Window is not in Client mode: %s" % self.mode)
             return
 
-        for i in range(5):
-            index = self.end
-            
-            if index >= self.fileSize:
-                self.arraycopy([None] * self.packetSize, i * self.packetSize)
-                
-            self.marks[index] = False
-            
-            # Appends index (sized to 10 bytes) to start of packet
-            self.arraycopy((index).to_bytes(10, byteorder='big'),
-                           i * self.packetSize)
-                           
-            # Increases the self.end parameter by effective data size
-            if i < 4:
-                self.end += (self.packetSize - 10 - 56)
-                
-        self.start = 0
+        remaining = max(0, self.fileSize - startOffset)
+        numPackets = (remaining + self.dataSize - 1) // self.dataSize
+        lastSlot = max(0, min(self.windowSize, numPackets) - 1)
+        self.end = startOffset + lastSlot * self.dataSize
+        self.start = startOffset
     # End of buildClientWindow()
 
+    def _preallocate(self):
+        """
+        Reserves space on disk for the whole of the file being received, so
+        packets can be written at their offsets in any order without the file
+        being extended piece by piece. Falls back to just setting the size of
+        the file where the file system cannot preallocate. The file is never
+        shrunk, since other windows may be receiving other ranges of it.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        if self.fileSize <= 0:
+            return
+
+        fd = self.file.fileno()
+        try:
+            os.posix_fallocate(fd, 0, self.fileSize)
+        except (AttributeError, OSError):
+            if os.fstat(fd).st_size < self.fileSize:
+                os.ftruncate(fd, self.fileSize)
+    # End of _preallocate()
+
+    def _writeData(self, index, data):
+        """
+        Writes file data to the file being received, at the offset given by
+        the index of the packet holding it.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+
+        :type data: bytes-like object
+        :param data: the file data held by the packet
+        """
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.file.fileno(), data, index)
+        else:
+            self.file.seek(index)
+            self.file.write(data)
+    # End of _writeData()
+
+    def isMarked(self, index):
+        """
+        Returns True if the packet that starts with byte index has already
+        been acknowledged or received, either because it is marked or because
+        the window has already slid past it.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+        """
+        if index < self.start:
+            return True
+
+        slot = self.slotOf(index)
+        return slot != -1 and self.buffer.isMarked(slot)
+    # End of isMarked()
+
     def mark(self, index=None):
         """
         Marks the packet that starts with byte index as either acknowledged
@@ -245,188 +544,569 @@ class SlidingWindow(object):
         """
         if index == None:
             index = self.start
-            
-        if index not in self.marks.keys():
-            print("Index %d is not within the Sliding Window" % index)
+
+        slot = self.slotOf(index)
+        if slot == -1:
+            if self.verbose:
+                print("Index %d is not within the Sliding Window" % index)
             return
-        
-        self.marks[index] = True
+
+        self.buffer.mark(slot)
         if self.mode == 'Server':
             self.slideServer()
         else:
             self.slideClient()
     # End of mark()
 
+    def markSelective(self, cumulative, bitmap):
+        """
+        Marks every packet in the window that starts before byte cumulative,
+        as well as every packet whose bit is set in bitmap, where bit i stands
+        for the packet that starts with byte cumulative + i * dataSize.
+        Returns the indexes of the packets that were newly marked, in order.
+        Unlike mark(), this does not slide the window, so the send times of the
+        newly marked packets can still be looked up. slideServer() should be
+        called afterwards.
+
+        :type cumulative: int
+        :param cumulative: the index of the first byte not yet received
+
+        :type bitmap: int
+        :param bitmap: the packets received after byte cumulative
+        """
+        offset = cumulative - self.start
+        if offset % self.dataSize != 0:
+            if self.verbose:
+                print("Index %d is not the start of a packet" % cumulative)
+            return []
+
+        # Lines the acknowledged packets up with the slots of the window
+        shift = min(offset // self.dataSize, self.windowSize)
+        if shift >= 0:
+            acked = ((1 << shift) - 1) | (bitmap << shift)
+        else:
+            acked = bitmap >> -shift
+
+        numPackets = (self.fileSize - self.start + self.dataSize - 1) // \
+                     self.dataSize
+        valid = (1 << max(0, min(numPackets, self.windowSize))) - 1
+        newBits = acked & valid & ~self.buffer.markedBits()
+        self.buffer.markBits(newBits)
+
+        newlyMarked = []
+        while newBits:
+            lowest = newBits & -newBits
+            newlyMarked.append(
+                self.start + (lowest.bit_length() - 1) * self.dataSize)
+            newBits ^= lowest
+        return newlyMarked
+    # End of markSelective()
+
+    def getAckState(self):
+        """
+        Returns the state of the window needed to acknowledge every packet
+        received so far, as a (cumulative, bitmap) tuple: the index of the
+        first byte not yet received, and an int with bit i set if the packet
+        that starts with byte cumulative + i * dataSize has been received.
+        """
+        return (self.start, self.buffer.markedBits())
+    # End of getAckState()
+
     def slideClient(self):
         """
         Shifts the Sliding Window to the right. If first packet has been
-        received, writes first packet to file, and shifts all the data in the
-        window left by the packet size, and all the data in the marks list to
-        the left by 1, but only if the first element of marks is not -1 (has
-        been received if on the Client side, or has been acknowledged if on the
-        Server side.) Continues shifting the SlidingWindow to the right until
-        the first element of marks becomes -1.
-        """
-        dataSize = self.packetSize - 10 - 56
-        
+        received, drops it from the window by advancing the head of the
+        buffer. Its data was already written to the file when it was saved.
+        Continues shifting the SlidingWindow to the right until the first
+        packet is one that has not been received.
+        """
         if not self.mode == 'Client':
             print("Error: Sliding Window not in Client mode: %s" % self.mode)
             return
 
-        while self.start < self.fileSize and self.marks[self.start]:
-            # Save first packet to file
-            temp = self.window[(10 + 56):self.packetSize]
-            
-            # Get rid of None values trailing in packet
-            while temp[-1] == None:
-                del temp[-1]
-            
-            self.file.write(bytes(temp))
-            self.bytesRead += len(temp)
-            
-            # Shift sliding window to the right
-            for i in range(len(self.window) - self.packetSize):
-                self.window[i] = self.window[i + self.packetSize]
-                
-            # Nullify end of sliding window
-            self.arraycopy([None] * self.packetSize,
-                           len(self.window) - self.packetSize)
-                           
-            if self.end < self.fileSize:
-                # Add 10 bytes of index to the next packet
-                self.arraycopy((self.end + (self.packetSize - 10)).to_bytes(
-                               10, byteorder='big'),
-                               len(self.window) - self.packetSize)
-                               
-            # Slide the marks list to the right
-            del self.marks[self.start]
-            self.start += dataSize
-            if (self.end + dataSize) < self.fileSize:
-                self.end += dataSize
-                self.marks[self.end] = False
+        start = self.start
+        while self.start < self.fileSize and self.buffer.isMarked(0):
+            # First packet is complete on disk
+            self.bytesRead += self.buffer.length(0)
+
+            self.buffer.advance()
+            self.start += self.dataSize
+
+            index = self.start + (self.windowSize - 1) * self.dataSize
+            if index < self.fileSize:
+                self.end = index
+
+        if not self.trace == None and not self.start == start:
+            self._traceSlide(start)
     # End of slideClient()
 
-    def readBytes(self):
+    def _traceSlide(self, start):
+        """
+        Records that the window slid from start to where it starts now.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
         """
-        Reads (packetSize - 10) bytes from the requested file. Returns a list
-        of bytes read, or a list of size (packetSize - 10) containing None
-        values if the end of file has been reached.
+        end = min(self.start, self.fileSize)
+        self.trace.record(Trace.SLIDE, 0, self.sessionId, end, end - start)
+    # End of _traceSlide()
+
+    def dataAt(self, index):
+        """
+        Returns a memoryview of the file data carried by the packet starting
+        with byte index: up to dataSize bytes of the mapped file, shared with
+        the page cache rather than copied. The view is empty past the end of
+        the file.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+        """
+        if self.mapView == None:
+            return memoryview(b'')
+        return self.mapView[index:min(index + self.dataSize, self.fileSize)]
+    # End of dataAt()
+
+    def readBytes(self, dest):
+        """
+        Reads up to dataSize bytes from the requested file, following on from
+        the last bytes read, straight into dest. Returns the number of bytes
+        read, which is 0 if the end of file has been reached.
+
+        :type dest: writable bytes-like object
+        :param dest: the part of a packet that the file data is read into
         """
         if not self.mode == 'Server':
             print("Error: Sliding Window not in Server mode: %s" % self.mode)
-            return
+            return 0
+
+        # Reads packetSize - headerSize bytes of file data
+        # wireFormat.headerSize bytes reserved for type and index
+        # tagSize bytes reserved for hash/checksum
+        data = self.dataAt(self.bytesRead)
+        numBytes = len(data)
+        dest[:numBytes] = data
 
-        # Reads packetSize - 10 - 56 bytes of file data
-        # 10 bytes reserved for index
-        # 56 bytes reserved for hash/checksum
-        fileBytes = self.file.read(self.packetSize - 10 - 56)
-        
         # if end of file has been reached
-        if fileBytes == '':
-            return ([None] * (self.packetSize - 10))
-            
-        # Hash is left blank at first
-        temp = []
-        temp.extend([0] * 56)
-        temp.extend(fileBytes)
-        self.bytesRead += (len(temp) - 56)
-        return temp
+        if not numBytes:
+            return 0
+
+        self.bytesRead += numBytes
+        return numBytes
     # End of readBytes()
 
-    def getPackets(self):
+    def getPackets(self, limit=None):
         """
         Returns the packets that have not been acknowledged yet, in a list.
-        The return value is a list of packets, so a list of lists.
+        Each packet is a writable memoryview of the window, so the packets
+        should be sent before the window is allowed to slide.
+
+        :type limit: int
+        :param limit: only packets within the first limit slots of the window
+                      are returned. Defaults to the whole window.
         """
         if not self.mode == 'Server':
             print("Sliding Window not in Server mode: %s" % self.mode)
             return
 
+        if limit == None:
+            limit = self.windowSize
+
         packets = []
-        for i in range(5):
-            # Move next packet to list
-            packets.append(
-                self.window[(i * self.packetSize):((i + 1) * self.packetSize)])
-            # Get index of packet
-            index = packets[-1][:10]
+        for i in range(min(limit, self.windowSize)):
             # If no more packets
-            if index[0] == None:
-                del packets[-1]
-                return packets
-            # Delete packet if it is marked, or not a valid index, or an
-            # empty packet
-            index = int.from_bytes(index, byteorder='big')
-            if (index not in self.marks.keys() or self.marks[index]
-                or index > self.fileSize):
-                del packets[-1]
+            if self.start + (i * self.dataSize) >= self.fileSize:
+                break
+            # Skip packet if it is marked
+            if not self.buffer.isMarked(i):
+                packets.append(self.buffer.packet(i))
 
         return packets
     # End of getPackets()
 
+    def getDuePackets(self, timeout, limit=None, now=None, count=None):
+        """
+        Returns the packets that are due to be sent, in a list of
+        (index, packet) tuples. A packet is due if it has not been
+        acknowledged, and has either never been sent or was last sent more
+        than timeout seconds ago. Each packet is a writable memoryview of the
+        window, so the packets should be sent before the window is allowed to
+        slide.
+
+        :type timeout: float
+        :param timeout: the number of seconds after which an unacknowledged
+                        packet is sent again
+
+        :type limit: int
+        :param limit: only packets within the first limit slots of the window
+                      are returned. Defaults to the whole window.
+
+        :type now: float
+        :param now: the current time, as given by time.monotonic()
+
+        :type count: int
+        :param count: only the first count packets due are returned. Defaults
+                      to all of them.
+        """
+        if not self.mode == 'Server':
+            print("Sliding Window not in Server mode: %s" % self.mode)
+            return
+
+        if limit == None:
+            limit = self.windowSize
+        if now == None:
+            now = time.monotonic()
+
+        packets = []
+        for i in range(min(limit, self.windowSize)):
+            index = self.start + (i * self.dataSize)
+            # If no more packets
+            if index >= self.fileSize:
+                break
+            if self.buffer.isMarked(i):
+                continue
+            # Compared the same way as in nextExpiry(), so a packet is due
+            # exactly when its timer expires
+            if (self.buffer.sendCount(i) == 0
+                or self.buffer.sentTime(i) + timeout <= now):
+                if len(packets) == count:
+                    break
+                packets.append((index, self.buffer.packet(i)))
+
+        return packets
+    # End of getDuePackets()
+
+    def nextExpiry(self, timeout, limit=None):
+        """
+        Returns the time at which the timer of the next unacknowledged packet
+        in flight expires, or None if no packets are in flight.
+
+        :type timeout: float
+        :param timeout: the number of seconds after which an unacknowledged
+                        packet is sent again
+
+        :type limit: int
+        :param limit: only packets within the first limit slots of the window
+                      are considered. Defaults to the whole window.
+        """
+        if limit == None:
+            limit = self.windowSize
+
+        expiry = None
+        for i in range(min(limit, self.windowSize)):
+            if self.start + (i * self.dataSize) >= self.fileSize:
+                break
+            if self.buffer.isMarked(i) or self.buffer.sendCount(i) == 0:
+                continue
+            if expiry == None or self.buffer.sentTime(i) < expiry:
+                expiry = self.buffer.sentTime(i)
+
+        if expiry == None:
+            return None
+        return expiry + timeout
+    # End of nextExpiry()
+
+    def recordSend(self, index, now=None):
+        """
+        Records that the packet that starts with byte index has just been
+        sent, starting its timer. Returns the number of times the packet has
+        been sent, or -1 if the packet is not within the window.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+
+        :type now: float
+        :param now: the time at which the packet was sent, as given by
+                    time.monotonic()
+        """
+        slot = self.slotOf(index)
+        if slot == -1:
+            if self.verbose:
+                print("Index %d is not within the Sliding Window" % index)
+            return -1
+
+        if now == None:
+            now = time.monotonic()
+        return self.buffer.recordSend(slot, now)
+    # End of recordSend()
+
+    def sentTime(self, index):
+        """
+        Returns the time at which the packet that starts with byte index was
+        last sent, or None if the packet is not within the window.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+        """
+        slot = self.slotOf(index)
+        if slot == -1:
+            return None
+        return self.buffer.sentTime(slot)
+    # End of sentTime()
+
+    def sendCount(self, index):
+        """
+        Returns the number of times the packet that starts with byte index has
+        been sent, or 0 if the packet is not within the window.
+
+        :type index: int
+        :param index: the index of the first byte of the packet
+        """
+        slot = self.slotOf(index)
+        if slot == -1:
+            return 0
+        return self.buffer.sendCount(slot)
+    # End of sendCount()
+
     def saveBytes(self, bytes):
         """
-        Saves (packetSize - 10 - 56) bytes into the buffer, at the correct place.
-        Only meant to be used on the Client side.
-        
-        :type bytes: a list of bytes 
-        :param bytes: the list of bytes to be saved
+        Saves a packet of up to packetSize bytes, writing its file data
+        straight to the correct place in the file and marking it as received.
+        Compressed packets are decompressed first. Only meant to be used on
+        the Client side.
+
+        :type bytes: bytes-like object
+        :param bytes: the packet to be saved
         """
         if not self.mode == 'Client':
             print("Sliding Window not in Client mode: %s" % self.mode)
             return
-        
+
         if bytes == None:
             print("Error: no bytes provided to be saved")
             return -1
-            
+
         if len(bytes) > (self.packetSize):
             print("Error: byte array provided is of the wrong size: %d" %
                   len(bytes))
             return -1
-            
-        index = bytes[:10]
+
+        (packetType, sessionId, index, length) = self.wireFormat.unpack(bytes)
+        return self._saveData(index, packetType, bytes[self.headerSize:])
+    # End of saveBytes()
+
+    def _saveData(self, index, packetType, data, recovered=False):
+        """
+        Saves the file data of a packet, received or recovered from parity,
+        and marks it as received. Returns the index of the packet, "Done" once
+        the whole file has been received, -2 for a duplicate and -1 if the
+        packet cannot be saved.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+
+        :type packetType: int
+        :param packetType: the code of the packet, telling whether its data
+                           is compressed
+
+        :type data: bytes-like object
+        :param data: the data of the packet, as sent
+
+        :type recovered: bool
+        :param recovered: True if the packet was recovered from parity, and so
+                          is not part of a group anymore
+        """
+        if index >= self.fileSize:
+            if self.verbose:
+                print("Index of received packet greater than file size: "
+                      "%d > %d" % (index, self.fileSize))
+            return -1
+
+        slot = self.slotOf(index)
+
         # Do nothing if packet already received/marked
-        index = int.from_bytes(index, byteorder='big')
-        
-        if index in self.marks and self.marks[index]:
-            print("Received duplicate packet.")
+        if slot == -1 and index < self.start:
+            if self.verbose:
+                print("Received duplicate packet.")
             return -2
-            
-        if index not in self.marks:
-            print("Received a packet when its not the packet's turn to be" +
-                  " received, with index: %d" % index)
+
+        # Packets ahead of the window are not saved, so must not be
+        # acknowledged
+        if slot == -1:
+            if self.verbose:
+                print("Received a packet when its not the packet's turn to "
+                      "be received, with index: %d" % index)
+            return -1
+
+        if self.buffer.isMarked(slot):
+            if self.verbose:
+                print("Received duplicate packet.")
             return -2
-            
-        if index > self.fileSize:
-            print("Index of received packet greater than file size: %d > %d" %
-                  (index, self.fileSize))
+
+        # The data goes straight to disk, only its length is kept
+        sent = data
+        if packetType == WireFormat.FZPACKET[0]:
+            data = self._decompress(index, data)
+            if data == None:
+                return -1
+        self._writeData(index, data)
+        self.buffer.setLength(slot, len(data))
+        self.mark(index)
+        if self.fecGroup > 0 and not recovered:
+            self._addToGroup(index, sent)
+        if self.bytesRead < self.fileSize:
+            return index
+        else:
+            self.file.close()
+            return "Done"
+    # End of _saveData()
+
+    def saveParity(self, bytes):
+        """
+        Adds a parity packet to the group of packets it protects, and recovers
+        the one packet of the group that is missing, if there is only one.
+        Returns the index of the recovered packet, "Done" if that completed the
+        file, or -1 if nothing was recovered. Only meant to be used on the
+        Client side.
+
+        :type bytes: bytes-like object
+        :param bytes: the parity packet
+        """
+        if not self.mode == 'Client' or self.fecGroup == 0:
             return -1
-            
-        for i in range(5):
-            windowIndex = self.start + (i * (self.packetSize - 10 - 56))
-            
-            if windowIndex == index:
-                self.arraycopy(
-                               src=bytes,
-                               srcStart=0,
-                               dest=self.window,
-                               destStart=(i * self.packetSize),
-                               length=self.packetSize
-                              )
-                self.mark(windowIndex)
-                if self.bytesRead < self.fileSize:
-                    return windowIndex
-                else:
-                    self.file.close()
-                    return "Done"
-        print("Error: for loop completed without saving bytes.")
-        return -1
-    # End of saveBytes()
-    
+
+        (packetType, sessionId, first, lengths) = self.wireFormat.unpack(bytes)
+        if first < self.origin or first >= self.fileSize:
+            return -1
+        (groupFirst, count) = self._groupOf(first)
+        if not groupFirst == first or count < MINGROUPSIZE:
+            return -1
+
+        # Nothing to recover if every packet of the group has been received
+        missing = [i for i in range(count)
+                   if not self.isMarked(first + i * self.dataSize)]
+        if missing == [] or first + missing[0] * self.dataSize >= \
+                self.start + self.windowSize * self.dataSize:
+            return -1
+
+        if not first in self.groups:
+            self.groups[first] = ParityGroup(first, count)
+        group = self.groups[first]
+        if group.hasParity:
+            return -1
+        group.addParity(bytes[self.headerSize:], lengths)
+        return self._recover(group)
+    # End of saveParity()
+
+    def _addToGroup(self, index, data):
+        """
+        Folds the data of a received packet into the parity of its group, and
+        recovers the one packet of the group that is missing, if the parity
+        has been received already.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+
+        :type data: bytes-like object
+        :param data: the data of the packet, as sent
+        """
+        (first, count) = self._groupOf(index)
+        if count < MINGROUPSIZE:
+            return
+
+        if not first in self.groups:
+            self.groups[first] = ParityGroup(first, count)
+        group = self.groups[first]
+        group.add(index, data)
+        if group.isComplete():
+            del self.groups[first]
+        else:
+            self._recover(group)
+    # End of _addToGroup()
+
+    def _recover(self, group):
+        """
+        Recovers the missing packet of a group from its parity and the other
+        packets, if it can be, and saves it. Returns what saving it returned,
+        or -1 if nothing was recovered.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type group: FEC.ParityGroup
+        :param group: the group the packet is missing from
+        """
+        if not group.canRecover():
+            return -1
+
+        del self.groups[group.first]
+        (index, data) = group.recover(self.dataSize)
+        # Only compressed data is shorter than the data the packet holds
+        if len(data) < min(self.dataSize, self.fileSize - index):
+            packetType = WireFormat.FZPACKET[0]
+        else:
+            packetType = WireFormat.FPACKET[0]
+        if self.verbose:
+            print("Recovered packet %d from parity" % index)
+        self.recovered += 1
+        if not self.trace == None:
+            self.trace.record(Trace.RECOVER, packetType, self.sessionId, index,
+                              len(data))
+        return self._saveData(index, packetType, data, recovered=True)
+    # End of _recover()
+
+    def _decompress(self, index, data):
+        """
+        Returns the file data of a compressed packet, or None if it cannot be
+        decompressed into exactly the data the packet should hold.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+
+        :type index: int
+        :param index: the index of the first byte of file data in the packet
+
+        :type data: bytes-like object
+        :param data: the compressed data
+        """
+        if self.codec == None:
+            print("Error: received a compressed packet, but no compression " +
+                  "was negotiated")
+            return None
+
+        expected = min(self.dataSize, self.fileSize - index)
+        try:
+            data = self.codec.decompress(data, expected)
+        except Exception as error:
+            print("Error: could not decompress packet %d: %s" % (index, error))
+            return None
+        if not len(data) == expected:
+            print("Error: packet %d decompressed to %d bytes instead of %d" %
+                  (index, len(data), expected))
+            return None
+        return data
+    # End of _decompress()
+
+    def close(self):
+        """
+        Closes the file being read from/written to, or hands it back to the
+        cache it was shared through. Safe to call more than once, and after
+        the transfer has finished.
+        """
+        if not self.mapped == None:
+            self.cache.closeFile(self.mapped)
+            self.mapped = None
+            self.map = None
+            self.mapView = None
+            self.file = None
+        if not self.map == None:
+            self.mapView.release()
+            self.map.close()
+            self.map = None
+            self.mapView = None
+        if not self.file == None and not self.file.closed:
+            self.file.close()
+    # End of close()
+
     def isDone(self):
         """
-        Returns true if the Sliding Window operation is done, false if not. 
-        Function identifies whether the operation is done by looking at the 
+        Returns true if the Sliding Window operation is done, false if not.
+        Function identifies whether the operation is done by looking at the
         self.start parameter.
         """
         if self.start < self.fileSize:
@@ -434,19 +1114,18 @@ class SlidingWindow(object):
         else:
             return True
     # End of isDone()
-        
+
 # End of SlidingWindow class
 
 if __name__ == "__main__":
     # slidingWindow = SlidingWindow(filePath="trysmall.txt", packetSize=25)
-    # print(slidingWindow.marks)
-    # print(slidingWindow.window)
+    # print(slidingWindow.buffer.buffer)
     # print(slidingWindow.bytesRead)
     # slidingWindow.mark(0)
     # print(slidingWindow.getPackets())
     # slidingWindow.mark(45)
     # print(slidingWindow.getPackets())
     sW = SlidingWindow(filePath="trysmall.txt", packetSize=25, mode='Client', fileSize=69)
-    print(sW.window)
+    print(sW.buffer.markedBits())
     sW.mark(0)
-    print(sW.window)
+    print(sW.buffer.markedBits())
@@ -0,0 +1,412 @@
+#
+# Records what happens to every packet of a transfer, as fixed size binary
+# records, so a transfer that stalled or crawled can be looked at afterwards
+# without running it again. Tracing is opt-in: the Server, the Client and
+# SlidingWindow only record events when they are given a Tracer.
+#
+# Run as a script, reads a trace back and prints a summary of each session
+# with the stalls in it, every event in order, the data for plotting the
+# offsets sent and acknowledged over time, or the throughput over time.
+#
+
+import argparse # For the command line of the analyzer
+import io # For reading and writing trace files
+import struct # For packing records
+import time # For timestamps
+
+###############################################################################
+# Defining the events recorded
+###############################################################################
+# A packet was sent for the first time. The offset is the index of its first
+# byte, and the size its number of bytes
+SEND = 1
+
+# A packet was sent again after its timer expired
+RESEND = 2
+
+# A file packet was received, with its offset and size
+RECEIVE = 3
+
+# A parity packet was sent or received. The offset is the index of the first
+# packet of its group
+PARITY = 4
+
+# An acknowledgement was sent or received. The offset is the byte
+# acknowledged up to, and the size is the number of packets it acknowledged
+# for the first time on the Server, or its number of bytes on the Client
+ACK = 5
+
+# A request or a packet went unanswered for too long. The size is the number
+# of times it has been sent
+TIMEOUT = 6
+
+# The sliding window slid. The offset is the new start of the window, and the
+# size the number of bytes it slid by
+SLIDE = 7
+
+# A packet that had been received already was received again
+DUPLICATE = 8
+
+# A packet failed its integrity check
+CORRUPT = 9
+
+# A packet was recovered from parity
+RECOVER = 10
+
+# The congestion window was cut after a loss. The offset is the packet lost,
+# and the size the new congestion window
+CUT = 11
+
+# The names of the events, for the analyzer
+EVENTS = {SEND: "send", RESEND: "resend", RECEIVE: "receive",
+          PARITY: "parity", ACK: "ack", TIMEOUT: "timeout", SLIDE: "slide",
+          DUPLICATE: "duplicate", CORRUPT: "corrupt", RECOVER: "recover",
+          CUT: "cut"}
+
+###############################################################################
+# Defining the layout of trace files
+###############################################################################
+# Written at the start of every trace file, before the version
+MAGIC = b'FTPTRACE'
+
+# The version of the layout
+VERSION = 1
+
+# The header of a trace file: the magic bytes, the version, and the wall
+# clock time at which the trace started, which record times are relative to
+HEADER = struct.Struct('!8sBd')
+
+# A record: seconds since the trace started, the event, the code of the
+# packet involved or 0, the id of the transfer, the offset and the size
+RECORD = struct.Struct('!dBBIQI')
+
+# The default number of records held in memory before they are written out
+RINGSIZE = 65536
+
+# The number of seconds without the window sliding after which the analyzer
+# reports a stall
+STALLTIME = 0.5
+
+class Tracer(object):
+    """
+    Records events into a ring of fixed size records in memory, packed in
+    place so recording an event allocates nothing. In the default mode, the
+    ring is written to the trace file each time it fills up, so the file
+    holds every event. With keepLast, the ring wraps around instead, holding
+    only the latest events, and nothing is written until flush() is called,
+    like a flight recorder: cheap enough to leave on, and dumped once a
+    transfer goes wrong.
+    """
+
+    def __init__(self, path, capacity=RINGSIZE, keepLast=False):
+        """
+        Initializes a Tracer writing to the file at the given path.
+
+        :type path: string
+        :param path: the path to the trace file, which is overwritten
+
+        :type capacity: int
+        :param capacity: the number of records held in memory
+
+        :type keepLast: bool
+        :param keepLast: only keep the latest capacity records, and only
+                         write them when flush() or close() is called
+        """
+        self.capacity = capacity
+        self.keepLast = keepLast
+        self.ring = bytearray(capacity * RECORD.size)
+
+        # The position of the next record in the ring, and whether the ring
+        # has wrapped around since it was last written out
+        self.position = 0
+        self.wrapped = False
+
+        # Record times are relative to when the trace started
+        self.origin = time.monotonic()
+
+        self.file = io.open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+    # End of constructor()
+
+    def record(self, event, packetType=0, sessionId=0, offset=0, size=0):
+        """
+        Records an event, as it happens.
+
+        :type event: int
+        :param event: the event, such as Trace.SEND
+
+        :type packetType: int
+        :param packetType: the code of the packet involved, 0 if none
+
+        :type sessionId: int
+        :param sessionId: the id of the transfer, as written into the headers
+                          of its packets
+
+        :type offset: int
+        :param offset: the offset the event is about, see the events
+
+        :type size: int
+        :param size: the size the event is about, see the events
+        """
+        RECORD.pack_into(self.ring, self.position * RECORD.size,
+                         time.monotonic() - self.origin, event, packetType,
+                         sessionId, offset, size)
+        self.position += 1
+        if self.position == self.capacity:
+            self.position = 0
+            if self.keepLast:
+                self.wrapped = True
+            else:
+                self.file.write(self.ring)
+    # End of record()
+
+    def flush(self):
+        """
+        Writes the records held in memory to the trace file, oldest first.
+        """
+        if self.file.closed:
+            return
+        if self.wrapped:
+            self.file.write(memoryview(self.ring)[(self.position *
+                                                   RECORD.size):])
+            self.wrapped = False
+        self.file.write(memoryview(self.ring)[:(self.position * RECORD.size)])
+        self.position = 0
+        self.file.flush()
+    # End of flush()
+
+    def close(self):
+        """
+        Writes the records held in memory, and closes the trace file.
+        """
+        self.flush()
+        self.file.close()
+    # End of close()
+
+# End of Tracer class
+
+def read(path):
+    """
+    Returns the wall clock time at which a trace started, and a list of its
+    records, each a (time, event, packetType, sessionId, offset, size) tuple.
+    Raises ValueError if the file is not a trace.
+
+    :type path: string
+    :param path: the path to the trace file
+    """
+    with io.open(path, 'rb') as traceFile:
+        data = traceFile.read()
+    if len(data) < HEADER.size:
+        raise ValueError("%s is too short to be a trace" % path)
+    (magic, version, started) = HEADER.unpack_from(data, 0)
+    if not magic == MAGIC or not version == VERSION:
+        raise ValueError("%s is not a version %d trace" % (path, VERSION))
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    return (started, list(RECORD.iter_unpack(data[HEADER.size:end])))
+# End of read()
+
+def _sessions(records):
+    """
+    Returns the records of each session, by session id.
+
+    NOTE: This function is NOT meant to be called from outside this module
+    i.e. it is meant to be treated as a private function.
+    """
+    sessions = {}
+    for record in records:
+        sessions.setdefault(record[3], []).append(record)
+    return sessions
+# End of _sessions()
+
+def findStalls(records, stallTime=STALLTIME):
+    """
+    Returns the stalls in the records of one session: the times the window
+    did not slide for at least stallTime seconds while the session went on,
+    as a list of (start, seconds, offset) tuples, where offset is where the
+    window was stuck.
+
+    :type records: list of tuples
+    :param records: the records of the session, in order
+
+    :type stallTime: float
+    :param stallTime: the shortest gap reported
+    """
+    stalls = []
+    lastSlide = None
+    offset = 0
+    for record in records:
+        if lastSlide == None:
+            lastSlide = record[0]
+        if record[1] == SLIDE or record is records[-1]:
+            if record[0] - lastSlide >= stallTime:
+                stalls.append((lastSlide, record[0] - lastSlide, offset))
+            lastSlide = record[0]
+            if record[1] == SLIDE:
+                offset = record[4]
+    return stalls
+# End of findStalls()
+
+def summarize(records, stallTime=STALLTIME):
+    """
+    Returns a summary of each session in a trace: its duration, the number
+    of each event, the bytes sent and received, and its stalls, as lines of
+    text.
+
+    :type records: list of tuples
+    :param records: the records of the trace
+
+    :type stallTime: float
+    :param stallTime: the shortest gap reported as a stall
+    """
+    lines = []
+    for (sessionId, sessionRecords) in sorted(_sessions(records).items()):
+        counts = {}
+        sent = received = 0
+        for record in sessionRecords:
+            counts[record[1]] = counts.get(record[1], 0) + 1
+            if record[1] in (SEND, RESEND):
+                sent += record[5]
+            elif record[1] == RECEIVE:
+                received += record[5]
+        start = sessionRecords[0][0]
+        seconds = sessionRecords[-1][0] - start
+        lines.append("Session %08x: %.3f s to %.3f s (%.3f s)" %
+                     (sessionId, start, sessionRecords[-1][0], seconds))
+        lines.append("  " + ", ".join(
+            "%s %d" % (EVENTS.get(event, event), count)
+            for (event, count) in sorted(counts.items())))
+        if sent > 0:
+            lines.append("  %d bytes sent, %.0f bytes/s" %
+                         (sent, sent / seconds if seconds > 0 else 0))
+        if received > 0:
+            lines.append("  %d bytes received, %.0f bytes/s" %
+                         (received, received / seconds if seconds > 0 else 0))
+        for (stallStart, stallSeconds, offset) in findStalls(
+                sessionRecords, stallTime):
+            lines.append("  Stalled at byte %d for %.3f s from %.3f s" %
+                         (offset, stallSeconds, stallStart))
+    return lines
+# End of summarize()
+
+def timeline(records, sessionId=None, start=0.0, end=None):
+    """
+    Returns the events of a trace in order, as lines of text.
+
+    :type records: list of tuples
+    :param records: the records of the trace
+
+    :type sessionId: int
+    :param sessionId: only the events of this session, None for all
+
+    :type start: float
+    :param start: only the events from this many seconds into the trace
+
+    :type end: float
+    :param end: only the events up to this many seconds into the trace, None
+                for all
+    """
+    lines = []
+    for (when, event, packetType, session, offset, size) in records:
+        if not sessionId == None and not session == sessionId:
+            continue
+        if when < start or (not end == None and when > end):
+            continue
+        lines.append("%.6f %08x %-9s type %2d offset %12d size %d" %
+                     (when, session, EVENTS.get(event, event), packetType,
+                      offset, size))
+    return lines
+# End of timeline()
+
+def sequence(records):
+    """
+    Returns the data of a sequence plot of a trace as lines of CSV: the time
+    and offset of every packet sent, sent again, received or recovered, and
+    of every acknowledgement, one series per event.
+
+    :type records: list of tuples
+    :param records: the records of the trace
+    """
+    lines = ["time,session,event,offset,size"]
+    for (when, event, packetType, session, offset, size) in records:
+        if event in (SEND, RESEND, RECEIVE, RECOVER, ACK, DUPLICATE):
+            lines.append("%.6f,%08x,%s,%d,%d" %
+                         (when, session, EVENTS[event], offset, size))
+    return lines
+# End of sequence()
+
+def throughput(records, interval):
+    """
+    Returns the throughput over time of each session in a trace as lines of
+    CSV: for each interval, the bytes sent for the first time and sent again,
+    the bytes received, and the bytes the window slid past, per second.
+
+    :type records: list of tuples
+    :param records: the records of the trace
+
+    :type interval: float
+    :param interval: the number of seconds in each interval
+    """
+    lines = ["time,session,sent,resent,received,slid"]
+    for (sessionId, sessionRecords) in sorted(_sessions(records).items()):
+        buckets = {}
+        for (when, event, packetType, session, offset, size) in \
+                sessionRecords:
+            bucket = buckets.setdefault(int(when / interval), [0, 0, 0, 0])
+            if event == SEND:
+                bucket[0] += size
+            elif event == RESEND:
+                bucket[1] += size
+            elif event == RECEIVE:
+                bucket[2] += size
+            elif event == SLIDE:
+                bucket[3] += size
+        for index in range(min(buckets), max(buckets) + 1):
+            bucket = buckets.get(index, [0, 0, 0, 0])
+            lines.append("%.6f,%08x,%s" % (
+                index * interval, sessionId,
+                ",".join("%.0f" % (value / interval) for value in bucket)))
+    return lines
+# End of throughput()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyzes a trace recorded by the Server or the Client.")
+    parser.add_argument("trace", help="the trace file")
+    parser.add_argument("view", nargs="?", default="summary",
+                        choices=["summary", "timeline", "sequence",
+                                 "throughput"],
+                        help="what to print, a summary of each session by "
+                             "default")
+    parser.add_argument("--session", default=None,
+                        help="only the events of this session, in hex, for "
+                             "the timeline")
+    parser.add_argument("--start", type=float, default=0.0,
+                        help="only the events from this many seconds in, "
+                             "for the timeline")
+    parser.add_argument("--end", type=float, default=None,
+                        help="only the events up to this many seconds in, "
+                             "for the timeline")
+    parser.add_argument("--interval", type=float, default=0.1,
+                        help="seconds in each interval of the throughput")
+    parser.add_argument("--stall", type=float, default=STALLTIME,
+                        help="seconds without the window sliding reported "
+                             "as a stall in the summary")
+    arguments = parser.parse_args()
+
+    (started, records) = read(arguments.trace)
+    if arguments.view == "summary":
+        print("Trace started %s, %d events" %
+              (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+               len(records)))
+        lines = summarize(records, arguments.stall)
+    elif arguments.view == "timeline":
+        sessionId = None
+        if not arguments.session == None:
+            sessionId = int(arguments.session, 16)
+        lines = timeline(records, sessionId, arguments.start, arguments.end)
+    elif arguments.view == "sequence":
+        lines = sequence(records)
+    else:
+        lines = throughput(records, arguments.interval)
+    for line in lines:
+        print(line)
@@ -0,0 +1,207 @@
+import struct # For packing headers in a single call
+
+###############################################################################
+# Defining the codes that identify messages
+###############################################################################
+# Packet containing file name
+FNAME = (1).to_bytes(1, byteorder='big')
+
+# Packet containing file size
+FSIZE = (2).to_bytes(1, byteorder='big')
+
+# Packet signifying that the Client is ready to receive file
+FREADYACK = (3).to_bytes(1, byteorder='big')
+
+# Packet containing bytes of file
+FPACKET = (4).to_bytes(1, byteorder='big')
+
+# Packet containing file acknowledgement
+FILEACK = (5).to_bytes(1, byteorder='big')
+
+# Packet containing a cumulative acknowledgement, followed by a bitmap of the
+# packets received after it
+FSACK = (6).to_bytes(1, byteorder='big')
+
+# Packet containing file name, and how much of the file the Client already has
+FRESUME = (7).to_bytes(1, byteorder='big')
+
+# Packet containing file name, and which of the parts of the file the Client
+# is asking for
+FRANGE = (8).to_bytes(1, byteorder='big')
+
+# Packet sent by the Client to find out whether packets of its size get
+# through, echoed back as-is by the Server
+FPROBE = (9).to_bytes(1, byteorder='big')
+
+# Packet containing bytes of file, compressed with the codec negotiated for the
+# transfer
+FZPACKET = (10).to_bytes(1, byteorder='big')
+
+# Packet containing the parity of a group of file packets, from which any one
+# packet of the group can be recovered
+FPARITY = (11).to_bytes(1, byteorder='big')
+
+# Packet containing file name, asking for the changes from the Client's old
+# copy of the file rather than the whole file
+FDELTA = (12).to_bytes(1, byteorder='big')
+
+# Packet containing the signatures of some of the blocks of the Client's old
+# copy of the file
+FSIG = (13).to_bytes(1, byteorder='big')
+
+# Packet sent by the Server in answer to a delta request while the delta is
+# still being built, so the Client keeps waiting for the file size
+FWAIT = (14).to_bytes(1, byteorder='big')
+
+###############################################################################
+# Defining the versions of the header of file packets and acknowledgements
+###############################################################################
+# The type, then a 9 byte big-endian offset, with the type taking the place of
+# the top byte of what used to be a 10 byte offset
+LEGACY = 1
+
+# A header packed with struct: type, version, session id, 64 bit offset and
+# payload length
+BINARY = 2
+
+# The newest version, offered by the Client
+VERSION = BINARY
+
+class LegacyFormat(object):
+    """
+    The original header of file packets and acknowledgements: one byte of
+    type and 9 bytes of offset, followed by the hash/checksum. Used with
+    peers that do not negotiate a version.
+    """
+
+    def __init__(self):
+        """
+        Initializes a LegacyFormat.
+        """
+
+        # The version of the format, as negotiated in the handshake
+        self.version = LEGACY
+
+        # The number of bytes before the hash/checksum
+        self.headerSize = 10
+    # End of constructor()
+
+    def pack(self, packet, packetType, sessionId, offset, length):
+        """
+        Writes the header to the start of a packet. The session id and the
+        payload length are not part of this format, and are left out.
+
+        :type packet: writable bytes-like object
+        :param packet: the packet the header is written to
+
+        :type packetType: int
+        :param packetType: the code identifying the message
+
+        :type sessionId: int
+        :param sessionId: the id of the transfer the packet belongs to
+
+        :type offset: int
+        :param offset: the index of the first byte of file data in the
+                       packet, or the byte acknowledged up to
+
+        :type length: int
+        :param length: the number of bytes after the hash/checksum
+        """
+        packet[0] = packetType
+        packet[1:10] = offset.to_bytes(9, byteorder='big')
+    # End of pack()
+
+    def unpack(self, packet):
+        """
+        Returns the header of a packet as a (packetType, sessionId, offset,
+        length) tuple. The session id is always 0, and the length is None
+        since this format does not carry it.
+
+        :type packet: bytes-like object
+        :param packet: the packet holding the header
+        """
+        return (packet[0], 0, int.from_bytes(packet[1:10], byteorder='big'),
+                None)
+    # End of unpack()
+
+# End of LegacyFormat class
+
+class BinaryFormat(object):
+    """
+    A fixed size header packed with struct, in network byte order: the type,
+    the version, the id of the session the packet belongs to, the 64 bit
+    offset and the number of bytes of payload, followed by the binary
+    hash/checksum negotiated for the transfer.
+    """
+
+    # The layout of the header
+    HEADER = struct.Struct('!BBIQH')
+
+    def __init__(self):
+        """
+        Initializes a BinaryFormat.
+        """
+
+        # The version of the format, as negotiated in the handshake
+        self.version = BINARY
+
+        # The number of bytes before the hash/checksum
+        self.headerSize = self.HEADER.size
+    # End of constructor()
+
+    def pack(self, packet, packetType, sessionId, offset, length):
+        """
+        Writes the header to the start of a packet.
+
+        :type packet: writable bytes-like object
+        :param packet: the packet the header is written to
+
+        :type packetType: int
+        :param packetType: the code identifying the message
+
+        :type sessionId: int
+        :param sessionId: the id of the transfer the packet belongs to
+
+        :type offset: int
+        :param offset: the index of the first byte of file data in the
+                       packet, or the byte acknowledged up to
+
+        :type length: int
+        :param length: the number of bytes after the hash/checksum
+        """
+        self.HEADER.pack_into(packet, 0, packetType, self.version, sessionId,
+                              offset, length)
+    # End of pack()
+
+    def unpack(self, packet):
+        """
+        Returns the header of a packet as a (packetType, sessionId, offset,
+        length) tuple.
+
+        :type packet: bytes-like object
+        :param packet: the packet holding the header
+        """
+        (packetType, version, sessionId, offset, length) = \
+            self.HEADER.unpack_from(packet, 0)
+        return (packetType, sessionId, offset, length)
+    # End of unpack()
+
+# End of BinaryFormat class
+
+# Every version of the header, by version
+FORMATS = {
+    LEGACY: LegacyFormat(),
+    BINARY: BinaryFormat(),
+}
+
+def choose(version):
+    """
+    Returns the format to be used for a transfer: the version offered by the
+    Client, or the newest version known here if the Client's is newer. Clients
+    that do not offer a version get the legacy format.
+
+    :type version: int
+    :param version: the version offered by the Client, 0 if none
+    """
+    return FORMATS[max(LEGACY, min(version, VERSION))]
+# End of choose()
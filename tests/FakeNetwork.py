@@ -0,0 +1,230 @@
+#
+# Runs a ServerSession and a ClientSession against each other without sockets
+# or an event loop: the packets each side sends are queued, and handed to the
+# other side when the test says so, and the clock only moves when the test
+# moves it, firing the timers that come due.
+#
+
+import heapq
+
+import Client
+import Server
+
+# The address the Client is seen from by the Server
+CLIENTADDRESS = ('127.0.0.1', 40000)
+
+class FakeTimer(object):
+    """
+    A timer set on a FakeLoop, which can be cancelled like an asyncio handle.
+    """
+
+    def __init__(self, when, callback, args):
+        """
+        Initializes a FakeTimer firing at the given time.
+        """
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    # End of constructor()
+
+    def cancel(self):
+        """
+        Stops the timer from firing.
+        """
+        self.cancelled = True
+    # End of cancel()
+
+    def __lt__(self, other):
+        return self.when < other.when
+    # End of __lt__()
+
+# End of FakeTimer class
+
+class FakeLoop(object):
+    """
+    The parts of an event loop used by the sessions, with a clock that only
+    moves in advance().
+    """
+
+    def __init__(self):
+        """
+        Initializes a FakeLoop at time 0 with no timers set.
+        """
+        self.now = 0.0
+        self.timers = []
+    # End of constructor()
+
+    def time(self):
+        return self.now
+    # End of time()
+
+    def call_at(self, when, callback, *args):
+        timer = FakeTimer(when, callback, args)
+        heapq.heappush(self.timers, timer)
+        return timer
+    # End of call_at()
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.now + delay, callback, *args)
+    # End of call_later()
+
+    def advance(self, seconds):
+        """
+        Moves the clock forward, firing every timer that comes due on the way,
+        in order.
+
+        :type seconds: float
+        :param seconds: the number of seconds the clock moves
+        """
+        end = self.now + seconds
+        while self.timers and self.timers[0].when <= end:
+            timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            self.now = max(self.now, timer.when)
+            timer.callback(*timer.args)
+        self.now = end
+    # End of advance()
+
+# End of FakeLoop class
+
+class FakeFuture(object):
+    """
+    Holds the outcome of a download, like the asyncio future it stands in for.
+    """
+
+    def __init__(self):
+        self.outcome = None
+        self.exception = None
+        self.finished = False
+    # End of constructor()
+
+    def done(self):
+        return self.finished
+    # End of done()
+
+    def set_result(self, result):
+        self.outcome = result
+        self.finished = True
+    # End of set_result()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self.finished = True
+    # End of set_exception()
+
+# End of FakeFuture class
+
+class FakeNetwork(object):
+    """
+    Connects a Server, which is never started, to one ClientSession. Stands
+    in for the socket of each side, and for the Server's BatchSender.
+    """
+
+    def __init__(self, remoteName, dest, packetSize=1024, **options):
+        """
+        Sets up a Server and a ClientSession downloading remoteName to dest,
+        with the given ClientSession options. Nothing is sent until start().
+        """
+        self.loop = FakeLoop()
+
+        # The packets sent to each side, not handed over yet
+        self.toServer = []
+        self.toClient = []
+
+        self.server = Server.Server('127.0.0.1', 0, pacing=False)
+        self.server.loop = self.loop
+        self.server.transport = self
+        self.server.sender = self
+
+        self.finished = FakeFuture()
+        self.client = Client.ClientSession(
+            remoteName, dest, self.finished, packetSize=packetSize,
+            **options)
+        self.client.transport = ClientTransport(self)
+        self.client.loop = self.loop
+    # End of constructor()
+
+    def start(self):
+        """
+        Makes the Client send its request.
+        """
+        self.client.lastReceived = self.loop.time()
+        self.client.sendFileRequest()
+    # End of start()
+
+    def sendto(self, packet, address):
+        """
+        Queues a packet sent by the Server.
+        """
+        self.toClient.append(bytes(packet))
+    # End of sendto()
+
+    def send(self, packets, address):
+        """
+        Queues a batch of packets sent by the Server.
+        """
+        for packet in packets:
+            self.sendto(packet, address)
+    # End of send()
+
+    def deliver(self, drop=None, latency=0.0):
+        """
+        Hands every queued packet to the other side, and the packets sent in
+        answer, until no packets are left queued. Returns the number of
+        packets handed over.
+
+        :type drop: function
+        :param drop: called with each packet and the side it is sent to,
+                     'Server' or 'Client', and returns True if the packet is
+                     lost instead
+
+        :type latency: float
+        :param latency: the number of seconds the clock moves before each
+                        round of packets is handed over
+        """
+        delivered = 0
+        while self.toServer or self.toClient:
+            self.loop.advance(latency)
+            if self.toServer:
+                packet = self.toServer.pop(0)
+                if drop == None or not drop(packet, 'Server'):
+                    self.server.datagramReceived(packet, CLIENTADDRESS)
+                    delivered += 1
+            if self.toClient:
+                packet = self.toClient.pop(0)
+                if drop == None or not drop(packet, 'Client'):
+                    self.client.datagram_received(packet, None)
+                    delivered += 1
+        return delivered
+    # End of deliver()
+
+    def session(self):
+        """
+        Returns the Server's session with the Client, or None if it has none.
+        """
+        return self.server.sessions.get(CLIENTADDRESS)
+    # End of session()
+
+# End of FakeNetwork class
+
+class ClientTransport(object):
+    """
+    Stands in for the socket of the ClientSession.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.closed = False
+    # End of constructor()
+
+    def sendto(self, packet):
+        self.network.toServer.append(bytes(packet))
+    # End of sendto()
+
+    def close(self):
+        self.closed = True
+    # End of close()
+
+# End of ClientTransport class
@@ -0,0 +1,152 @@
+#
+# Tests sending bursts of packets over a real socket, batched with UDP
+# segmentation offload (GSO) where the kernel allows it and one at a time where
+# it does not.
+#
+
+import contextlib
+import io
+import socket
+import struct
+import unittest
+from unittest import mock
+
+import BatchSender
+
+# A socket option of the UDP level the kernel does not know, which makes it
+# refuse a batch as it would without UDP GSO
+UNKNOWNOPTION = 0x7fff
+
+# The number of seconds the receiving socket waits for each packet
+RECVTIMEOUT = 2.0
+
+def gsoAvailable():
+    """
+    Returns True if the kernel splits up a batch sent with UDP GSO.
+    """
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        receiver.bind(('127.0.0.1', 0))
+        segment = struct.pack('=H', 1)
+        sender.sendmsg([b"a", b"b"], [(BatchSender.SOL_UDP,
+                                       BatchSender.UDP_SEGMENT, segment)],
+                       0, receiver.getsockname())
+        return True
+    except (AttributeError, OSError):
+        return False
+    finally:
+        receiver.close()
+        sender.close()
+# End of gsoAvailable()
+
+class SocketTransport(object):
+    """
+    Sends single packets straight through a socket, standing in for the
+    transport of the Server socket, and counts them.
+    """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.sends = 0
+    # End of constructor()
+
+    def sendto(self, packet, address):
+        self.socket.sendto(packet, address)
+        self.sends += 1
+    # End of sendto()
+
+    def get_write_buffer_size(self):
+        return 0
+    # End of get_write_buffer_size()
+
+# End of SocketTransport class
+
+class BatchSenderTest(unittest.TestCase):
+    """
+    Tests that every packet sent arrives as a datagram of its own, whole and
+    in order, whether or not the packets were batched.
+    """
+
+    def setUp(self):
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 1 << 20)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.settimeout(RECVTIMEOUT)
+        self.address = self.receiver.getsockname()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.transport = SocketTransport(self.socket)
+        self.sender = BatchSender.BatchSender(self.transport, self.socket)
+
+        # Runs of packets of the same size, a run cut short by a shorter
+        # packet, and a run longer than a batch may be
+        sizes = ([1000] * 20 + [300] + [1000] * 5 + [500] * 70 + [10, 20] +
+                 [100] * 3)
+        self.packets = []
+        for i, size in enumerate(sizes):
+            label = i.to_bytes(2, byteorder='big')
+            self.packets.append(label + bytes([i % 256]) * (size - 2))
+    # End of setUp()
+
+    def tearDown(self):
+        self.receiver.close()
+        self.socket.close()
+    # End of tearDown()
+
+    def receiveAll(self):
+        """
+        Returns the datagrams received, one for each packet sent.
+        """
+        return [self.receiver.recv(BatchSender.MAXPAYLOAD)
+                for packet in self.packets]
+    # End of receiveAll()
+
+    def testBatches(self):
+        batches = []
+        position = 0
+        while position < len(self.packets):
+            batch = self.sender._nextBatch(self.packets, position)
+            batches.append([len(packet) for packet in batch])
+            position += len(batch)
+        self.assertEqual(batches[0], [1000] * 20 + [300])
+        self.assertEqual(batches[1], [1000] * 5 + [500])
+        self.assertEqual(batches[2], [500] * BatchSender.MAXSEGMENTS)
+        self.assertEqual(batches[3], [500] * 5 + [10])
+        self.assertEqual(batches[4], [20])
+        self.assertEqual(batches[5], [100] * 3)
+        self.assertEqual(len(batches), 6)
+    # End of testBatches()
+
+    @unittest.skipUnless(gsoAvailable(), "UDP GSO not available")
+    def testSegmentBoundaries(self):
+        self.sender.send(self.packets, self.address)
+        self.assertTrue(self.sender.gso)
+        self.assertEqual(self.receiveAll(), self.packets)
+        # Only the packet that could not be batched went on its own
+        self.assertEqual(self.transport.sends, 1)
+    # End of testSegmentBoundaries()
+
+    def testFallbackWhenKernelRefuses(self):
+        with mock.patch.object(BatchSender, 'UDP_SEGMENT', UNKNOWNOPTION), \
+             contextlib.redirect_stdout(io.StringIO()) as output:
+            self.sender.send(self.packets, self.address)
+        self.assertFalse(self.sender.gso)
+        self.assertIn("UDP GSO not available", output.getvalue())
+        self.assertEqual(self.receiveAll(), self.packets)
+        self.assertEqual(self.transport.sends, len(self.packets))
+    # End of testFallbackWhenKernelRefuses()
+
+    def testFallbackWithoutSendmsg(self):
+        sender = BatchSender.BatchSender(self.transport, object())
+        self.assertFalse(sender.gso)
+        sender.send(self.packets, self.address)
+        self.assertEqual(self.receiveAll(), self.packets)
+        self.assertEqual(self.transport.sends, len(self.packets))
+    # End of testFallbackWithoutSendmsg()
+
+# End of BatchSenderTest class
+
+if __name__ == '__main__':
+    unittest.main()
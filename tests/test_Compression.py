@@ -0,0 +1,94 @@
+#
+# Tests compressing file packets, and falling back to sending them as they
+# are when compressing does not pay off.
+#
+
+import os
+import unittest
+
+import Compression
+
+# The size of the file data of the packets compressed
+DATASIZE = 1400
+
+class CodecTest(unittest.TestCase):
+    """
+    Tests every available codec on its own.
+    """
+
+    def testRoundTrip(self):
+        data = b"the quick brown fox jumps over the lazy dog " * 32
+        for codec in Compression.CODECS.values():
+            for level in (codec.levels[0], codec.defaultLevel):
+                compressed = codec.compress(data, level)
+                self.assertLess(len(compressed), len(data), codec.name)
+                self.assertEqual(codec.decompress(compressed, len(data)),
+                                 data)
+    # End of testRoundTrip()
+
+    def testDecompressionIsBounded(self):
+        data = bytes(1 << 20)
+        for codec in Compression.CODECS.values():
+            compressed = codec.compress(data, codec.defaultLevel)
+            self.assertEqual(len(codec.decompress(compressed, DATASIZE)),
+                             DATASIZE)
+    # End of testDecompressionIsBounded()
+
+    def testChooseLevel(self):
+        codec = Compression.CODECS[Compression.ZLIB]
+        self.assertEqual(codec.chooseLevel(0), codec.defaultLevel)
+        self.assertEqual(codec.chooseLevel(3), 3)
+        self.assertEqual(codec.chooseLevel(50), codec.levels[-1])
+        self.assertEqual(codec.chooseLevel(-4), codec.levels[0])
+    # End of testChooseLevel()
+
+# End of CodecTest class
+
+class CompressorTest(unittest.TestCase):
+    """
+    Tests when a Compressor sends packets as they are.
+    """
+
+    def setUp(self):
+        codec = Compression.CODECS[Compression.ZLIB]
+        self.compressor = Compression.Compressor(codec, codec.defaultLevel)
+        self.text = bytes(DATASIZE)
+    # End of setUp()
+
+    def testCompressibleDataIsCompressed(self):
+        compressed = self.compressor.compress(self.text)
+        self.assertIsNotNone(compressed)
+        self.assertEqual(self.compressor.misses, 0)
+    # End of testCompressibleDataIsCompressed()
+
+    def testIncompressibleDataIsSentAsItIs(self):
+        self.assertIsNone(self.compressor.compress(os.urandom(DATASIZE)))
+        self.assertEqual(self.compressor.misses, 1)
+        # A hit resets the count of misses
+        self.assertIsNotNone(self.compressor.compress(self.text))
+        self.assertEqual(self.compressor.misses, 0)
+    # End of testIncompressibleDataIsSentAsItIs()
+
+    def testSmallSavingIsNotWorthIt(self):
+        # Only a few bytes of the packet compress well
+        data = os.urandom(DATASIZE - 40) + bytes(40)
+        self.assertIsNone(self.compressor.compress(data))
+    # End of testSmallSavingIsNotWorthIt()
+
+    def testGivesUpAndRetries(self):
+        # The last of these misses is the first retry
+        for i in range(Compression.GIVEUPAFTER + 1):
+            self.assertIsNone(self.compressor.compress(os.urandom(DATASIZE)))
+
+        # The file now looks incompressible, so even compressible data is
+        # sent as it is until the next retry
+        for i in range(Compression.RETRYEVERY - 1):
+            self.assertIsNone(self.compressor.compress(self.text))
+        self.assertIsNotNone(self.compressor.compress(self.text))
+        self.assertEqual(self.compressor.misses, 0)
+    # End of testGivesUpAndRetries()
+
+# End of CompressorTest class
+
+if __name__ == "__main__":
+    unittest.main()
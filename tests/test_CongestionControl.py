@@ -0,0 +1,234 @@
+#
+# Tests estimating the round trip time and the retransmission timeout, and
+# pacing the packets sent by the Server with a token bucket.
+#
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from CongestionControl import RttEstimator, ALPHA, BETA, K
+from CongestionControl import INITIALRTO, MINRTO, MAXRTO
+from CongestionControl import Pacer, PACINGBURST, PACINGGAIN, SLOWSTARTGAIN
+from CongestionControl import TIMERSLACK
+import WireFormat
+from tests.FakeNetwork import FakeNetwork
+
+# The size of the packets paced
+PACKETSIZE = 1000
+
+class RttEstimatorTest(unittest.TestCase):
+    """
+    Tests the smoothed round trip time, its variation and the timeout derived
+    from them, as in RFC 6298.
+    """
+
+    def testBeforeAnySample(self):
+        rtt = RttEstimator()
+        self.assertIsNone(rtt.srtt)
+        self.assertIsNone(rtt.rttvar)
+        self.assertEqual(rtt.rto, INITIALRTO)
+    # End of testBeforeAnySample()
+
+    def testFirstSample(self):
+        rtt = RttEstimator()
+        rtt.sample(0.2)
+        self.assertAlmostEqual(rtt.srtt, 0.2)
+        self.assertAlmostEqual(rtt.rttvar, 0.1)
+        self.assertAlmostEqual(rtt.rto, 0.2 + K * 0.1)
+    # End of testFirstSample()
+
+    def testLaterSamples(self):
+        rtt = RttEstimator()
+        rtt.sample(0.2)
+        rtt.sample(0.4)
+        # The variation is updated from the old smoothed round trip time
+        rttvar = (1 - BETA) * 0.1 + BETA * abs(0.2 - 0.4)
+        srtt = (1 - ALPHA) * 0.2 + ALPHA * 0.4
+        self.assertAlmostEqual(rtt.rttvar, rttvar)
+        self.assertAlmostEqual(rtt.srtt, srtt)
+        self.assertAlmostEqual(rtt.rto, srtt + K * rttvar)
+
+        # Steady samples bring the variation, and so the timeout, down
+        for i in range(100):
+            rtt.sample(0.3)
+        self.assertAlmostEqual(rtt.srtt, 0.3, places=3)
+        self.assertLess(rtt.rttvar, 0.001)
+    # End of testLaterSamples()
+
+    def testTimeoutLimits(self):
+        rtt = RttEstimator()
+        rtt.sample(0.0001)
+        self.assertEqual(rtt.rto, MINRTO)
+        rtt = RttEstimator()
+        rtt.sample(MAXRTO)
+        self.assertEqual(rtt.rto, MAXRTO)
+    # End of testTimeoutLimits()
+
+    def testBackoff(self):
+        rtt = RttEstimator()
+        rtt.sample(0.2)
+        rto = rtt.rto
+        rtt.backoff()
+        self.assertAlmostEqual(rtt.rto, 2 * rto)
+        for i in range(20):
+            rtt.backoff()
+        self.assertEqual(rtt.rto, MAXRTO)
+        # The next sample goes back to the round trip time
+        rtt.sample(0.2)
+        self.assertLess(rtt.rto, 1.0)
+    # End of testBackoff()
+
+# End of RttEstimatorTest class
+
+class KarnTest(unittest.TestCase):
+    """
+    Tests that the Server only samples the round trip time from packets that
+    were sent once, since the acknowledgement of a resent packet could belong
+    to any of its sends. Runs a transfer of a file of one packet over a
+    FakeNetwork.
+    """
+
+    # The number of seconds each packet takes to arrive
+    LATENCY = 0.05
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.mkdir("files")
+        with open(os.path.join("files", "one"), 'wb') as source:
+            source.write(os.urandom(500))
+        self.network = None
+        self.session = None
+    # End of setUp()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def transfer(self, loseFirstSend):
+        """
+        Runs the transfer, losing the first send of the file packet if asked
+        to, and returns the Server's session.
+        """
+        sends = []
+        def drop(packet, side):
+            if side == 'Client' and packet[0] == WireFormat.FPACKET[0]:
+                if sends == []:
+                    # The handshake gave the first sample
+                    self.session = self.network.session()
+                    self.assertEqual(
+                        self.session.metrics.histograms['rtt'].count, 1)
+                    self.handshakeRtt = self.session.rtt.srtt
+                sends.append(packet)
+                return loseFirstSend and len(sends) == 1
+            return False
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.network = FakeNetwork("one", "dest")
+            self.network.start()
+            self.network.deliver(drop, self.LATENCY)
+            while not self.network.finished.done():
+                self.network.loop.advance(self.session.rtt.rto)
+                self.network.deliver(drop, self.LATENCY)
+        self.assertEqual(self.network.finished.outcome, 500)
+        self.assertEqual(len(sends), 2 if loseFirstSend else 1)
+        self.assertEqual(self.session.state, 'Done')
+        return self.session
+    # End of transfer()
+
+    def testPacketSentOnceIsSampled(self):
+        session = self.transfer(False)
+        self.assertEqual(session.metrics.histograms['rtt'].count, 2)
+    # End of testPacketSentOnceIsSampled()
+
+    def testResentPacketIsNotSampled(self):
+        session = self.transfer(True)
+        self.assertEqual(session.metrics.histograms['rtt'].count, 1)
+        self.assertEqual(session.rtt.srtt, self.handshakeRtt)
+        self.assertEqual(session.metrics.counters['retransmits'], 1)
+    # End of testResentPacketIsNotSampled()
+
+# End of KarnTest class
+
+class PacerTest(unittest.TestCase):
+    """
+    Tests how many packets a Pacer lets out, and when.
+    """
+
+    def send(self, pacer, now):
+        """
+        Sends as many packets as the pacer allows at the given time, and
+        returns the number sent.
+        """
+        allowance = pacer.allowance(now)
+        for i in range(allowance):
+            pacer.consume(PACKETSIZE)
+        return allowance
+    # End of send()
+
+    def testUnpacedUntilRoundTripIsMeasured(self):
+        pacer = Pacer(PACKETSIZE)
+        self.assertIsNone(pacer.allowance(0.0))
+        pacer.update(10, None)
+        self.assertIsNone(pacer.allowance(0.1))
+        self.assertEqual(pacer.nextSend(0.1), 0.1)
+    # End of testUnpacedUntilRoundTripIsMeasured()
+
+    def testRateFollowsTheWindow(self):
+        pacer = Pacer(PACKETSIZE)
+        pacer.update(10, 0.1)
+        self.assertAlmostEqual(pacer.rate,
+                               PACINGGAIN * 10 * PACKETSIZE / 0.1)
+        pacer.update(10, 0.1, slowStart=True)
+        self.assertAlmostEqual(pacer.rate,
+                               SLOWSTARTGAIN * 10 * PACKETSIZE / 0.1)
+    # End of testRateFollowsTheWindow()
+
+    def testFixedRateIsKept(self):
+        pacer = Pacer(PACKETSIZE, rate=5000.0)
+        pacer.update(100, 0.01)
+        self.assertEqual(pacer.rate, 5000.0)
+    # End of testFixedRateIsKept()
+
+    def testBurstThenSpacing(self):
+        rate = 100.0 * PACKETSIZE
+        pacer = Pacer(PACKETSIZE, rate=rate)
+        # A full bucket lets out a burst, the last packet going into debt
+        self.assertEqual(self.send(pacer, 0.0), PACINGBURST + 1)
+        self.assertEqual(pacer.allowance(0.0), 0)
+        nextSend = pacer.nextSend(0.0)
+        self.assertAlmostEqual(nextSend, PACKETSIZE / rate)
+        self.assertEqual(pacer.allowance(nextSend - 0.001), 0)
+        self.assertEqual(self.send(pacer, nextSend), 1)
+    # End of testBurstThenSpacing()
+
+    def testLongRunRate(self):
+        rate = 100.0 * PACKETSIZE
+        pacer = Pacer(PACKETSIZE, rate=rate)
+        sent = 0
+        now = 0.0
+        # Timers fire late, at uneven times
+        while now < 2.0:
+            sent += self.send(pacer, now)
+            now = pacer.nextSend(now) + 0.0037
+        self.assertAlmostEqual(sent, 2.0 * 100 + PACINGBURST + 1, delta=3)
+    # End of testLongRunRate()
+
+    def testCapacityCoversLateTimers(self):
+        self.assertEqual(Pacer(PACKETSIZE).capacity(),
+                         PACINGBURST * PACKETSIZE)
+        rate = 1000.0 * PACINGBURST * PACKETSIZE / TIMERSLACK
+        self.assertEqual(Pacer(PACKETSIZE, rate=rate).capacity(),
+                         int(rate * TIMERSLACK))
+    # End of testCapacityCoversLateTimers()
+
+# End of PacerTest class
+
+if __name__ == "__main__":
+    unittest.main()
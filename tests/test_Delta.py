@@ -0,0 +1,124 @@
+#
+# Tests rebuilding a file from a Client's old copy and a delta.
+#
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import Delta
+
+# The size of the blocks the old copy is split into
+BLOCKSIZE = Delta.MINBLOCKSIZE
+
+class DeltaTest(unittest.TestCase):
+    """
+    Tests encoding a delta against the signatures of an old copy, and
+    applying it to that copy.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.random = random.Random(1)
+        self.old = self.randomBytes(40 * BLOCKSIZE + 300)
+    # End of setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def randomBytes(self, size):
+        """
+        Returns the given number of random bytes, the same on every run.
+        """
+        return bytes(self.random.getrandbits(8) for i in range(size))
+    # End of randomBytes()
+
+    def write(self, name, data):
+        """
+        Writes a file into the temporary directory and returns its path.
+        """
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+    # End of write()
+
+    def rebuild(self, old, new):
+        """
+        Encodes the delta from old to new, applies it to the old copy, and
+        returns the number of bytes copied from the old copy.
+        """
+        oldPath = self.write("old", old)
+        newPath = self.write("new", new)
+        deltaPath = oldPath + Delta.EXTENSION
+        copied = Delta.encode(newPath, BLOCKSIZE,
+                              Delta.signatures(oldPath, BLOCKSIZE), deltaPath)
+        self.assertLess(os.path.getsize(deltaPath),
+                        len(new) - copied + 1024)
+        self.assertEqual(Delta.apply(deltaPath, oldPath), len(new))
+        with open(oldPath, 'rb') as rebuilt:
+            self.assertEqual(rebuilt.read(), new)
+        self.assertFalse(os.path.exists(deltaPath))
+        return copied
+    # End of rebuild()
+
+    def testUnchangedFileIsCopied(self):
+        copied = self.rebuild(self.old, self.old)
+        self.assertEqual(copied, 40 * BLOCKSIZE)
+    # End of testUnchangedFileIsCopied()
+
+    def testEditsAreSentAsLiterals(self):
+        new = self.old[:1000] + b"inserted" + self.old[1000:(10 * BLOCKSIZE)] \
+              + self.old[(12 * BLOCKSIZE + 5):] + b"appended"
+        copied = self.rebuild(self.old, new)
+        # Only the blocks around each edit are sent again
+        self.assertGreaterEqual(copied, 34 * BLOCKSIZE)
+    # End of testEditsAreSentAsLiterals()
+
+    def testNothingInCommon(self):
+        self.assertEqual(self.rebuild(self.old, self.randomBytes(5000)), 0)
+        self.assertEqual(self.rebuild(b"", self.randomBytes(100)), 0)
+        self.assertEqual(self.rebuild(self.old, b""), 0)
+    # End of testNothingInCommon()
+
+    def testMismatchedOldCopyIsLeftInPlace(self):
+        oldPath = self.write("old", self.old)
+        newPath = self.write("new", self.old + b"tail")
+        deltaPath = oldPath + Delta.EXTENSION
+        Delta.encode(newPath, BLOCKSIZE,
+                     Delta.signatures(oldPath, BLOCKSIZE), deltaPath)
+        # The old copy changes after its signatures were sent
+        self.write("old", bytes(BLOCKSIZE) + self.old[BLOCKSIZE:])
+        with self.assertRaises(ValueError):
+            Delta.apply(deltaPath, oldPath)
+        self.assertFalse(os.path.exists(oldPath + ".new"))
+        self.assertTrue(os.path.exists(deltaPath))
+    # End of testMismatchedOldCopyIsLeftInPlace()
+
+    def testTruncatedDeltaIsRejected(self):
+        oldPath = self.write("old", self.old)
+        newPath = self.write("new", self.old[BLOCKSIZE:] + b"tail")
+        deltaPath = oldPath + Delta.EXTENSION
+        Delta.encode(newPath, BLOCKSIZE,
+                     Delta.signatures(oldPath, BLOCKSIZE), deltaPath)
+        with open(deltaPath, 'r+b') as delta:
+            delta.truncate(os.path.getsize(deltaPath) - 3)
+        with self.assertRaises(ValueError):
+            Delta.apply(deltaPath, oldPath)
+        with open(oldPath, 'rb') as oldCopy:
+            self.assertEqual(oldCopy.read(), self.old)
+    # End of testTruncatedDeltaIsRejected()
+
+    def testBlockSize(self):
+        self.assertEqual(Delta.blockSizeFor(0), Delta.MINBLOCKSIZE)
+        self.assertEqual(Delta.blockSizeFor(100 * 1024 * 1024), 10 * 1024)
+        self.assertEqual(Delta.blockSizeFor(2 ** 40), Delta.MAXBLOCKSIZE)
+    # End of testBlockSize()
+
+# End of DeltaTest class
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#
+# Tests recovering a lost file packet from the parity of its group.
+#
+
+import os
+import unittest
+
+import FEC
+
+# The number of bytes of the file between the starts of consecutive packets
+DATASIZE = 100
+
+class ParityGroupTest(unittest.TestCase):
+    """
+    Tests building the parity of a group on the Server, and recovering a
+    packet from it on the Client.
+    """
+
+    def setUp(self):
+        # The last packet of the file is short, and one packet ends in zeros,
+        # which do not show up in the integer the data is folded into
+        self.packets = [os.urandom(DATASIZE), os.urandom(60) + bytes(40),
+                        os.urandom(DATASIZE), os.urandom(37)]
+        self.first = 5 * DATASIZE
+        self.sender = FEC.ParityGroup(self.first, len(self.packets))
+        for (i, data) in enumerate(self.packets):
+            self.assertFalse(self.sender.isComplete())
+            self.sender.add(self.index(i), data)
+        self.assertTrue(self.sender.isComplete())
+    # End of setUp()
+
+    def index(self, i):
+        """
+        Returns the index of the first byte of packet i of the group.
+        """
+        return self.first + i * DATASIZE
+    # End of index()
+
+    def receiver(self, lost):
+        """
+        Returns the Client's group, with every packet but the lost one and the
+        parity added.
+        """
+        group = FEC.ParityGroup(self.first, len(self.packets))
+        for (i, data) in enumerate(self.packets):
+            if not i == lost:
+                group.add(self.index(i), data)
+        self.assertFalse(group.canRecover())
+        group.addParity(self.sender.parityData(), self.sender.lengths)
+        return group
+    # End of receiver()
+
+    def testParityLength(self):
+        self.assertEqual(len(self.sender.parityData()), DATASIZE)
+    # End of testParityLength()
+
+    def testRecoversAnyOnePacket(self):
+        for lost in range(len(self.packets)):
+            group = self.receiver(lost)
+            self.assertTrue(group.canRecover())
+            self.assertEqual(group.recover(DATASIZE),
+                             (self.index(lost), self.packets[lost]))
+    # End of testRecoversAnyOnePacket()
+
+    def testCannotRecoverTwoPackets(self):
+        group = FEC.ParityGroup(self.first, len(self.packets))
+        group.add(self.index(0), self.packets[0])
+        group.add(self.index(1), self.packets[1])
+        group.addParity(self.sender.parityData(), self.sender.lengths)
+        self.assertFalse(group.canRecover())
+    # End of testCannotRecoverTwoPackets()
+
+    def testNothingToRecoverOnceComplete(self):
+        group = self.receiver(None)
+        self.assertTrue(group.isComplete())
+        self.assertFalse(group.canRecover())
+    # End of testNothingToRecoverOnceComplete()
+
+# End of ParityGroupTest class
+
+if __name__ == "__main__":
+    unittest.main()
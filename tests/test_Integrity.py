@@ -0,0 +1,85 @@
+#
+# Tests the integrity checks that tag packets, and the negotiation of the check
+# used for a transfer.
+#
+
+import os
+import unittest
+
+import Integrity
+
+class ChecksumTest(unittest.TestCase):
+    """
+    Tests signing and verifying packets with every available check.
+    """
+
+    def packet(self, checksum, start):
+        """
+        Returns a random packet with room for a tag at the given position.
+        """
+        return bytearray(os.urandom(start)) + bytearray(checksum.size) + \
+               bytearray(os.urandom(100))
+    # End of packet()
+
+    def testSignedPacketVerifies(self):
+        for checksum in Integrity.CHECKSUMS.values():
+            for start in (0, 1, 17):
+                packet = self.packet(checksum, start)
+                checksum.sign(packet, start)
+                self.assertTrue(checksum.verify(packet, start), checksum.name)
+                self.assertTrue(checksum.verify(bytes(packet), start))
+    # End of testSignedPacketVerifies()
+
+    def testCorruptionIsDetected(self):
+        for checksum in Integrity.CHECKSUMS.values():
+            packet = self.packet(checksum, 3)
+            checksum.sign(packet, 3)
+            for position in (0, 3, 3 + checksum.size, len(packet) - 1):
+                corrupted = bytearray(packet)
+                corrupted[position] ^= 0x01
+                self.assertFalse(checksum.verify(corrupted, 3),
+                                 "%s, byte %d" % (checksum.name, position))
+    # End of testCorruptionIsDetected()
+
+    def testShortPacketIsRejected(self):
+        for checksum in Integrity.CHECKSUMS.values():
+            self.assertFalse(checksum.verify(bytes(checksum.size), 1))
+            self.assertFalse(checksum.verify(None, 0))
+    # End of testShortPacketIsRejected()
+
+    def testTagSizes(self):
+        for checksum in Integrity.CHECKSUMS.values():
+            packet = self.packet(checksum, 0)
+            self.assertEqual(len(checksum.calculate(packet, 0)), checksum.size)
+    # End of testTagSizes()
+
+# End of ChecksumTest class
+
+class NegotiationTest(unittest.TestCase):
+    """
+    Tests the offer of checks made by the Client and the Server's choice.
+    """
+
+    def testOfferRoundTrip(self):
+        offer = Integrity.encodeOffer()
+        self.assertEqual(Integrity.decodeOffer(offer), Integrity.PREFERENCE)
+        offer = Integrity.encodeOffer([Integrity.BLAKE2B8, Integrity.CRC32])
+        self.assertEqual(Integrity.decodeOffer(offer + b"trailing"),
+                         [Integrity.BLAKE2B8, Integrity.CRC32])
+    # End of testOfferRoundTrip()
+
+    def testEmptyOfferFallsBackToSha224(self):
+        self.assertEqual(Integrity.decodeOffer(b""), [])
+        self.assertEqual(Integrity.choose([]).code, Integrity.SHA224)
+    # End of testEmptyOfferFallsBackToSha224()
+
+    def testFirstKnownCheckIsChosen(self):
+        chosen = Integrity.choose([200, Integrity.BLAKE2B16, Integrity.CRC32])
+        self.assertEqual(chosen.code, Integrity.BLAKE2B16)
+        self.assertEqual(Integrity.choose([200, 201]).code, Integrity.SHA224)
+    # End of testFirstKnownCheckIsChosen()
+
+# End of NegotiationTest class
+
+if __name__ == "__main__":
+    unittest.main()
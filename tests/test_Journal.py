@@ -0,0 +1,186 @@
+#
+# Tests recording how much of a file has been received, and resuming a
+# download that broke off from there.
+#
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import Client
+import WireFormat
+from Journal import Journal
+from tests.FakeNetwork import FakeNetwork
+
+# The size of the file downloaded, a few dozen packets
+FILESIZE = 40 * 1024
+
+# The number of file packets the Client receives before the download breaks
+# off
+INTERRUPTAFTER = 10
+
+# The number of seconds each packet takes to arrive
+LATENCY = 0.01
+
+class JournalTest(unittest.TestCase):
+    """
+    Tests saving and loading the progress kept in a Journal.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dest = os.path.join(self.directory, "dest")
+        with open(self.dest, 'wb') as dest:
+            dest.write(bytes(100))
+    # End of setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def testNothingToResume(self):
+        self.assertIsNone(Journal(self.dest).load())
+    # End of testNothingToResume()
+
+    def testLastSaveIsLoaded(self):
+        journal = Journal(self.dest)
+        journal.save(200, 50)
+        journal.save(200, 100)
+        journal.close()
+        self.assertEqual(Journal(self.dest).load(), (200, 100))
+    # End of testLastSaveIsLoaded()
+
+    def testOffsetPastSavedFileIsIgnored(self):
+        journal = Journal(self.dest)
+        journal.save(200, 150)
+        journal.close()
+        self.assertIsNone(Journal(self.dest).load())
+    # End of testOffsetPastSavedFileIsIgnored()
+
+    def testPartsHaveJournalsOfTheirOwn(self):
+        first = Journal(self.dest, 0)
+        first.save(200, 10)
+        first.close()
+        self.assertIsNone(Journal(self.dest).load())
+        self.assertIsNone(Journal(self.dest, 1).load())
+        self.assertEqual(Journal(self.dest, 0).load(), (200, 10))
+    # End of testPartsHaveJournalsOfTheirOwn()
+
+    def testRemove(self):
+        journal = Journal(self.dest)
+        journal.save(200, 50)
+        journal.remove()
+        self.assertFalse(os.path.exists(journal.path))
+        self.assertIsNone(Journal(self.dest).load())
+    # End of testRemove()
+
+# End of JournalTest class
+
+class ResumeTest(unittest.TestCase):
+    """
+    Tests that a download that breaks off leaves a journal behind, and that
+    downloading the file again resumes from it. The Server looks for files in
+    the files directory under the working directory, so each test runs in a
+    temporary directory of its own.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.mkdir("files")
+        self.data = os.urandom(FILESIZE)
+        with open(os.path.join("files", "source"), 'wb') as source:
+            source.write(self.data)
+    # End of setUp()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def interrupt(self):
+        """
+        Downloads the file until the Client has received INTERRUPTAFTER file
+        packets, then loses everything sent to the Client until it gives up.
+        """
+        received = []
+        def drop(packet, side):
+            if side == 'Client' and packet[0] == WireFormat.FPACKET[0]:
+                received.append(packet)
+            return side == 'Client' and len(received) > INTERRUPTAFTER
+
+        network = FakeNetwork("source", "dest")
+        network.start()
+        network.deliver(drop, LATENCY)
+        network.loop.advance(2 * Client.TIMEOUT)
+        network.deliver(drop, LATENCY)
+        self.assertIsInstance(network.finished.exception, TimeoutError)
+    # End of interrupt()
+
+    def resume(self):
+        """
+        Downloads the file again, without losing anything, and returns the
+        request sent by the Client and the number of file packets it
+        received.
+        """
+        requests = []
+        received = []
+        def drop(packet, side):
+            if side == 'Server':
+                requests.append(packet)
+            elif packet[0] == WireFormat.FPACKET[0]:
+                received.append(packet)
+            return False
+
+        network = FakeNetwork("source", "dest")
+        network.start()
+        network.deliver(drop, LATENCY)
+        while not network.finished.done():
+            network.loop.advance(Client.TIMEOUT / 4)
+            network.deliver(drop, LATENCY)
+        self.assertIsNone(network.finished.exception)
+        self.assertEqual(network.finished.outcome, FILESIZE)
+        return (requests[0], len(received))
+    # End of resume()
+
+    def testInterruptedDownloadResumes(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.interrupt()
+
+            # The journal holds how much of the file is on disk
+            progress = Journal("dest").load()
+            self.assertIsNotNone(progress)
+            (fileSize, offset) = progress
+            self.assertEqual(fileSize, FILESIZE)
+            self.assertGreater(offset, 0)
+            self.assertLess(offset, FILESIZE)
+            with open("dest", 'rb') as dest:
+                self.assertEqual(dest.read(offset), self.data[:offset])
+
+            (request, received) = self.resume()
+
+        # Only the rest of the file is asked for, and sent
+        self.assertEqual(request[0], WireFormat.FRESUME[0])
+        self.assertLess(received, FILESIZE // 1024)
+        with open("dest", 'rb') as dest:
+            self.assertEqual(dest.read(), self.data)
+        self.assertFalse(os.path.exists(Journal("dest").path))
+    # End of testInterruptedDownloadResumes()
+
+    def testCompleteDownloadLeavesNoJournal(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            (request, received) = self.resume()
+        self.assertEqual(request[0], WireFormat.FNAME[0])
+        with open("dest", 'rb') as dest:
+            self.assertEqual(dest.read(), self.data)
+        self.assertFalse(os.path.exists(Journal("dest").path))
+    # End of testCompleteDownloadLeavesNoJournal()
+
+# End of ResumeTest class
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#
+# Tests the conditions packets meet going through one direction of the network
+# emulator.
+#
+
+import unittest
+
+import NetEmulator
+
+# The number of packets sent through a link to measure what happens to them
+NUMPACKETS = 50000
+
+# The packet sent through the links
+PACKET = bytes(range(100))
+
+class LinkTest(unittest.TestCase):
+    """
+    Tests the losses and the corruption of packets on a Link.
+    """
+
+    def send(self, link):
+        """
+        Sends NUMPACKETS packets through the link, and returns which of them
+        were dropped, as a list of booleans.
+        """
+        link.seed("test")
+        return [len(link.schedule(PACKET, 0.0)) == 0
+                for i in range(NUMPACKETS)]
+    # End of send()
+
+    def runs(self, dropped):
+        """
+        Returns the lengths of the runs of dropped packets.
+        """
+        runs = []
+        length = 0
+        for lost in dropped + [False]:
+            if lost:
+                length += 1
+            elif length > 0:
+                runs.append(length)
+                length = 0
+        return runs
+    # End of runs()
+
+    def testNoLoss(self):
+        self.assertFalse(any(self.send(NetEmulator.Link())))
+    # End of testNoLoss()
+
+    def testIndependentLoss(self):
+        for loss in (0.05, 0.3, 0.6):
+            dropped = self.send(NetEmulator.Link(loss=loss))
+            self.assertAlmostEqual(sum(dropped) / NUMPACKETS, loss, delta=0.01)
+            # Losses on their own come in runs of 1 / (1 - loss) on average
+            runs = self.runs(dropped)
+            self.assertAlmostEqual(sum(runs) / len(runs), 1 / (1 - loss),
+                                   delta=0.1)
+    # End of testIndependentLoss()
+
+    def testBurstLoss(self):
+        for (loss, burst) in ((0.05, 4), (0.3, 2), (0.6, 3)):
+            dropped = self.send(NetEmulator.Link(loss=loss, burst=burst))
+            self.assertAlmostEqual(sum(dropped) / NUMPACKETS, loss, delta=0.02)
+            runs = self.runs(dropped)
+            self.assertAlmostEqual(sum(runs) / len(runs), burst,
+                                   delta=0.15 * burst)
+    # End of testBurstLoss()
+
+    def testInvalidLossIsRejected(self):
+        for (loss, burst) in ((-0.1, 1), (1.5, 1), (0.1, 0.5), (0.7, 2)):
+            with self.assertRaises(ValueError):
+                NetEmulator.Link(loss=loss, burst=burst)
+        # Every packet is dropped, at any burst length
+        self.assertTrue(all(self.send(NetEmulator.Link(loss=1.0))))
+    # End of testInvalidLossIsRejected()
+
+    def testCorruptionFlipsOneBit(self):
+        link = NetEmulator.Link(corrupt=1.0)
+        link.seed("test")
+        for i in range(100):
+            [(time, packet)] = link.schedule(PACKET, 0.0)
+            flipped = sum(bin(a ^ b).count("1")
+                          for (a, b) in zip(packet, PACKET))
+            self.assertEqual(flipped, 1)
+        self.assertEqual(link.counts['corrupted'], 100)
+    # End of testCorruptionFlipsOneBit()
+
+# End of LinkTest class
+
+if __name__ == "__main__":
+    unittest.main()
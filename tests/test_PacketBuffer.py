@@ -0,0 +1,114 @@
+#
+# Tests the Bitset and the ring of slots the SlidingWindow keeps its packets
+# in. Run from the top of the repository with python -m pytest or
+# python -m unittest.
+#
+
+import unittest
+
+from PacketBuffer import Bitset, PacketBuffer
+
+class BitsetTest(unittest.TestCase):
+    """
+    Tests setting, clearing and converting the flags of a Bitset.
+    """
+
+    def testSetClearAndTest(self):
+        bits = Bitset(20)
+        for index in (0, 7, 8, 19):
+            bits.set(index)
+        self.assertEqual([i for i in range(20) if bits.test(i)],
+                         [0, 7, 8, 19])
+        bits.clear(8)
+        self.assertFalse(bits.test(8))
+        self.assertTrue(bits.test(7))
+    # End of testSetClearAndTest()
+
+    def testIntRoundTrip(self):
+        bits = Bitset(20)
+        bits.fromInt(0b1010000000000000101)
+        self.assertEqual(bits.toInt(), 0b1010000000000000101)
+        self.assertTrue(bits.test(0))
+        self.assertTrue(bits.test(18))
+        bits.clearAll()
+        self.assertEqual(bits.toInt(), 0)
+    # End of testIntRoundTrip()
+
+# End of BitsetTest class
+
+class PacketBufferTest(unittest.TestCase):
+    """
+    Tests that slots are counted from the head of the ring, however far it
+    has advanced.
+    """
+
+    def testStoreAndAdvance(self):
+        buffer = PacketBuffer(4, 8)
+        for slot in range(4):
+            buffer.store(slot, bytes([slot]) * (slot + 1))
+        buffer.advance()
+        self.assertEqual(bytes(buffer.packet(0)), b'\x01\x01')
+        self.assertEqual(buffer.length(3), 0)
+        buffer.store(3, b'new')
+        self.assertEqual(bytes(buffer.packet(3)), b'new')
+        # The last slot of the ring is the first slot of the buffer
+        self.assertEqual(bytes(buffer.buffer[:3]), b'new')
+    # End of testStoreAndAdvance()
+
+    def testAdvanceClearsTheSlot(self):
+        buffer = PacketBuffer(3, 4)
+        buffer.store(0, b'ab')
+        buffer.mark(0)
+        buffer.recordSend(0, 1.5)
+        buffer.advance()
+        self.assertFalse(buffer.isMarked(2))
+        self.assertEqual(buffer.sendCount(2), 0)
+        self.assertEqual(buffer.sentTime(2), 0.0)
+    # End of testAdvanceClearsTheSlot()
+
+    def testHeadWrapsAround(self):
+        buffer = PacketBuffer(3, 4)
+        for i in range(7):
+            buffer.advance()
+        self.assertEqual(buffer.head, 1)
+        buffer.store(2, b'x')
+        self.assertEqual(bytes(buffer.buffer[0:1]), b'x')
+    # End of testHeadWrapsAround()
+
+    def testMarkedBitsAcrossTheEnd(self):
+        buffer = PacketBuffer(8, 1)
+        for i in range(5):
+            buffer.advance()
+        # Slots 1 and 4 from the head are physical slots 6 and 1
+        buffer.mark(1)
+        buffer.mark(4)
+        self.assertEqual(buffer.markedBits(), 0b10010)
+        self.assertTrue(buffer.marks.test(6))
+        self.assertTrue(buffer.marks.test(1))
+    # End of testMarkedBitsAcrossTheEnd()
+
+    def testMarkBitsAcrossTheEnd(self):
+        buffer = PacketBuffer(8, 1)
+        for i in range(6):
+            buffer.advance()
+        buffer.markBits(0b1000101)
+        self.assertEqual([slot for slot in range(8) if buffer.isMarked(slot)],
+                         [0, 2, 6])
+        self.assertEqual(buffer.markedBits(), 0b1000101)
+        # Bits past the end of the ring are ignored
+        buffer.markBits(1 << 8)
+        self.assertEqual(buffer.markedBits(), 0b1000101)
+    # End of testMarkBitsAcrossTheEnd()
+
+    def testRecordSend(self):
+        buffer = PacketBuffer(2, 4)
+        self.assertEqual(buffer.recordSend(1, 2.0), 1)
+        self.assertEqual(buffer.recordSend(1, 3.0), 2)
+        self.assertEqual(buffer.sentTime(1), 3.0)
+        self.assertEqual(buffer.sendCount(0), 0)
+    # End of testRecordSend()
+
+# End of PacketBufferTest class
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#
+# Tests keeping files and prepared packet data in memory between transfers,
+# and evicting them.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import PacketCache as cache
+
+# The number of bytes of each packet cached
+DATASIZE = 100
+
+# The number of bytes each cached packet is counted as
+ENTRYSIZE = DATASIZE + cache.ENTRYOVERHEAD
+
+class PacketEvictionTest(unittest.TestCase):
+    """
+    Tests evicting packet data once it takes up more than the budget.
+    """
+
+    def setUp(self):
+        self.cache = cache.PacketCache(budget=3 * ENTRYSIZE)
+    # End of setUp()
+
+    def tearDown(self):
+        self.cache.close()
+    # End of tearDown()
+
+    def testLookup(self):
+        self.assertIs(self.cache.lookup(("file", 0)), cache.MISSING)
+        self.cache.store(("file", 0), bytes(DATASIZE))
+        self.cache.store(("file", 1), None)
+        self.assertEqual(self.cache.lookup(("file", 0)), bytes(DATASIZE))
+        self.assertIsNone(self.cache.lookup(("file", 1)))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+    # End of testLookup()
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        for i in range(3):
+            self.cache.store(("file", i), bytes(DATASIZE))
+        # Packet 0 is used again, so packet 1 is the one evicted
+        self.cache.lookup(("file", 0))
+        self.cache.store(("file", 3), bytes(DATASIZE))
+        self.assertIs(self.cache.lookup(("file", 1)), cache.MISSING)
+        for i in (0, 2, 3):
+            self.assertIsNot(self.cache.lookup(("file", i)), cache.MISSING)
+        self.assertEqual(self.cache.used, 3 * ENTRYSIZE)
+    # End of testLeastRecentlyUsedIsEvicted()
+
+    def testStoringTwiceCountsOnce(self):
+        self.cache.store(("file", 0), bytes(DATASIZE))
+        self.cache.store(("file", 0), bytes(DATASIZE))
+        self.assertEqual(self.cache.used, ENTRYSIZE)
+    # End of testStoringTwiceCountsOnce()
+
+    def testOversizedPacketIsNotKept(self):
+        self.cache.store(("file", 0), bytes(4 * ENTRYSIZE))
+        self.assertIs(self.cache.lookup(("file", 0)), cache.MISSING)
+        self.assertEqual(self.cache.used, 0)
+    # End of testOversizedPacketIsNotKept()
+
+# End of PacketEvictionTest class
+
+class FileEvictionTest(unittest.TestCase):
+    """
+    Tests keeping files open while they are used, and closing them once they
+    fall out of use.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.PacketCache(maxFiles=2)
+    # End of setUp()
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def path(self, name, data=b"data"):
+        """
+        Writes a file into the temporary directory and returns its path.
+        """
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+    # End of path()
+
+    def testFileIsShared(self):
+        path = self.path("a")
+        first = self.cache.openFile(path)
+        second = self.cache.openFile(path)
+        self.assertIs(first, second)
+        self.assertEqual(bytes(first.view), b"data")
+        self.cache.closeFile(first)
+        self.cache.closeFile(second)
+        # Kept open for the next transfer
+        self.assertIs(self.cache.openFile(path), first)
+        self.cache.closeFile(first)
+    # End of testFileIsShared()
+
+    def testIdleFilesAreEvicted(self):
+        paths = [self.path(name) for name in "abc"]
+        mapped = [self.cache.openFile(path) for path in paths]
+        # Every file is in use, so none is closed
+        self.assertEqual(len(self.cache.files), 3)
+        for m in mapped:
+            self.cache.closeFile(m)
+        self.assertEqual(len(self.cache.files), 2)
+        self.assertTrue(mapped[0].file.closed)
+        self.assertFalse(mapped[2].file.closed)
+    # End of testIdleFilesAreEvicted()
+
+    def testChangedFileIsReopened(self):
+        path = self.path("a")
+        old = self.cache.openFile(path)
+        self.path("a", b"new data")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        new = self.cache.openFile(path)
+        self.assertIsNot(old, new)
+        self.assertEqual(bytes(new.view), b"new data")
+        # The old version stays open until its transfer is over
+        self.assertFalse(old.file.closed)
+        self.cache.closeFile(old)
+        self.assertTrue(old.file.closed)
+        self.cache.closeFile(new)
+        self.assertFalse(new.file.closed)
+    # End of testChangedFileIsReopened()
+
+    def testEmptyFile(self):
+        mapped = self.cache.openFile(self.path("empty", b""))
+        self.assertEqual(mapped.size, 0)
+        self.assertIsNone(mapped.view)
+        self.cache.closeFile(mapped)
+    # End of testEmptyFile()
+
+# End of FileEvictionTest class
+
+if __name__ == "__main__":
+    unittest.main()
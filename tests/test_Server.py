@@ -0,0 +1,46 @@
+#
+# Tests splitting a file into the parts downloaded by parallel sessions.
+#
+
+import unittest
+
+import Server
+
+class PartRangeTest(unittest.TestCase):
+    """
+    Tests that the parts of a file cover every byte exactly once.
+    """
+
+    def testPartsAreContiguousAndCoverTheFile(self):
+        for fileSize in (0, 1, 7, 1000, 1001, 2 ** 33 + 5):
+            for parts in (1, 2, 3, 4, 8):
+                end = 0
+                for part in range(parts):
+                    (start, stop) = Server.partRange(fileSize, part, parts)
+                    self.assertEqual(start, end)
+                    self.assertLessEqual(start, stop)
+                    end = stop
+                self.assertEqual(end, fileSize)
+    # End of testPartsAreContiguousAndCoverTheFile()
+
+    def testPartsAreBalanced(self):
+        sizes = [stop - start for (start, stop) in
+                 (Server.partRange(1001, part, 4) for part in range(4))]
+        self.assertEqual(sum(sizes), 1001)
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+    # End of testPartsAreBalanced()
+
+    def testSinglePartIsTheWholeFile(self):
+        self.assertEqual(Server.partRange(12345, 0, 1), (0, 12345))
+    # End of testSinglePartIsTheWholeFile()
+
+    def testMorePartsThanBytes(self):
+        ranges = [Server.partRange(2, part, 4) for part in range(4)]
+        self.assertEqual(sum(stop - start for (start, stop) in ranges), 2)
+        self.assertIn((0, 0), ranges)
+    # End of testMorePartsThanBytes()
+
+# End of PartRangeTest class
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+#
+# Tests acknowledging packets of a sliding window with a cumulative index and
+# a bitmap of the packets received after it, and resending only the packets
+# whose own timers expired.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import SlidingWindow as window
+import WireFormat
+
+# The size of the packets of the windows tested, their tags, and the number of
+# packets the file sent fills
+PACKETSIZE = 64
+TAGSIZE = 4
+NUMPACKETS = 20
+
+class WindowTest(unittest.TestCase):
+    """
+    Sets up a Server's window over a file of NUMPACKETS packets.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wireFormat = WireFormat.FORMATS[WireFormat.VERSION]
+        self.dataSize = PACKETSIZE - self.wireFormat.headerSize - TAGSIZE
+        self.source = os.path.join(self.directory, "source")
+        with open(self.source, 'wb') as source:
+            source.write(os.urandom(self.dataSize * NUMPACKETS - 3))
+        self.fileSize = os.path.getsize(self.source)
+        self.server = self.window('Server', self.source)
+    # End of setUp()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def window(self, mode, path, fileSize=None):
+        """
+        Returns a window of 8 packets over the file at the given path.
+        """
+        return window.SlidingWindow(
+            path, packetSize=PACKETSIZE, mode=mode, fileSize=fileSize,
+            windowSize=8, tagSize=TAGSIZE, wireFormat=self.wireFormat)
+    # End of window()
+
+    def index(self, packet):
+        """
+        Returns the index of the first byte of the file held by packet i.
+        """
+        return packet * self.dataSize
+    # End of index()
+
+# End of WindowTest class
+
+class SelectiveAcknowledgementTest(WindowTest):
+    """
+    Tests markSelective() on the Server's window, fed by the acknowledgement
+    state of the Client's window.
+    """
+
+    def testCumulativeOnly(self):
+        newlyMarked = self.server.markSelective(self.index(3), 0)
+        self.assertEqual(newlyMarked, [self.index(i) for i in range(3)])
+        self.server.slideServer()
+        self.assertEqual(self.server.start, self.index(3))
+    # End of testCumulativeOnly()
+
+    def testBitmapAfterCumulative(self):
+        newlyMarked = self.server.markSelective(self.index(1), 0b101)
+        self.assertEqual(newlyMarked,
+                         [self.index(0), self.index(1), self.index(3)])
+        self.server.slideServer()
+        self.assertEqual(self.server.start, self.index(2))
+        self.assertTrue(self.server.isMarked(self.index(3)))
+        self.assertFalse(self.server.isMarked(self.index(4)))
+    # End of testBitmapAfterCumulative()
+
+    def testRepeatedAcknowledgementMarksNothingNew(self):
+        self.server.markSelective(self.index(0), 0b110)
+        self.assertEqual(self.server.markSelective(self.index(0), 0b110), [])
+        self.assertEqual(self.server.markSelective(self.index(0), 0b111),
+                         [self.index(0)])
+    # End of testRepeatedAcknowledgementMarksNothingNew()
+
+    def testStaleCumulativeIsShiftedDown(self):
+        self.server.markSelective(self.index(2), 0)
+        self.server.slideServer()
+        # Acknowledges packets 0 to 1, and 4 and 5 past an older cumulative
+        newlyMarked = self.server.markSelective(self.index(1), 0b11001)
+        self.assertEqual(newlyMarked, [self.index(4), self.index(5)])
+    # End of testStaleCumulativeIsShiftedDown()
+
+    def testBitsPastTheEndOfTheFileAreIgnored(self):
+        for cumulative in (8, 16):
+            self.server.markSelective(self.index(cumulative), 0)
+            self.server.slideServer()
+        newlyMarked = self.server.markSelective(self.index(16), 0xff)
+        self.assertEqual(newlyMarked,
+                         [self.index(i) for i in range(16, NUMPACKETS)])
+        self.server.slideServer()
+        self.assertTrue(self.server.isDone())
+    # End of testBitsPastTheEndOfTheFileAreIgnored()
+
+    def testClientStateAcknowledgesWhatWasSaved(self):
+        client = self.window('Client', os.path.join(self.directory, "dest"),
+                             self.fileSize)
+        try:
+            packets = dict((index, bytes(packet)) for (index, packet) in
+                           self.server.getDuePackets(1.0))
+            # Packets 0, 1, 3 and 6 arrive, 2 is lost
+            for i in (6, 0, 3, 1):
+                client.saveBytes(packets[self.index(i)])
+            (cumulative, bitmap) = client.getAckState()
+            self.assertEqual(cumulative, self.index(2))
+            self.assertEqual(bitmap, 0b10010)
+            newlyMarked = self.server.markSelective(cumulative, bitmap)
+            self.assertEqual(newlyMarked, [self.index(i)
+                                           for i in (0, 1, 3, 6)])
+        finally:
+            client.close()
+    # End of testClientStateAcknowledgesWhatWasSaved()
+
+# End of SelectiveAcknowledgementTest class
+
+class SelectiveRepeatTest(WindowTest):
+    """
+    Tests that each packet has a timer of its own, and that only the packets
+    that are not acknowledged and whose timers expired are due again. The
+    time is passed in, so the clock is under the test's control.
+    """
+
+    # The number of seconds after which a packet is sent again
+    TIMEOUT = 1.0
+
+    def due(self, now, limit=None):
+        """
+        Returns the indexes of the packets due at the given time.
+        """
+        return [index for (index, packet) in
+                self.server.getDuePackets(self.TIMEOUT, limit, now)]
+    # End of due()
+
+    def send(self, now, limit=None):
+        """
+        Sends every packet due at the given time, and returns their indexes.
+        """
+        indexes = self.due(now, limit)
+        for index in indexes:
+            self.server.recordSend(index, now)
+        return indexes
+    # End of send()
+
+    def testUnsentPacketsAreDue(self):
+        self.assertEqual(self.send(0.0, limit=4),
+                         [self.index(i) for i in range(4)])
+        self.assertEqual(self.due(0.5, limit=4), [])
+        # The congestion window opened up
+        self.assertEqual(self.due(0.5), [self.index(i) for i in range(4, 8)])
+    # End of testUnsentPacketsAreDue()
+
+    def testOnlyExpiredPacketsAreResent(self):
+        self.send(0.0, limit=2)
+        self.send(0.5, limit=4)
+        self.assertEqual(self.server.nextExpiry(self.TIMEOUT, 4), 1.0)
+        self.assertEqual(self.due(0.99, limit=4), [])
+        self.assertEqual(self.due(1.0, limit=4),
+                         [self.index(0), self.index(1)])
+        self.assertEqual(self.due(1.5, limit=4),
+                         [self.index(i) for i in range(4)])
+    # End of testOnlyExpiredPacketsAreResent()
+
+    def testDueWhenTimerExpires(self):
+        # 0.1 + 0.15000000000000002 is 0.25, but 0.25 - 0.1 is less than the
+        # timeout, so the packet must be compared the same way as its expiry
+        timeout = 0.15000000000000002
+        self.server.recordSend(self.index(0), 0.1)
+        expiry = self.server.nextExpiry(timeout, 1)
+        self.assertEqual(
+            self.server.getDuePackets(timeout, 1, expiry)[0][0], 0)
+    # End of testDueWhenTimerExpires()
+
+    def testAcknowledgedPacketsAreNotResent(self):
+        self.send(0.0, limit=4)
+        # Packets 0 and 2 arrive, 1 and 3 are lost
+        self.server.markSelective(self.index(1), 0b10)
+        self.assertEqual(self.due(1.0, limit=4),
+                         [self.index(1), self.index(3)])
+        self.server.slideServer()
+        self.assertEqual(self.server.start, self.index(1))
+        self.assertEqual(self.send(1.0, limit=3),
+                         [self.index(1), self.index(3)])
+        self.assertEqual(self.server.sendCount(self.index(1)), 2)
+        self.assertEqual(self.server.sendCount(self.index(2)), 1)
+        # The resent packets have new timers
+        self.assertEqual(self.server.nextExpiry(self.TIMEOUT, 3), 2.0)
+        self.assertEqual(self.due(1.5, limit=3), [])
+    # End of testAcknowledgedPacketsAreNotResent()
+
+    def testNothingInFlight(self):
+        self.assertIsNone(self.server.nextExpiry(self.TIMEOUT))
+        self.send(0.0)
+        self.server.markSelective(self.index(8), 0)
+        self.assertIsNone(self.server.nextExpiry(self.TIMEOUT))
+    # End of testNothingInFlight()
+
+# End of SelectiveRepeatTest class
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+#
+# Tests whole downloads from a Server through the network emulator, with
+# packets corrupted, lost and reordered on the way.
+#
+
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import Client
+import Compression
+import NetEmulator
+import Server
+
+# The size of the file downloaded, a few hundred packets
+FILESIZE = 300 * 1024
+
+# The number of seconds a download is given before the test fails
+TIMEOUT = 60
+
+class TransferTest(unittest.TestCase):
+    """
+    Tests that the file saved by the Client matches the Server's copy, however
+    the packets between them are mangled. The Server looks for files in the
+    files directory under the working directory, so each test runs in a
+    temporary directory of its own.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.mkdir("files")
+        # Half of the file compresses, half does not
+        self.data = os.urandom(FILESIZE // 2) + bytes(FILESIZE // 2)
+        with open(os.path.join("files", "source"), 'wb') as source:
+            source.write(self.data)
+    # End of setUp()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+    # End of tearDown()
+
+    def download(self, upstream, downstream, seed, **options):
+        """
+        Downloads the file through an emulator with the given links, and
+        returns the Server once the download is over.
+        """
+        return asyncio.run(self._download(upstream, downstream, seed,
+                                          options))
+    # End of download()
+
+    async def _download(self, upstream, downstream, seed, options):
+        """
+        Runs the Server, the emulator and the Client on one event loop.
+
+        NOTE: This method is NOT meant to be called from outside this class
+        i.e. it is meant to be treated as a private method.
+        """
+        # Every component reports what it does on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = Server.Server('127.0.0.1', 0)
+            await server.start()
+            port = server.transport.get_extra_info('sockname')[1]
+            emulator = NetEmulator.NetEmulator(
+                '127.0.0.1', 0, '127.0.0.1', port, upstream, downstream,
+                seed=seed)
+            try:
+                await emulator.start()
+                fileSize = await asyncio.wait_for(Client.download(
+                    '127.0.0.1', emulator.port, "source", "dest",
+                    packetSize=1024, **options), TIMEOUT)
+            finally:
+                emulator.close()
+                server.close()
+        self.assertEqual(fileSize, FILESIZE)
+        with open("dest", 'rb') as dest:
+            self.assertEqual(dest.read(), self.data)
+        return server
+    # End of _download()
+
+    def testCorruption(self):
+        corrupted = {'upstream': 0, 'downstream': 0}
+        for seed in range(8):
+            # Few packets go upstream, so more of them are corrupted
+            upstream = NetEmulator.Link(corrupt=0.1)
+            downstream = NetEmulator.Link(corrupt=0.05)
+            server = self.download(upstream, downstream, seed)
+            # Corrupted requests are dropped instead of ending the transfer
+            self.assertEqual(len(server.sessions), 0)
+            corrupted['upstream'] += upstream.counts['corrupted']
+            corrupted['downstream'] += downstream.counts['corrupted']
+            os.remove("dest")
+        self.assertGreater(corrupted['upstream'], 0)
+        self.assertGreater(corrupted['downstream'], 0)
+    # End of testCorruption()
+
+    def testLossReorderingAndCorruption(self):
+        upstream = NetEmulator.Link(loss=0.02, corrupt=0.02)
+        downstream = NetEmulator.Link(loss=0.05, burst=2, corrupt=0.02,
+                                      latency=0.002, jitter=0.001,
+                                      reorder=0.05, duplicate=0.01)
+        self.download(upstream, downstream, 7,
+                      compression=Compression.ZLIB, fecGroup=8)
+    # End of testLossReorderingAndCorruption()
+
+    def testDuplicatedRequests(self):
+        for seed in range(6):
+            # Every request reaches the Server twice, often after the ready
+            # acknowledgement that answers it
+            upstream = NetEmulator.Link(duplicate=1.0, reorder=0.5)
+            server = self.download(upstream, NetEmulator.Link(), seed)
+            # A copy of the request does not restart the transfer
+            self.assertEqual(server.metrics.counters['sessionsStarted'], 1)
+            os.remove("dest")
+    # End of testDuplicatedRequests()
+
+# End of TransferTest class
+
+if __name__ == "__main__":
+    unittest.main()
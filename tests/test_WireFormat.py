@@ -0,0 +1,75 @@
+#
+# Tests packing and unpacking the headers of file packets and
+# acknowledgements, and the negotiation of their version.
+#
+
+import struct
+import unittest
+
+import WireFormat
+
+# The code of file packets, as an int
+FPACKET = WireFormat.FPACKET[0]
+
+class HeaderTest(unittest.TestCase):
+    """
+    Tests that every version of the header unpacks what it packed.
+    """
+
+    def testBinaryRoundTrip(self):
+        wireFormat = WireFormat.FORMATS[WireFormat.BINARY]
+        for (sessionId, offset, length) in [(0, 0, 0), (7, 1400, 1372),
+                                            (2 ** 32 - 1, 2 ** 64 - 1,
+                                             2 ** 16 - 1)]:
+            packet = bytearray(wireFormat.headerSize + 4)
+            wireFormat.pack(packet, FPACKET, sessionId, offset, length)
+            self.assertEqual(wireFormat.unpack(packet),
+                             (FPACKET, sessionId, offset, length))
+            self.assertEqual(packet[1], WireFormat.BINARY)
+    # End of testBinaryRoundTrip()
+
+    def testLegacyRoundTrip(self):
+        wireFormat = WireFormat.FORMATS[WireFormat.LEGACY]
+        packet = bytearray(wireFormat.headerSize + 56)
+        wireFormat.pack(packet, FPACKET, 9, 2 ** 40 + 3, 100)
+        self.assertEqual(wireFormat.unpack(packet),
+                         (FPACKET, 0, 2 ** 40 + 3, None))
+        self.assertEqual(packet[0:1], WireFormat.FPACKET)
+    # End of testLegacyRoundTrip()
+
+    def testPackingLeavesTheRestOfThePacket(self):
+        for wireFormat in WireFormat.FORMATS.values():
+            packet = bytearray(b"\xaa" * (wireFormat.headerSize + 8))
+            wireFormat.pack(packet, FPACKET, 1, 2, 3)
+            self.assertEqual(packet[wireFormat.headerSize:], b"\xaa" * 8)
+    # End of testPackingLeavesTheRestOfThePacket()
+
+    def testOversizedFieldsAreRejected(self):
+        wireFormat = WireFormat.FORMATS[WireFormat.BINARY]
+        packet = bytearray(wireFormat.headerSize)
+        with self.assertRaises(struct.error):
+            wireFormat.pack(packet, FPACKET, 0, 2 ** 64, 0)
+        with self.assertRaises(struct.error):
+            wireFormat.pack(packet, FPACKET, 0, 0, 2 ** 16)
+    # End of testOversizedFieldsAreRejected()
+
+# End of HeaderTest class
+
+class VersionTest(unittest.TestCase):
+    """
+    Tests choosing the version of the header for a transfer.
+    """
+
+    def testChoose(self):
+        self.assertIs(WireFormat.choose(0),
+                      WireFormat.FORMATS[WireFormat.LEGACY])
+        self.assertIs(WireFormat.choose(WireFormat.BINARY),
+                      WireFormat.FORMATS[WireFormat.BINARY])
+        self.assertIs(WireFormat.choose(WireFormat.VERSION + 10),
+                      WireFormat.FORMATS[WireFormat.VERSION])
+    # End of testChoose()
+
+# End of VersionTest class
+
+if __name__ == "__main__":
+    unittest.main()